@@ -0,0 +1,134 @@
+'''
+time the PublishableManager filters against a large table and show the
+query plan the database picks for each of them.
+
+    python benchmarks/q_filters.py [--rows 1000000] [--repeat 5]
+
+by default this uses (and keeps, so later runs needn't fill it again) a
+sqlite database in benchmark.db.  use --engine, --name etc. to run it
+against another database.
+'''
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def configure(options):
+    from django.conf import settings
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.' + options.engine,
+                'NAME': options.name,
+                'USER': options.user,
+                'PASSWORD': options.password,
+                'HOST': options.host,
+            }
+        },
+        INSTALLED_APPS=(
+            'django.contrib.contenttypes',
+            'django.contrib.admin',
+            'django.contrib.auth',
+            'django.contrib.messages',
+            'publish',
+            'publish.tests.example_app',
+        ),
+    )
+
+
+def fill(model, rows):
+    '''
+    half the rows are public, the other half drafts - 1 in 20 of them
+    changed and 1 in 100 marked for deletion
+    '''
+    from publish.models import Publishable
+    from publish.utils import chunked
+
+    if model._base_manager.count() == rows:
+        return
+    model._base_manager.all().delete()
+
+    def make(i):
+        if i % 2:
+            return model(name='public %d' % i, is_public=True)
+        state = Publishable.PUBLISH_DEFAULT
+        if i % 40 == 0:
+            state = Publishable.PUBLISH_CHANGED
+        elif i % 200 == 2:
+            state = Publishable.PUBLISH_DELETE
+        return model(name='draft %d' % i, publish_state=state)
+
+    for chunk in chunked(xrange(rows), 10000):
+        model._base_manager.bulk_create([make(i) for i in chunk])
+
+
+def explain(queryset):
+    from django.db import connection
+    sql, params = queryset.query.sql_with_params()
+    if connection.vendor == 'sqlite':
+        sql = 'EXPLAIN QUERY PLAN ' + sql
+    else:
+        sql = 'EXPLAIN ' + sql
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return [' '.join(unicode(column) for column in row)
+            for row in cursor.fetchall()]
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--rows', type='int', default=1000000)
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--engine', default='sqlite3')
+    parser.add_option('--name', default='benchmark.db')
+    parser.add_option('--user', default='')
+    parser.add_option('--password', default='')
+    parser.add_option('--host', default='')
+    options, args = parser.parse_args()
+
+    configure(options)
+    # creates the tables
+    from publish.tests.example_app.models import Author
+    from publish.models import Publishable
+    from django.db import connection
+    from django.db.models import Q
+
+    fill(Author, options.rows)
+    if connection.vendor in ('sqlite', 'postgresql'):
+        connection.cursor().execute('ANALYZE')
+
+    querysets = [
+        ('draft()', Author.objects.draft()),
+        ('changed()', Author.objects.changed()),
+        ('deleted()', Author.objects.deleted()),
+        ('published()', Author.objects.published()),
+        ('draft_and_deleted()', Author.objects.draft_and_deleted()),
+        # the negated filter draft() used to use, for comparison
+        ('draft() (negated)', Author.objects.filter(
+            Q(is_public=False) &
+            ~Q(publish_state=Publishable.PUBLISH_DELETE))),
+    ]
+    print '%d rows, best of %d' % (options.rows, options.repeat)
+    for name, queryset in querysets:
+        count = queryset.count()
+        seconds = best_time(queryset.count, options.repeat)
+        print
+        print '%-22s %8d rows  %8.2fms' % (name, count, seconds * 1000)
+        for line in explain(queryset.values('pk')):
+            print '    ' + line
+
+
+if __name__ == '__main__':
+    main()
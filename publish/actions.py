@@ -1,6 +1,7 @@
 from django import template
 from django.core.exceptions import PermissionDenied
 from django.contrib.admin import helpers
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.admin.util import quote, model_ngettext
 from django.shortcuts import render_to_response
 from django.utils.encoding import force_unicode
@@ -11,8 +12,7 @@ from django.utils.translation import ugettext as _
 from django.contrib.admin.actions import delete_selected as \
     django_delete_selected
 
-from models import Publishable
-from utils import NestedSet
+from models import Publishable, PublishJob, PublishHistory
 
 
 def _get_change_view_url(app_label, object_name, pk, levels_to_root):
@@ -45,6 +45,46 @@ undelete_selected.short_description = \
     "Un-mark %(verbose_name_plural)s for deletion"
 
 
+def rollback_selected(modeladmin, request, queryset):
+    if not modeladmin.has_publish_permission(request):
+        raise PermissionDenied
+    n = PublishHistory.objects.rollback(
+        model=modeladmin.model,
+        object_ids=list(queryset.values_list('pk', flat=True)))
+    modeladmin.message_user(request, _("Rolled back %(count)d %(items)s.") % {
+        "count": n, "items": model_ngettext(modeladmin.opts, n)})
+    return None
+
+
+rollback_selected.short_description = \
+    "Roll back the last publish of selected %(verbose_name_plural)s"
+
+
+def rollback_selected_runs(modeladmin, request, queryset):
+    if not modeladmin.has_publish_permission(request):
+        raise PermissionDenied
+    content_type = ContentType.objects.get_for_model(modeladmin.model)
+    runs = []
+    for pk in queryset.values_list('pk', flat=True):
+        latest = PublishHistory.objects.filter(
+            content_type=content_type, object_id=force_unicode(pk)) \
+            .order_by('-pk').values_list('run', flat=True)[:1]
+        if latest and latest[0] not in runs:
+            runs.append(latest[0])
+    n = 0
+    for run in runs:
+        # rolling back a run also undoes later runs of the same objects,
+        # so there may be nothing left of a run by the time we get to it
+        n += PublishHistory.objects.rollback(run)
+    modeladmin.message_user(request, _("Rolled back %(count)d objects.") % {
+        "count": n})
+    return None
+
+
+rollback_selected_runs.short_description = \
+    "Roll back the whole last publish of selected %(verbose_name_plural)s"
+
+
 def _get_publishable_html(admin_site, levels_to_root, value):
     model = value.__class__
     model_name = escape(capfirst(model._meta.verbose_name))
@@ -106,9 +146,9 @@ def publish_selected(modeladmin, request, queryset):
     opts = modeladmin.model._meta
     app_label = opts.app_label
 
-    all_published = NestedSet()
-    for obj in queryset:
-        obj.publish(dry_run=True, all_published=all_published)
+    # work out everything that would get published once, so
+    # we can both show it and then publish it without doing it all again
+    all_published = queryset.publish(dry_run=True)
 
     perms_needed = []
     _check_permissions(modeladmin, all_published, request, perms_needed)
@@ -118,12 +158,19 @@ def publish_selected(modeladmin, request, queryset):
 
         n = queryset.count()
         if n:
-            for object in all_published:
-                modeladmin.log_publication(request, object)
-
-            queryset.publish()
-
-            message = _("Successfully published %(count)d %(items)s.") % {
+            if modeladmin.publish_in_background:
+                # the permissions have been checked for everything that
+                # gets published, the publish itself is left to the worker
+                PublishJob.objects.enqueue(queryset, user=request.user)
+                message = _("Queued %(count)d %(items)s for publishing.")
+            else:
+                for object in all_published:
+                    modeladmin.log_publication(request, object)
+
+                all_published.execute()
+                message = _("Successfully published %(count)d %(items)s.")
+
+            message = message % {
                 "count": n,
                 "items": model_ngettext(modeladmin.opts, n)
             }
@@ -7,11 +7,12 @@ from django.http import HttpResponseRedirect
 from django.utils.encoding import force_unicode, force_text
 from django.utils.translation import ugettext as _
 
-from .models import Publishable
-from .actions import publish_selected, delete_selected, undelete_selected
+from .models import Publishable, PublishJob
+from .actions import publish_selected, delete_selected, undelete_selected, \
+    rollback_selected, rollback_selected_runs
 
 from publish.filters import register_filters
-from publish.utils import NestedSet
+from publish.utils import PublishGraph
 
 register_filters()
 
@@ -64,10 +65,14 @@ def attach_filtered_formfields(admin_class):
 
 
 class PublishableAdmin(admin.ModelAdmin):
-    actions = [publish_selected, delete_selected, undelete_selected]
+    actions = [publish_selected, delete_selected, undelete_selected,
+               rollback_selected, rollback_selected_runs]
     change_form_template = 'admin/publish_change_form.html'
     publish_confirmation_template = None
     deleted_form_template = None
+    # queue publishes up for the publish_worker command, rather
+    # than publishing during the request
+    publish_in_background = False
 
     list_display = ['__unicode__', 'publish_state']
     list_filter = ['publish_state']
@@ -85,6 +90,10 @@ class PublishableAdmin(admin.ModelAdmin):
         if 'delete_selected' in actions:
             actions['delete_selected'] = (delete_selected, 'delete_selected',
                                           delete_selected.short_description)
+        # rolling back needs the publish history
+        if not self.model.PublishMeta.publish_history:
+            actions.pop('rollback_selected', None)
+            actions.pop('rollback_selected_runs', None)
         return actions
 
     def has_change_permission(self, request, obj=None):
@@ -153,7 +162,12 @@ class PublishableAdmin(admin.ModelAdmin):
         msg_dict = {'name': force_text(opts.verbose_name),
                     'obj': force_text(obj)}
 
-        msg = _('The %(name)s "%(obj)s" was published successfully') % msg_dict
+        if self.publish_in_background:
+            msg = _('The %(name)s "%(obj)s" will be published shortly') % \
+                msg_dict
+        else:
+            msg = _('The %(name)s "%(obj)s" was published successfully') % \
+                msg_dict
 
         messages.success(request, msg, fail_silently=True)
         return HttpResponseRedirect(request.path)
@@ -163,9 +177,12 @@ class PublishableAdmin(admin.ModelAdmin):
         if request.method == "POST" and "_publish" in request.POST:
             obj = self.get_object(request, unquote(object_id))
 
-            all_published = NestedSet()
-            obj.publish(all_published=all_published)
-            self.log_publication(request, obj)
+            if self.publish_in_background:
+                PublishJob.objects.enqueue(obj, user=request.user)
+            else:
+                all_published = PublishGraph()
+                obj.publish(all_published=all_published)
+                self.log_publication(request, obj)
 
             return self.response_publish(request, obj)
         return super(PublishableAdmin, self).change_view(request, object_id,
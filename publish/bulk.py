@@ -0,0 +1,562 @@
+from django.db.models.fields.related import RelatedField
+
+from models import Publishable, PublishException, PublishFieldPlan, \
+    _count_publish_states, _group_by_model, _public_field, _publish_run, \
+    _send_batch, _sync_through_rows, _through_columns
+from signals import pre_publish, post_publish, pre_publish_batch, \
+    post_publish_batch, send_publish_signal, has_listeners
+from utils import PublishGraph, bulk_update, chunked, CHUNK_SIZE
+
+
+def _key(obj):
+    return (obj.__class__, obj.pk)
+
+
+def _copy_fields(model):
+    return model.publish_field_plan().fields
+
+
+def _synced_many_to_many(model):
+    # m2m with a custom "through" model can't be synced directly
+    return [field for field, _ in model.publish_field_plan().many_to_many
+            if field.rel.through._meta.auto_created]
+
+
+def _fingerprint_fields(model):
+    if model.publish_field_plan().fingerprinted:
+        return [model._meta.get_field('publish_fingerprint')]
+    return []
+
+
+def _load_pairs(field, ids):
+    through, source, target = _through_columns(field)
+    pairs = []
+    for chunk in chunked(ids, CHUNK_SIZE):
+        pairs.extend(through._base_manager.filter(**{source + '__in': chunk})
+                     .values_list(source, target))
+    return pairs
+
+
+def _send_each(signal, nodes, deleted):
+    for node in nodes:
+        if has_listeners(signal, node.__class__):
+            send_publish_signal(signal, node.__class__, instance=node,
+                                deleted=deleted)
+
+
+class PublishPlan(object):
+    '''
+    everything a publish would do, as worked out by a dry run publish:
+    the draft objects in the order they would be published, the foreign
+    key, many-to-many and reverse edges between them and the field values
+    that will be copied over to the public versions.
+
+    execute() applies the plan, after checking that none of the drafts
+    have changed in the meantime.  the publish is done object by object,
+    as publish() would, reusing the related objects the dry run loaded,
+    or model by model (see BulkPublisher) if the plan is for a bulk publish.
+    '''
+
+    def __init__(self, all_published, batch_size=None, bulk=False,
+                 roots=()):
+        self.all_published = all_published
+        self.batch_size = batch_size
+        self.bulk = bulk
+        self.roots = list(roots)
+        self.executed = False
+        # only objects added after this point are part of the plan
+        self._start = len(all_published)
+        self._nodes = None
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, item):
+        return item in self.all_published
+
+    def nested_items(self):
+        return self.all_published.nested_items()
+
+    @property
+    def nodes(self):
+        self._resolve()
+        return self._nodes
+
+    def _resolve(self):
+        if self._nodes is not None:
+            return
+        nodes = self.all_published.ordered_items(since=self._start)
+        keys = set(_key(node) for node in nodes)
+
+        # (model, draft pk) -> {attname: value}
+        self.values = {}
+        # (draft, field, (model, target pk))
+        self.foreign_keys = []
+        # (parent draft, child draft)
+        self.reverse = []
+        # (model, field name) -> [(draft pk, target pk)]
+        self.many_to_many = {}
+
+        for node in nodes:
+            if node.publish_state == Publishable.PUBLISH_CHANGED:
+                field_plan = node.__class__.publish_field_plan()
+                self.values[_key(node)] = dict(
+                    (attname, getattr(node, attname))
+                    for attname in field_plan.attnames)
+                for field in field_plan.foreign_keys:
+                    pk = getattr(node, field.attname)
+                    if pk is not None:
+                        self.foreign_keys.append(
+                            (node, field, (field.rel.to, pk)))
+            for child in self.all_published.children(node):
+                if _key(child) in keys and self._is_reverse(node, child):
+                    self.reverse.append((node, child))
+
+        for model, group in _group_by_model(nodes):
+            group = [node for node in group
+                     if node.publish_state != Publishable.PUBLISH_DELETE]
+            if not group:
+                continue
+            for field in _synced_many_to_many(model):
+                self.many_to_many[(model, field.name)] = _load_pairs(
+                    field, [node.pk for node in group])
+
+        self._nodes = nodes
+
+    def _is_reverse(self, parent, child):
+        for field in child._meta.fields:
+            if isinstance(field, RelatedField) and \
+                    field.rel.to == parent.__class__ and \
+                    getattr(child, field.attname) == parent.pk:
+                return True
+        return False
+
+    def _check_unchanged(self):
+        for model, group in _group_by_model(self.nodes):
+            fields = _copy_fields(model)
+            names = ['pk', 'publish_state', 'public'] + \
+                    [field.name for field in fields]
+            current = {}
+            for chunk in chunked([node.pk for node in group], CHUNK_SIZE):
+                for row in model._base_manager.filter(pk__in=chunk) \
+                        .values_list(*names):
+                    current[row[0]] = row[1:]
+
+            for node in group:
+                row = current.get(node.pk)
+                unchanged = row is not None \
+                    and row[0] == node.publish_state \
+                    and row[1] == node.public_id
+                values = self.values.get(_key(node))
+                if unchanged and values is not None:
+                    for field, value in zip(fields, row[2:]):
+                        if field.to_python(value) != \
+                                field.to_python(values[field.attname]):
+                            unchanged = False
+                            break
+                if not unchanged:
+                    raise PublishException(
+                        "%s has changed since the publish was planned" %
+                        node)
+
+        for (model, name), pairs in self.many_to_many.items():
+            field = model._meta.get_field(name)
+            ids = set(source for source, _ in pairs) | set(
+                node.pk for node in self.nodes
+                if node.__class__ == model
+                and node.publish_state != Publishable.PUBLISH_DELETE)
+            if set(_load_pairs(field, list(ids))) != set(pairs):
+                raise PublishException(
+                    "%s has changed since the publish was planned" %
+                    model._meta.verbose_name_plural)
+
+    def execute(self):
+        '''
+        publish everything in this plan
+        '''
+        if self.executed:
+            raise PublishException("Publish plan has already been executed")
+        if self.all_published.release is not None:
+            raise PublishException("Can't execute a publish plan in a "
+                                   "release")
+        self._check_unchanged()
+        if self.bulk:
+            BulkPublisher(self, batch_size=self.batch_size).publish()
+        else:
+            # save() and the save signals still get called this way
+            all_published = PublishGraph()
+            all_published.related = self.all_published.related
+            all_published.prefetched = self.all_published.prefetched
+            _publish_run(self.roots, all_published)
+        self.executed = True
+
+
+class BulkPublisher(object):
+    '''
+    publish the draft objects in a PublishPlan, grouping the work by
+    model, so that the number of queries grows with the number of models
+    involved rather than the number of objects.
+
+    new public versions are inserted with bulk_create, existing ones
+    are updated in batches and the draft publish_state is reset with a
+    single UPDATE per model.  as with bulk_create and QuerySet.update()
+    no save() is called and no pre_save/post_save signals are sent for
+    the public versions, but pre_publish and post_publish still are.
+    '''
+
+    def __init__(self, plan, batch_size=None):
+        self.plan = plan
+        self.batch_size = batch_size
+        self.nodes = plan.nodes
+        self.by_key = dict((_key(node), node) for node in self.nodes)
+
+        self.deleted = [node for node in self.nodes
+                        if node.publish_state == Publishable.PUBLISH_DELETE]
+        self.changes = [node for node in self.nodes
+                        if node.publish_state != Publishable.PUBLISH_DELETE]
+        self.changed = [node for node in self.changes
+                        if node.publish_state == Publishable.PUBLISH_CHANGED]
+
+        # (model, draft pk) -> foreign key targets
+        self.targets = {}
+        for node, field, target in plan.foreign_keys:
+            self.targets.setdefault(_key(node), []).append(target)
+
+        # (model, draft pk) -> pk of public version
+        self.public_ids = {}
+        self.publics = {}
+        self.had_public = set()
+        for node in self.changes:
+            if node.public_id is not None:
+                self.public_ids[_key(node)] = node.public_id
+                self.had_public.add(_key(node))
+            else:
+                self.public_ids[_key(node)] = None
+
+    def publish(self):
+        self._load_public_versions()
+        self._skip_unchanged()
+
+        signalled = [(node, False) for node in self.published] + \
+            [(node, True) for node in self.deleted]
+        if has_listeners(pre_publish_batch):
+            _send_batch(pre_publish_batch, signalled)
+        _send_each(pre_publish, self.published, deleted=False)
+
+        from history import HistoryRecorder, records_history
+        recorder = None
+        if records_history(self.published + self.deleted):
+            recorder = HistoryRecorder(self.plan.all_published)
+            recorder.before(self.published + self.deleted)
+
+        self._publish_changes()
+        self._publish_many_to_many()
+        self._remove_deleted_children()
+        self._publish_deletions()
+
+        if recorder is not None:
+            recorder.after()
+
+        _send_each(post_publish, self.published, deleted=False)
+        if has_listeners(post_publish_batch):
+            _send_batch(post_publish_batch, signalled)
+
+    def _skip_unchanged(self):
+        # drafts with the same fingerprint as their public version have
+        # nothing to copy, so only get their publish_state reset
+        unchanged = set()
+        for model, nodes in _group_by_model(self.changed):
+            field_plan = model.publish_field_plan()
+            if not field_plan.fingerprinted:
+                continue
+            targets = {}
+            for field, _ in field_plan.many_to_many:
+                for s, t in self.plan.many_to_many.get((model, field.name),
+                                                       []):
+                    targets.setdefault((field.name, s), []).append(t)
+            for node in nodes:
+                many_to_many = dict(
+                    (field.name, targets.get((field.name, node.pk), []))
+                    for field, _ in field_plan.many_to_many)
+                node.publish_fingerprint = field_plan.fingerprint(
+                    self.plan.values[_key(node)], many_to_many)
+                public_version = self.publics.get(_key(node))
+                if public_version is not None and \
+                        public_version.publish_fingerprint == \
+                        node.publish_fingerprint:
+                    unchanged.add(_key(node))
+
+        self.unchanged = [node for node in self.changed
+                          if _key(node) in unchanged]
+        self.changed = [node for node in self.changed
+                        if _key(node) not in unchanged]
+        self.published = [node for node in self.changes
+                          if _key(node) not in unchanged]
+
+    def _resolve_public_ids(self, model, ids):
+        # find the public versions of drafts not part of this publish
+        missing = [pk for pk in set(ids) if (model, pk) not in self.public_ids]
+        for chunk in chunked(missing, CHUNK_SIZE):
+            rows = model._base_manager.filter(pk__in=chunk) \
+                .values_list('pk', 'public')
+            for pk, public_id in rows:
+                self.public_ids[(model, pk)] = public_id
+
+    def _public_id(self, model, pk):
+        return self.public_ids.get((model, pk))
+
+    def _load_public_versions(self):
+        for model, nodes in _group_by_model(self.changed):
+            ids = [node.public_id for node in nodes if node.public_id]
+            existing = {}
+            manager = model.public_model()._base_manager
+            for chunk in chunked(ids, CHUNK_SIZE):
+                existing.update(manager.in_bulk(chunk))
+            for node in nodes:
+                if node.public_id:
+                    self.publics[_key(node)] = existing[node.public_id]
+
+    def _load_foreign_key_targets(self):
+        targets = {}
+        for _, _, (model, pk) in self.plan.foreign_keys:
+            targets.setdefault(model, []).append(pk)
+        for model, ids in targets.items():
+            self._resolve_public_ids(model, ids)
+
+    def _waiting(self, node, pending):
+        # is this node waiting on a foreign key target that is being
+        # published for the first time?
+        key = _key(node)
+        for target in self.targets.get(key, []):
+            if target in pending and target != key:
+                return True
+        return False
+
+    def _copy_values(self, node, public_version, fixups):
+        values = self.plan.values[_key(node)]
+        field_plan = node.__class__.publish_field_plan()
+        for field, copy, publish_function in field_plan.copy_fields:
+            if copy == PublishFieldPlan.COPY_PUBLISHABLE:
+                pk = values[field.attname]
+                value = None
+                if pk is not None:
+                    target = (field.rel.to, pk)
+                    value = self.public_ids.get(target)
+                    if value is None and target in self.by_key:
+                        # circular reference - fill it in later
+                        fixups.append((public_version, field, target))
+                if publish_function is None:
+                    setattr(public_version, field.attname, value)
+                    continue
+                if value is not None:
+                    value = field.rel.to._base_manager.get(pk=value)
+            elif copy == PublishFieldPlan.COPY_RELATED:
+                if publish_function is None:
+                    # no need to load the related object just to copy its id
+                    setattr(public_version, field.attname,
+                            values[field.attname])
+                    continue
+                value = getattr(node, field.name)
+            else:
+                value = values[field.attname]
+
+            publish_function = publish_function or setattr
+            publish_function(public_version, field.name, value)
+
+        if field_plan.fingerprinted:
+            public_version.publish_fingerprint = node.publish_fingerprint
+
+    def _insert(self, created):
+        for model, nodes in _group_by_model([node for node, _ in created]):
+            public_versions = [self.publics[_key(node)] for node in nodes]
+            if model._meta.parents or model.public_model() is not model:
+                # bulk_create can't handle multi-table inheritance, and
+                # public versions in a shadow table have no public column
+                # to find their ids with
+                for public_version in public_versions:
+                    public_version.save()
+            else:
+                # temporarily point each new public version at its draft,
+                # so we can find out the ids bulk_create doesn't give us
+                for node, public_version in zip(nodes, public_versions):
+                    public_version.public_id = node.pk
+                model._base_manager.bulk_create(public_versions,
+                                                batch_size=self.batch_size)
+                mapping = {}
+                for chunk in chunked([node.pk for node in nodes],
+                                     CHUNK_SIZE):
+                    mapping.update(model._base_manager
+                                   .filter(is_public=True, public__in=chunk)
+                                   .values_list('public', 'pk'))
+                for chunk in chunked(mapping.values(), CHUNK_SIZE):
+                    model._base_manager.filter(pk__in=chunk) \
+                        .update(public=None)
+                for node, public_version in zip(nodes, public_versions):
+                    public_version.public_id = None
+                    public_version.pk = mapping[node.pk]
+                    public_version._state.adding = False
+                    public_version._state.db = node._state.db
+
+            for node, public_version in zip(nodes, public_versions):
+                self.public_ids[_key(node)] = public_version.pk
+
+    def _publish_changes(self):
+        self._load_foreign_key_targets()
+
+        fixups = []
+
+        # insert new public versions in waves, so that foreign keys to
+        # other new public versions can always be filled in
+        pending = set(_key(node) for node in self.changed
+                      if node.public_id is None)
+        while pending:
+            ready = [node for node in self.changed
+                     if _key(node) in pending
+                     and not self._waiting(node, pending)]
+            if not ready:
+                # circular references - break the cycle and fix up after
+                ready = [node for node in self.changed
+                         if _key(node) in pending]
+            created = []
+            for node in ready:
+                public_version = node.__class__.public_model()(is_public=True)
+                self.publics[_key(node)] = public_version
+                self._copy_values(node, public_version, fixups)
+                created.append((node, public_version))
+            self._insert(created)
+            pending.difference_update(_key(node) for node in ready)
+
+        for model, nodes in _group_by_model(self.changed):
+            updated = [node for node in nodes if _key(node) in
+                       self.had_public]
+            if not updated:
+                continue
+            public_versions = []
+            changed_fields = set()
+            for node in updated:
+                public_version = self.publics[_key(node)]
+                self._copy_values(node, public_version, fixups)
+                # only update public versions and columns that differ
+                dirty_fields = public_version.dirty_fields()
+                if dirty_fields:
+                    changed_fields.update(dirty_fields)
+                    public_versions.append(public_version)
+            if public_versions:
+                bulk_update(public_versions,
+                            [field for field in list(_copy_fields(model)) +
+                             _fingerprint_fields(model)
+                             if field.name in changed_fields],
+                            batch_size=self.batch_size)
+                for public_version in public_versions:
+                    public_version._reset_dirty_fields()
+
+        fixed = {}
+        for public_version, field, target in fixups:
+            setattr(public_version, field.attname, self.public_ids.get(target))
+            fixed.setdefault((public_version.__class__, field), []) \
+                .append(public_version)
+        for (model, field), public_versions in fixed.items():
+            bulk_update(public_versions, [field], batch_size=self.batch_size)
+
+        # update state so we know everything is up-to-date
+        for model, nodes in _group_by_model(self.changed + self.unchanged):
+            old_states = []
+            for node in nodes:
+                old_states.append(node.publish_state)
+                node.public = self.publics[_key(node)]
+                node.publish_state = Publishable.PUBLISH_DEFAULT
+            bulk_update(nodes, [model._meta.get_field('publish_state'),
+                                model._meta.get_field('public')] +
+                        _fingerprint_fields(model),
+                        batch_size=self.batch_size)
+            for node in nodes:
+                node._reset_dirty_fields()
+            _count_publish_states(model, old_states,
+                                  Publishable.PUBLISH_DEFAULT)
+
+    def _publish_many_to_many(self):
+        for model, nodes in _group_by_model(self.published):
+            nodes = [node for node in nodes
+                     if self._public_id(model, node.pk) is not None]
+            if not nodes:
+                continue
+            for field in _synced_many_to_many(model):
+                self._sync_many_to_many(model, field, nodes)
+
+    def _sync_many_to_many(self, model, field, nodes):
+        related = field.rel.to
+
+        ids = set(node.pk for node in nodes)
+        draft_pairs = [(s, t) for s, t in
+                       self.plan.many_to_many[(model, field.name)]
+                       if s in ids]
+
+        if issubclass(related, Publishable):
+            self._resolve_public_ids(related, [t for _, t in draft_pairs])
+            wanted = set((self._public_id(model, s),
+                          self._public_id(related, t))
+                         for s, t in draft_pairs)
+            wanted = set((s, t) for s, t in wanted if t is not None)
+        else:
+            wanted = set((self._public_id(model, s), t)
+                         for s, t in draft_pairs)
+
+        public_ids = [self._public_id(model, node.pk) for node in nodes]
+        _sync_through_rows(_public_field(field), public_ids, wanted,
+                           batch_size=self.batch_size)
+
+    def _remove_deleted_children(self):
+        for model, nodes in _group_by_model(self.changes):
+            parents = [node for node in nodes if _key(node) in
+                       self.had_public]
+            if not parents:
+                continue
+            for related in model.publish_field_plan().reverse_relations:
+                if related.field.rel.multiple:
+                    self._remove_children(related, parents)
+
+    def _remove_children(self, related, parents):
+        manager = related.model._base_manager
+        parent_column = related.field.attname
+
+        public_parent_ids = dict((node.pk, node.public_id)
+                                 for node in parents)
+        keep = set()
+        for chunk in chunked(public_parent_ids.keys(), CHUNK_SIZE):
+            rows = manager.filter(**{parent_column + '__in': chunk}) \
+                .values_list(parent_column, 'public')
+            for parent_id, public_id in rows:
+                keep.add((public_parent_ids[parent_id], public_id))
+
+        stale = []
+        for chunk in chunked(public_parent_ids.values(), CHUNK_SIZE):
+            rows = manager.filter(**{parent_column + '__in': chunk}) \
+                .values_list(parent_column, 'pk')
+            stale.extend(pk for parent_id, pk in rows
+                         if (parent_id, pk) not in keep)
+
+        for chunk in chunked(stale, CHUNK_SIZE):
+            for item in manager.filter(pk__in=chunk):
+                item.delete(mark_for_deletion=False)
+
+    def _publish_deletions(self):
+        _send_each(pre_publish, self.deleted, deleted=True)
+
+        # the graph has parents before their children, so going
+        # backwards deletes children first.  drafts go before their
+        # public versions, as deleting a public version would cascade
+        # to the draft
+        for model, nodes in _group_by_model(reversed(self.deleted)):
+            public_ids = [node.public_id for node in nodes
+                          if node.public_id is not None]
+            for manager, ids in (
+                    (model._base_manager, [node.pk for node in nodes]),
+                    (model.public_model()._base_manager, public_ids)):
+                # (which takes the drafts off the publish counters)
+                for chunk in chunked(ids, self.batch_size or CHUNK_SIZE):
+                    manager.filter(pk__in=chunk).delete()
+
+        _send_each(post_publish, self.deleted, deleted=True)
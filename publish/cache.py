@@ -0,0 +1,167 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils.datastructures import SortedDict
+
+from models import PublishException, PublishCacheGeneration
+
+
+class PublishedCache(object):
+    '''
+    an in-process LRU cache of published objects, looked up by pk or by
+    one of their model's PublishMeta publish_cache_keys.
+
+    publishing evicts the published objects' entries here and moves their
+    models on a generation in the database.  other processes check the
+    generations every PUBLISH_CACHE_CHECK_INTERVAL seconds and drop
+    everything they have cached for models that have moved on.
+
+    a publish inside a transaction only shows once it commits, so until
+    then other threads can still read (and cache) the old objects.  the
+    new generation isn't taken as seen until it has been committed, so
+    the first check after the commit drops them.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # (model, field name, value) -> (pk, instance)
+        self._entries = SortedDict()
+        # (model, pk) -> keys of its entries
+        self._keys = {}
+        self._generations = {}
+        # model -> count of its evictions, so that a miss can tell if the
+        # object it loaded was evicted (so may be stale) in the meantime
+        self._versions = {}
+        self._checked = None
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'PUBLISH_CACHE_SIZE', 0)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries),
+                'max_size': self.max_size}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._generations.clear()
+            self._versions.clear()
+            self._checked = None
+            self.hits = self.misses = self.evictions = 0
+
+    def get(self, model, **kwargs):
+        model = model._meta.concrete_model
+        if len(kwargs) != 1:
+            raise PublishException("Expected a single lookup, not %r"
+                                   % kwargs)
+        name, value = kwargs.items()[0]
+        if name in ('pk', model._meta.pk.name):
+            name = 'pk'
+            value = model._meta.pk.to_python(value)
+        elif name not in model.PublishMeta.cache_keys():
+            raise PublishException("%s is not one of %s's publish_cache_keys"
+                                   % (name, model._meta.object_name))
+
+        published = model._default_manager.published()
+        if not self.max_size:
+            return published.get(**{name: value})
+
+        key = (model, name, value)
+        with self._lock:
+            self._check_generations()
+            if key in self._entries:
+                entry = self._entries.pop(key)
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            version = self._versions.get(model, 0)
+
+        instance = published.get(**{name: value})
+        with self._lock:
+            # not if it was read from changes that aren't committed, or
+            # its model's entries have been evicted since it was read
+            if not _uncommitted() and \
+                    self._versions.get(model, 0) == version:
+                self._add(key, instance)
+        return instance
+
+    def _add(self, key, instance):
+        model = key[0]
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (instance.pk, instance)
+        self._keys.setdefault((model, instance.pk), set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(self._entries.keyOrder[0])
+            self.evictions += 1
+
+    def _remove(self, key):
+        pk, instance = self._entries.pop(key)
+        keys = self._keys.get((key[0], pk))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[(key[0], pk)]
+
+    def _remove_model(self, model):
+        self._evicted(model)
+        for key in [key for key in self._entries if key[0] is model]:
+            self._remove(key)
+
+    def _evicted(self, model):
+        self._versions[model] = self._versions.get(model, 0) + 1
+
+    def _check_generations(self):
+        interval = getattr(settings, 'PUBLISH_CACHE_CHECK_INTERVAL', 1)
+        now = time.time()
+        if self._checked is not None and now - self._checked < interval:
+            return
+        if _uncommitted():
+            # we'd see our own generations before they are committed
+            return
+        self._checked = now
+        current = PublishCacheGeneration.objects.current()
+        for model in set(current) | set(self._generations):
+            if current.get(model) != self._generations.get(model):
+                self._remove_model(model)
+        self._generations = current
+
+    def invalidate(self, model, public_ids=None):
+        '''
+        evict the entries for model's public versions with public_ids
+        (all of them if None) and move model on a generation.  inside
+        a transaction the rest of model's entries are evicted by the
+        first check of the generations after it commits
+        '''
+        model = model._meta.concrete_model
+        generation = PublishCacheGeneration.objects.bump(model)
+        with self._lock:
+            self._evicted(model)
+            for pk in public_ids or ():
+                for key in list(self._keys.get((model, pk), ())):
+                    self._remove(key)
+            if public_ids is None or \
+                    generation != self._generations.get(model, 0) + 1:
+                # all of them, or someone else has published too
+                self._remove_model(model)
+            if not _uncommitted():
+                self._generations[model] = generation
+
+
+def _uncommitted():
+    '''
+    whether this thread has changes (to the publish cache generations)
+    that haven't been committed yet
+    '''
+    using = router.db_for_write(PublishCacheGeneration)
+    return transaction.is_managed(using) and transaction.is_dirty(using)
+
+
+published_cache = PublishedCache()
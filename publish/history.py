@@ -0,0 +1,468 @@
+'''
+the publish history of models with PublishMeta publish_history set:
+how their public versions were before each publish changed, deleted or
+created them, so that a publish can be rolled back.
+'''
+import base64
+from datetime import datetime
+import json
+import uuid
+import zlib
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from django.db.models import CASCADE, Count
+from django.db.models.deletion import Collector
+from django.utils.encoding import force_unicode
+
+from models import Publishable, PublishException, PublishHistory, \
+    _group_by_model, _sync_through_rows
+from bulk import _load_pairs
+from utils import chunked, CHUNK_SIZE
+import cache
+
+
+def history_enabled(model):
+    return getattr(model.PublishMeta, 'publish_history', False)
+
+
+_reaching = {}
+
+
+def _cascade_relations(model):
+    return [related
+            for related in model.publish_field_plan().deletion_relations
+            if related.field.rel.on_delete is CASCADE]
+
+
+def reaches_history(model):
+    '''
+    whether model, or any model deleting it cascades to, has publish_history
+    '''
+    if model not in _reaching:
+        # cycles don't reach anything new
+        _reaching[model] = False
+        _reaching[model] = history_enabled(model) or any(
+            reaches_history(related.model)
+            for related in _cascade_relations(model))
+    return _reaching[model]
+
+
+def records_history(drafts):
+    '''
+    whether publishing drafts needs a HistoryRecorder
+    '''
+    for model, group in _group_by_model(drafts):
+        if history_enabled(model):
+            return True
+        if reaches_history(model) and any(
+                draft.publish_state == Publishable.PUBLISH_DELETE
+                for draft in group):
+            return True
+    return False
+
+
+def _fields(public_model):
+    # everything a public version has, other than what says it is one
+    return [field for field in public_model._meta.fields
+            if not field.primary_key
+            and field.name not in ('is_public', 'publish_state', 'public')]
+
+
+def _many_to_many(model):
+    return [field for field in model._meta.many_to_many
+            if field.rel.through._meta.auto_created]
+
+
+def load_states(model, public_ids):
+    '''
+    the field values (by attname) and many-to-many target ids (by field
+    name) of model's public versions with public_ids, by public id
+    '''
+    public_model = model.public_model()
+    attnames = [field.attname for field in _fields(public_model)]
+    many_to_many = _many_to_many(public_model)
+    states = {}
+    for chunk in chunked(public_ids, CHUNK_SIZE):
+        for row in public_model._base_manager.filter(pk__in=chunk) \
+                .values_list('pk', *attnames):
+            states[row[0]] = (dict(zip(attnames, row[1:])),
+                              dict((field.name, set())
+                                   for field in many_to_many))
+    for field in many_to_many:
+        for source, target in _load_pairs(field, states.keys()):
+            states[source][1][field.name].add(target)
+    return states
+
+
+def encode(data):
+    return base64.b64encode(zlib.compress(
+        json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))))
+
+
+def decode(data):
+    if not data:
+        return {}
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+class HistoryRecorder(object):
+    '''
+    records the public versions of drafts (of models with publish_history)
+    as they were before a publish: call before() with the drafts about to
+    be published and after() once they have been
+    '''
+
+    def __init__(self, all_published):
+        if all_published.history_run is None:
+            all_published.history_run = uuid.uuid4().hex
+        self.run = all_published.history_run
+        # (model, draft, draft pk, public id, action, state before)
+        self.pending = []
+
+    def before(self, drafts):
+        drafts = list(drafts)
+        # children deleted along with their parents, without being marked
+        cascaded = _cascaded(drafts)
+        drafts = [draft for draft in drafts + cascaded
+                  if history_enabled(draft.__class__)]
+        cascaded = set((draft.__class__, draft.pk) for draft in cascaded)
+        states = {}
+        for model, group in _group_by_model(drafts):
+            states[model] = load_states(model, [
+                draft.public_id for draft in group
+                if draft.public_id is not None])
+
+        # in the order given, which after() relies on
+        for draft in drafts:
+            model = draft.__class__
+            state = states[model].get(draft.public_id)
+            if state is None:
+                action = PublishHistory.ACTION_CREATED
+            elif draft.publish_state == Publishable.PUBLISH_DELETE or \
+                    (model, draft.pk) in cascaded:
+                action = PublishHistory.ACTION_DELETED
+            else:
+                action = PublishHistory.ACTION_CHANGED
+            self.pending.append((model, draft, draft.pk, draft.public_id,
+                                 action, state))
+
+    def after(self):
+        changed = {}
+        for model, _, _, public_id, action, _ in self.pending:
+            if action == PublishHistory.ACTION_CHANGED:
+                changed.setdefault(model, []).append(public_id)
+        after = {}
+        for model, public_ids in changed.items():
+            for public_id, state in load_states(model, public_ids).items():
+                after[(model, public_id)] = state
+
+        entries, deletions = [], []
+        for model, draft, draft_pk, public_id, action, state in self.pending:
+            if action == PublishHistory.ACTION_CREATED:
+                public_id = draft.public_id
+                if public_id is None:
+                    continue
+                data = {}
+            elif action == PublishHistory.ACTION_DELETED:
+                data = {'fields': state[0],
+                        'm2m': dict((name, sorted(ids)) for name, ids
+                                    in state[1].items())}
+            else:
+                values, many_to_many = after.get((model, public_id),
+                                                 ({}, {}))
+                data = {}
+                fields = dict((attname, value) for attname, value
+                              in state[0].items()
+                              if values.get(attname) != value)
+                if fields:
+                    data['fields'] = fields
+                m2m = dict((name, sorted(ids)) for name, ids
+                           in state[1].items()
+                           if many_to_many.get(name) != ids)
+                if m2m:
+                    data['m2m'] = m2m
+                if not data:
+                    continue
+            entry = PublishHistory(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id=force_unicode(draft_pk),
+                public_id=force_unicode(public_id),
+                run=self.run, action=action, data=encode(data))
+            if action == PublishHistory.ACTION_DELETED:
+                deletions.append(entry)
+            else:
+                entries.append(entry)
+        # the drafts come parents first, but the deletions of children go
+        # first, so that rolling back (newest first) restores parents first
+        entries.extend(reversed(deletions))
+        PublishHistory.objects.bulk_create(entries)
+        self.pending = []
+
+
+def _cascaded(drafts):
+    '''
+    the drafts (of models with publish_history) that deleting the given
+    drafts marked for deletion would delete along with them, without
+    having been marked themselves
+    '''
+    seen = set((draft.__class__, draft.pk) for draft in drafts)
+    parents = [draft for draft in drafts
+               if draft.publish_state == Publishable.PUBLISH_DELETE]
+    cascaded = []
+    while parents:
+        children = []
+        for model, group in _group_by_model(parents):
+            pks = [draft.pk for draft in group]
+            for related in _cascade_relations(model):
+                if not reaches_history(related.model):
+                    continue
+                for chunk in chunked(pks, CHUNK_SIZE):
+                    for child in related.model._base_manager.filter(**{
+                            'is_public': False,
+                            related.field.name + '__in': chunk}):
+                        key = (child.__class__, child.pk)
+                        if key not in seen:
+                            seen.add(key)
+                            children.append(child)
+        cascaded.extend(child for child in children
+                        if history_enabled(child.__class__))
+        parents = children
+    return cascaded
+
+
+def _undo_entries(to, model=None, object_ids=None):
+    '''
+    the history entries to undo, newest first, by (content type id,
+    object id)
+    '''
+    entries = PublishHistory.objects.all()
+    if model is not None:
+        entries = entries.filter(
+            content_type=ContentType.objects.get_for_model(model))
+        if object_ids is not None:
+            entries = entries.filter(object_id__in=[
+                force_unicode(pk) for pk in object_ids])
+
+    if to is None:
+        # the latest run of each object
+        latest = {}
+        for content_type_id, object_id, run in \
+                entries.order_by('pk').values_list('content_type',
+                                                   'object_id', 'run'):
+            latest[(content_type_id, object_id)] = run
+        undo = [entry for entry in entries.order_by('-pk')
+                if latest[(entry.content_type_id, entry.object_id)] ==
+                entry.run]
+    else:
+        if isinstance(to, datetime):
+            first = entries.filter(published__gte=to)
+        else:
+            first = entries.filter(run=to)
+        start = first.order_by('pk').values_list('pk', flat=True)[:1]
+        if not start:
+            return {}
+        targets = set(first.values_list('content_type', 'object_id'))
+        undo = [entry for entry in entries.filter(pk__gte=start[0])
+                .order_by('-pk')
+                if (entry.content_type_id, entry.object_id) in targets]
+
+    by_object = {}
+    for entry in undo:
+        by_object.setdefault((entry.content_type_id, entry.object_id),
+                             []).append(entry)
+    return by_object
+
+
+@transaction.commit_on_success
+def rollback(to=None, model=None, object_ids=None):
+    '''
+    restore the public versions of objects as they were before the publish
+    run with id to (or before the time to, if it is a datetime), undoing
+    everything published to them since.  if to is None the latest run of
+    each of model's objects with object_ids is undone.  the entries undone
+    are removed from the history.  returns the number of objects restored
+    '''
+    if to is None and (model is None or object_ids is None):
+        raise PublishException("Give the objects to roll back, or a run "
+                               "or time to roll back to")
+    by_object = _undo_entries(to, model, object_ids)
+
+    # newest first, so parents (whose deletions are recorded after
+    # their children's) are restored before them
+    objects = sorted(by_object.items(),
+                     key=lambda (key, entries): -entries[0].pk)
+    restored = {}
+    for (content_type_id, object_id), entries in objects:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        restored.setdefault(model, []).append(
+            _restore(model, object_id, entries))
+    if cache.published_cache.max_size:
+        for model, public_ids in restored.items():
+            cache.published_cache.invalidate(model, public_ids)
+
+    undone = [entry.pk for entries in by_object.values()
+              for entry in entries]
+    for chunk in chunked(undone, CHUNK_SIZE):
+        PublishHistory.objects.filter(pk__in=chunk).delete()
+    return len(by_object)
+
+
+def _restore(model, object_id, entries):
+    public_model = model.public_model()
+    pk_field = public_model._meta.pk
+    public_id = pk_field.to_python(entries[0].public_id)
+    state = load_states(model, [public_id]).get(public_id)
+    if state is not None:
+        state = (state[0], dict((name, sorted(ids))
+                                for name, ids in state[1].items()))
+
+    # entries hold the values from before each publish, so applying
+    # them newest first leaves the values from before the oldest
+    for entry in entries:
+        data = decode(entry.data)
+        public_id = pk_field.to_python(entry.public_id)
+        if entry.action == PublishHistory.ACTION_CREATED:
+            state = None
+        elif entry.action == PublishHistory.ACTION_DELETED:
+            state = (data['fields'], data['m2m'])
+        elif state is not None:
+            state[0].update(data.get('fields', {}))
+            state[1].update(data.get('m2m', {}))
+
+    drafts = list(model._base_manager.filter(
+        pk=model._meta.pk.to_python(object_id)))
+    draft = drafts[0] if drafts else None
+
+    if state is None:
+        # the publish created the public version
+        if draft is not None:
+            draft.public = None
+            draft.publish_state = Publishable.PUBLISH_CHANGED
+            draft.save(mark_changed=False)
+        for public_version in public_model._base_manager.filter(pk=public_id):
+            _detach_dependents(public_version)
+            public_version.delete(mark_for_deletion=False)
+        return public_id
+
+    values, many_to_many = state
+    fields = dict((field.attname, field) for field in _fields(public_model))
+    public_version = public_model(pk=public_id, is_public=True, **dict(
+        (attname, fields[attname].to_python(value))
+        for attname, value in values.items() if attname in fields))
+    public_version.save()
+    for field in _many_to_many(public_model):
+        _sync_through_rows(field, [public_id], set(
+            (public_id, target) for target in many_to_many.get(field.name,
+                                                               [])))
+
+    if draft is None:
+        # the publish deleted the draft too
+        _recreate_draft(model, object_id, public_version, many_to_many)
+    else:
+        draft.public = public_version
+        draft.publish_state = Publishable.PUBLISH_CHANGED
+        draft.save(mark_changed=False)
+    return public_id
+
+
+def _collect(instance):
+    # what deleting instance would delete, by model
+    collector = Collector(using=router.db_for_write(instance.__class__,
+                                                    instance=instance))
+    collector.collect([instance])
+    collected = [(model, list(instances))
+                 for model, instances in collector.data.items()]
+    # (Django 1.4 doesn't do fast deletes)
+    collected.extend((queryset.model, list(queryset))
+                     for queryset in getattr(collector, 'fast_deletes', ()))
+    return collected
+
+
+def _detach_dependents(public_version):
+    '''
+    deleting public_version cascades to the public versions that refer to
+    it, and from them to their drafts: detach those drafts first (marking
+    them changed), so that only the public versions go.  raises
+    PublishException if drafts would still be deleted
+    '''
+    for model, instances in _collect(public_version):
+        draft_model = getattr(model, '_draft_model', model)
+        if not issubclass(draft_model, Publishable):
+            continue
+        public_ids = [instance.pk for instance in instances
+                      if instance.is_public and instance != public_version]
+        for chunk in chunked(public_ids, CHUNK_SIZE):
+            for draft in draft_model._base_manager.filter(public__in=chunk):
+                draft.public = None
+                draft.publish_state = Publishable.PUBLISH_CHANGED
+                draft.save(mark_changed=False)
+
+    for model, instances in _collect(public_version):
+        if issubclass(model, Publishable) and \
+                any(not instance.is_public for instance in instances):
+            raise PublishException("Can't roll back %r, as that would "
+                                   "delete drafts of %s" % (
+                                       public_version,
+                                       model._meta.verbose_name_plural))
+
+
+def _recreate_draft(model, object_id, public_version, many_to_many):
+    draft = model(pk=model._meta.pk.to_python(object_id), is_public=False,
+                  publish_state=Publishable.PUBLISH_DEFAULT,
+                  public=public_version)
+    for field in _fields(model):
+        value = getattr(public_version, field.attname, None)
+        if value is not None and issubclass(getattr(field.rel, 'to', object),
+                                            Publishable):
+            value = _draft_id(field.rel.to, value)
+        setattr(draft, field.attname, value)
+    draft.save(mark_changed=False)
+
+    for field in _many_to_many(model):
+        targets = many_to_many.get(field.name, [])
+        if issubclass(field.rel.to, Publishable):
+            targets = [_draft_id(field.rel.to, target) for target in targets]
+        _sync_through_rows(field, [draft.pk], set(
+            (draft.pk, target) for target in targets if target is not None))
+
+
+def _draft_id(model, public_id):
+    ids = model._base_manager.filter(public=public_id) \
+        .values_list('pk', flat=True)[:1]
+    return ids[0] if ids else None
+
+
+def prune(before=None, keep=None, batch_size=CHUNK_SIZE):
+    '''
+    delete the history entries from before the time before and/or all
+    but the latest keep entries of each object, batch_size at a time.
+    returns the number of entries deleted
+    '''
+    deleted = 0
+    if before is not None:
+        old = PublishHistory.objects.filter(published__lt=before) \
+            .order_by('pk')
+        while True:
+            ids = list(old.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            PublishHistory.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
+
+    if keep is not None:
+        over = PublishHistory.objects.values('content_type', 'object_id') \
+            .annotate(entries=Count('pk')).filter(entries__gt=keep) \
+            .order_by()
+        stale = []
+        for row in list(over):
+            stale.extend(PublishHistory.objects
+                         .filter(content_type=row['content_type'],
+                                 object_id=row['object_id'])
+                         .order_by('-pk').values_list('pk', flat=True)
+                         [keep:])
+        for chunk in chunked(stale, batch_size):
+            PublishHistory.objects.filter(pk__in=chunk).delete()
+            deleted += len(chunk)
+    return deleted
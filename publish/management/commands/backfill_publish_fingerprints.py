@@ -0,0 +1,87 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model, get_models
+
+from publish.bulk import _load_pairs
+from publish.models import Publishable, FingerprintedPublishable
+from publish.utils import bulk_update, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    args = '[app_label.ModelName ...]'
+    help = 'Fill in missing fingerprints for published objects, so that ' \
+           'publishing them again without changes does nothing.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=CHUNK_SIZE,
+                    help='Number of objects to update at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if args:
+            models = [self._get_model(label) for label in args]
+        else:
+            models = [model for model in get_models()
+                      if issubclass(model, FingerprintedPublishable)]
+
+        for model in models:
+            count = self._backfill(model, batch_size)
+            self.stdout.write('%s.%s: %d fingerprints\n' % (
+                model._meta.app_label, model._meta.object_name, count))
+
+    def _get_model(self, label):
+        try:
+            app_label, model_name = label.split('.')
+        except ValueError:
+            raise CommandError('Expected app_label.ModelName, not %r' % label)
+        model = get_model(app_label, model_name)
+        if model is None or not issubclass(model, FingerprintedPublishable):
+            raise CommandError('%s is not a FingerprintedPublishable model'
+                               % label)
+        return model
+
+    def _backfill(self, model, batch_size):
+        # only drafts that are published and up-to-date have the same
+        # content as their public version
+        field_plan = model.publish_field_plan()
+        fingerprint_field = model._meta.get_field('publish_fingerprint')
+        drafts = model._base_manager.filter(
+            is_public=False, publish_state=Publishable.PUBLISH_DEFAULT,
+            public__isnull=False, publish_fingerprint='').order_by('pk')
+
+        count = 0
+        last_pk = None
+        while True:
+            batch = drafts
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            targets = {}
+            for field, _ in field_plan.many_to_many:
+                for s, t in _load_pairs(field, [draft.pk for draft in batch]):
+                    targets.setdefault((field.name, s), []).append(t)
+
+            public_versions = []
+            for draft in batch:
+                values = dict((attname, getattr(draft, attname))
+                              for attname in field_plan.attnames)
+                many_to_many = dict(
+                    (field.name, targets.get((field.name, draft.pk), []))
+                    for field, _ in field_plan.many_to_many)
+                draft.publish_fingerprint = field_plan.fingerprint(
+                    values, many_to_many)
+                public_versions.append(model.public_model()(
+                    pk=draft.public_id,
+                    publish_fingerprint=draft.publish_fingerprint))
+
+            bulk_update(batch, [fingerprint_field], batch_size=batch_size)
+            bulk_update(public_versions, [fingerprint_field],
+                        batch_size=batch_size)
+            count += len(batch)
+        return count
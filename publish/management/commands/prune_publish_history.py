@@ -0,0 +1,34 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from publish.models import PublishHistory
+from publish.utils import CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete old entries from the publish history, those from more ' \
+           'than --days ago and/or all but the latest --keep entries of ' \
+           'each object.'
+    option_list = BaseCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=None,
+                    help='Delete the entries older than this many days.'),
+        make_option('--keep', dest='keep', type='int', default=None,
+                    help='Number of entries to keep for each object.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=CHUNK_SIZE,
+                    help='Number of entries to delete at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        days, keep = options['days'], options['keep']
+        if days is None and keep is None:
+            raise CommandError('Expected --days and/or --keep')
+        before = None
+        if days is not None:
+            before = timezone.now() - timedelta(days=days)
+        deleted = PublishHistory.objects.prune(
+            before, keep, batch_size=options['batch_size'])
+        self.stdout.write('Deleted %d history entries\n' % deleted)
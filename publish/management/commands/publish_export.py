@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from publish.models import PublishException
+from publish.snapshot import export_published, _get_model
+from publish.utils import CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    args = 'path [app_label.ModelName ...]'
+    help = 'Write the published content (of all publishable models, or ' \
+           'just those given) to a snapshot file, which is compressed if ' \
+           'its name ends in .gz.  An index of where each model starts ' \
+           'is written to path.index.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=CHUNK_SIZE,
+                    help='Number of rows to read at a time.'),
+        make_option('--database', dest='database', default=None,
+                    help='Database to export from.'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Expected the path of the snapshot to write')
+        path, labels = args[0], args[1:]
+        try:
+            models = [_get_model(label) for label in labels] or None
+            index = export_published(path, models,
+                                     batch_size=options['batch_size'],
+                                     using=options['database'])
+        except PublishException, e:
+            raise CommandError(str(e))
+        for label, section in sorted(index['models'].items()):
+            self.stdout.write('%s: %d records\n' % (label,
+                                                    section['records']))
@@ -0,0 +1,34 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from publish.models import PublishException
+from publish.snapshot import import_published, _get_model
+from publish.utils import CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    args = 'path [app_label.ModelName ...]'
+    help = 'Load the published content (of all models, or just those ' \
+           'given) from a snapshot file written by publish_export.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=CHUNK_SIZE,
+                    help='Number of records to load at a time.'),
+        make_option('--database', dest='database', default=None,
+                    help='Database to load into.'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Expected the path of the snapshot to load')
+        path, labels = args[0], args[1:]
+        try:
+            models = [_get_model(label) for label in labels] or None
+            counts = import_published(path, models,
+                                      batch_size=options['batch_size'],
+                                      using=options['database'])
+        except PublishException, e:
+            raise CommandError(str(e))
+        for label, count in sorted(counts.items()):
+            self.stdout.write('%s: %d records\n' % (label, count))
@@ -0,0 +1,50 @@
+from optparse import make_option
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+
+from publish.scheduling import publish_due, expire_due
+
+
+class Command(BaseCommand):
+    help = 'Publish drafts whose publish_at time has come and delete ' \
+           'content whose expire_at time has.  Runs once (e.g. from ' \
+           'cron) unless --loop is given.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=100,
+                    help='Number of drafts to publish or expire at a '
+                         'time.'),
+        make_option('--loop', dest='loop', action='store_true',
+                    default=False,
+                    help='Keep checking for due drafts.'),
+        make_option('--sleep', dest='sleep', type='float', default=60,
+                    help='Seconds to wait between checks with --loop.'),
+    )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self._tick(options)
+            return
+        while True:
+            try:
+                self._tick(options)
+            except Exception:
+                # keep going, whatever failed will be tried again
+                self.stderr.write(traceback.format_exc())
+            time.sleep(options['sleep'])
+
+    def _tick(self, options):
+        failures = []
+        published = publish_due(batch_size=options['batch_size'],
+                                failures=failures)
+        if published:
+            self.stdout.write('Published %d\n' % published)
+        expired = expire_due(batch_size=options['batch_size'],
+                             failures=failures)
+        if expired:
+            self.stdout.write('Expired %d\n' % expired)
+        for obj, error in failures:
+            self.stderr.write('Failed %s %s:\n%s' % (
+                obj._meta.object_name, obj.pk, error))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from publish.models import PublishCounter
+
+
+class Command(BaseCommand):
+    help = 'Show the number of changed and deleted drafts waiting to be ' \
+           'published for each model, from the publish counters.'
+
+    def handle(self, *args, **options):
+        if not PublishCounter.objects.enabled():
+            self.stderr.write('PUBLISH_COUNTERS is not set, so the '
+                              'counts may be out of date.\n')
+        backlog = PublishCounter.objects.backlog()
+        rows = sorted((model._meta.app_label, model._meta.object_name,
+                       counts['changed'], counts['deleted'])
+                      for model, counts in backlog.items())
+        for app_label, object_name, changed, deleted in rows:
+            self.stdout.write('%s.%s: %d changed, %d deleted\n' % (
+                app_label, object_name, changed, deleted))
@@ -0,0 +1,52 @@
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+from publish.models import PublishJob
+
+
+class Command(BaseCommand):
+    help = 'Publish the drafts queued up by PublishJob.objects.enqueue().'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=10,
+                    help='Number of jobs to claim at a time.'),
+        make_option('--sleep', dest='sleep', type='float', default=5,
+                    help='Seconds to wait when there are no jobs.'),
+        make_option('--timeout', dest='timeout', type='int', default=3600,
+                    help='Seconds after which a job still running is taken '
+                         'to have been left by a worker that died, and is '
+                         'run again.'),
+        make_option('--once', dest='once', action='store_true',
+                    default=False,
+                    help='Stop once there are no jobs left, rather than '
+                         'waiting for more.'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = PublishJob.objects.claim(options['batch_size'],
+                                            options['timeout'])
+            if not jobs:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+            self._run(jobs)
+
+    def _run(self, jobs):
+        # duplicates of a job only need publishing once
+        done = {}
+        for job in jobs:
+            key = (job.content_type_id, job.object_id)
+            first = done.get(key)
+            if first is None:
+                job.run()
+                done[key] = job
+            else:
+                job.status = first.status
+                job.error = first.error
+                job.finished = first.finished
+                job.save()
+            self.stdout.write('%s in %s\n' % (job, job.duration()))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model, get_models
+
+from publish.models import Publishable, PublishCounter
+
+
+class Command(BaseCommand):
+    args = '[app_label.ModelName ...]'
+    help = 'Count the changed and deleted drafts of each model again, ' \
+           'correcting any drift in the publish counters.'
+
+    def handle(self, *args, **options):
+        if args:
+            models = [self._get_model(label) for label in args]
+        else:
+            models = [model for model in get_models()
+                      if issubclass(model, Publishable)]
+
+        for model in models:
+            PublishCounter.objects.recount(model)
+        backlog = PublishCounter.objects.backlog(models)
+        for model in models:
+            self.stdout.write('%s.%s: %d changed, %d deleted\n' % (
+                model._meta.app_label, model._meta.object_name,
+                backlog[model]['changed'], backlog[model]['deleted']))
+
+    def _get_model(self, label):
+        try:
+            app_label, model_name = label.split('.')
+        except ValueError:
+            raise CommandError('Expected app_label.ModelName, not %r' % label)
+        model = get_model(app_label, model_name)
+        if model is None or not issubclass(model, Publishable):
+            raise CommandError('%s is not a Publishable model' % label)
+        return model
@@ -1,10 +1,24 @@
-from django.db import models
+import copy
+from datetime import timedelta
+from hashlib import sha1
+from inspect import getargspec
+import traceback
+import types
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, models, transaction
+from django.db.models import Count, F, get_models, options
 from django.db.models.query import QuerySet, Q
 from django.db.models.base import ModelBase
 from django.db.models.fields.related import RelatedField
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from django.utils.encoding import smart_str, force_unicode
 
-from utils import NestedSet
-from signals import pre_publish, post_publish
+from utils import PublishGraph, graph_key, chunked, CHUNK_SIZE
+from signals import pre_publish, post_publish, pre_publish_batch, \
+    post_publish_batch, send_publish_signal, has_listeners
 
 # this takes some inspiration from the publisher stuff in
 # django-cms 2.0
@@ -18,7 +32,34 @@ class PublishException(Exception):
     pass
 
 
+# update_fields was added to Model.save() in Django 1.5
+SAVE_UPDATE_FIELDS = 'update_fields' in getargspec(models.Model.save)[0]
+
+# as was Meta.index_together
+INDEX_TOGETHER = 'index_together' in options.DEFAULT_NAMES
+
+
 class PublishableQuerySet(QuerySet):
+    # the filters applied so far, so they can be applied again
+    # to the public model of a model with a shadow table
+    _publish_filters = ()
+
+    def _clone(self, *arg, **kw):
+        clone = super(PublishableQuerySet, self)._clone(*arg, **kw)
+        clone._publish_filters = self._publish_filters
+        return clone
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        clone = super(PublishableQuerySet, self)._filter_or_exclude(
+            negate, *args, **kwargs)
+        clone._publish_filters = self._publish_filters + \
+            ((negate, args, kwargs),)
+        if not negate and Publishable.Q_PUBLISHED in args and \
+                self.model.public_model() is not self.model:
+            # the public versions are in another table
+            return clone.published()
+        return clone
+
     def changed(self):
         '''all draft objects that have not been published yet'''
         return self.filter(Publishable.Q_CHANGED)
@@ -32,20 +73,155 @@ class PublishableQuerySet(QuerySet):
         return self.filter(Publishable.Q_DRAFT)
 
     def draft_and_deleted(self):
-        return self.filter(Publishable.Q_DRAFT | Publishable.Q_DELETED)
-
-    def published(self):
-        '''all public/published objects'''
-        return self.filter(Publishable.Q_PUBLISHED)
+        return self.filter(Publishable.Q_DRAFT_AND_DELETED)
 
-    def publish(self, all_published=None):
+    def published(self, release=None):
+        '''
+        all public/published objects.  for a ReleasedPublishable those
+        in the live release, or in release (a PublishRelease or its id)
+        '''
+        public_model = self.model.public_model()
+        if public_model is not self.model:
+            # they're in another table, with the same fields, so this
+            # queryset's filters are applied to that instead
+            if self.query.where and not self._publish_filters:
+                raise PublishException(
+                    "Can't filter the published %s before published()" %
+                    self.model._meta.object_name)
+            queryset = public_model._default_manager.all()
+            for negate, args, kwargs in self._publish_filters:
+                if negate:
+                    queryset = queryset.exclude(*args, **kwargs)
+                else:
+                    queryset = queryset.filter(*args, **kwargs)
+            return queryset
+        queryset = self.filter(Publishable.Q_PUBLISHED)
+        if issubclass(self.model, ReleasedPublishable):
+            if release is None:
+                # the live release is looked up when the query runs, so
+                # querysets built before a release is activated see it
+                return queryset.extra(
+                    where=[ReleasedPublishable.live_release_sql(
+                        self.model, connections[self.db])])
+            queryset = queryset.filter(ReleasedPublishable.release_q(
+                getattr(release, 'pk', release)))
+        elif release is not None:
+            raise PublishException("%s doesn't have releases"
+                                   % self.model._meta.object_name)
+        return queryset
+
+    def publish(self, all_published=None, bulk=False, batch_size=None,
+                dry_run=False, processes=None, chunk_size=None,
+                checkpoint=None, databases=None, release=None):
         '''
         publish all models in this queryset
+
+        if dry_run is True nothing is published, instead a PublishPlan is
+        returned, that can be examined and then applied with its execute()
+        method.
+
+        if bulk is True the whole publish graph is collected first and then
+        published model by model, rather than object by object
+
+        if processes is given the publish is split into parts that don't
+        depend on each other, which are published by that many processes
+        at once.  a list of PublishResult (one per part) is returned
+
+        if chunk_size is given the queryset is published chunk_size objects
+        at a time (in pk order), committing after each chunk.  progress is
+        recorded in the PublishCheckpoint with the given name (if any), so
+        that a run that fails can be resumed from the last chunk committed.
+        the number of objects published is returned
+
+        if databases (a list of database aliases) is given the queryset is
+        published in bulk and the public versions involved are then copied
+        to each of those databases at once, each in its own thread and
+        transaction.  a list of ReplicationResult (one per database) is
+        returned
+
+        if release (a PublishRelease or its id) is given the changes to
+        ReleasedPublishable objects only go live when the release is
+        activated.  publishing to a release is always done object by
+        object, rather than in bulk
         '''
+        if release is not None:
+            if processes or databases:
+                raise PublishException(
+                    "Can't publish to a release with processes or "
+                    "databases")
+            release = _release_id(release)
+            bulk = False
+        if databases and not dry_run:
+            from replication import publish_to
+            return publish_to(self, databases, all_published,
+                              batch_size=batch_size)
+        if processes and not dry_run:
+            from parallel import publish_in_parallel
+            return publish_in_parallel(self, processes, all_published,
+                                       bulk=bulk, batch_size=batch_size)
+        if chunk_size and not dry_run:
+            return self._publish_in_chunks(chunk_size, checkpoint, bulk=bulk,
+                                           batch_size=batch_size,
+                                           release=release)
         if all_published is None:
-            all_published = NestedSet()
-        for p in self:
-            p.publish(all_published=all_published)
+            all_published = PublishGraph()
+        if release is not None:
+            all_published.release = release
+        return _publish_roots(list(self), all_published, bulk=bulk,
+                              batch_size=batch_size, dry_run=dry_run)
+
+    def _publish_in_chunks(self, chunk_size, checkpoint_name, bulk=False,
+                           batch_size=None, release=None):
+        checkpoint = None
+        last_pk = None
+        if checkpoint_name:
+            checkpoint = PublishCheckpoint.objects.start(checkpoint_name,
+                                                         self.model)
+            last_pk = checkpoint.get_last_pk()
+
+        queryset = self.order_by('pk')
+        published = 0
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            roots = list(chunk[:chunk_size].iterator())
+            if not roots:
+                break
+            last_pk = roots[-1].pk
+            self._publish_chunk(roots, checkpoint, last_pk, bulk, batch_size,
+                                release)
+            published += len(roots)
+
+        if checkpoint is not None:
+            checkpoint.delete()
+            transaction.commit_unless_managed()
+        return published
+
+    @transaction.commit_on_success
+    def _publish_chunk(self, roots, checkpoint, last_pk, bulk, batch_size,
+                       release):
+        # each chunk gets a fresh graph, so memory use doesn't grow with
+        # the size of the queryset.  anything published by an earlier
+        # chunk is up-to-date by now, so won't be visited again anyway
+        all_published = PublishGraph()
+        all_published.release = release
+        _publish_roots(roots, all_published, bulk=bulk,
+                       batch_size=batch_size)
+        if checkpoint is not None:
+            checkpoint.last_pk = force_unicode(last_pk)
+            checkpoint.published += len(roots)
+            checkpoint.save()
+
+    def publish_deletions(self, all_published=None, batch_size=None):
+        '''
+        publish the deletions of the objects in this queryset that are
+        marked for deletion (and of their marked children).  the marked
+        drafts and public versions are collected first and then deleted
+        a model at a time, rather than an object at a time
+        '''
+        return self.deleted().publish(all_published, bulk=True,
+                                      batch_size=batch_size)
 
     def delete(self, mark_for_deletion=True):
         '''
@@ -75,9 +251,29 @@ class PublishableManager(models.Manager):
     def draft_and_deleted(self):
         return self.get_query_set().draft_and_deleted()
 
-    def published(self):
-        '''all public/published objects'''
-        return self.get_query_set().published()
+    def published(self, release=None):
+        '''
+        all public/published objects.  for a ReleasedPublishable those
+        in the live release, or in release (a PublishRelease or its id)
+        '''
+        return self.get_query_set().published(release)
+
+    def backlog(self):
+        '''
+        the number of changed and deleted objects waiting to be
+        published, from the publish counters (see PUBLISH_COUNTERS)
+        '''
+        return PublishCounter.objects.backlog([self.model])[self.model]
+
+    def get_published(self, **kwargs):
+        '''
+        get a published object by pk or one of its PublishMeta
+        publish_cache_keys, through the published object cache (see
+        PUBLISH_CACHE_SIZE).  the object returned may be shared, so
+        shouldn't be changed
+        '''
+        from cache import published_cache
+        return published_cache.get(self.model, **kwargs)
 
 
 class PublishableBase(ModelBase):
@@ -92,10 +288,201 @@ class PublishableBase(ModelBase):
         opts.permissions = tuple(opts.permissions) + ((code, name), )
         opts.get_publish_permission = lambda: code
 
+        # the draft()/changed()/deleted() filters all select on both.
+        # a model extending another by multi-table inheritance gets
+        # them from the parent's table
+        local_names = [field.name for field in opts.local_fields]
+        if INDEX_TOGETHER and not opts.abstract and not opts.proxy \
+                and 'is_public' in local_names:
+            index = ('is_public', 'publish_state')
+            if index not in [tuple(fields) for fields in opts.index_together]:
+                opts.index_together = list(opts.index_together) + [index]
+            # a ReleasedPublishable's published() also selects on
+            # the range of releases
+            if 'release_to' in local_names:
+                index = ('is_public', 'release_from', 'release_to')
+                opts.index_together = list(opts.index_together) + [index]
+
+        if not opts.abstract and not opts.proxy:
+            post_delete.connect(_count_deleted, sender=new_class)
+
+        if not opts.abstract and not opts.proxy and \
+                getattr(new_class.PublishMeta, 'publish_shadow_table', False):
+            _add_public_model(new_class, attrs)
+
         return new_class
 
+    def public_model(cls):
+        '''
+        the model public versions are stored in - the model itself, or a
+        generated sibling model when publish_shadow_table is set
+        '''
+        return cls._meta.concrete_model.__dict__.get('_public_model', cls)
+
+    def publish_field_plan(cls):
+        '''
+        the PublishFieldPlan for this model, compiled the first time
+        it is needed (once all the related models have been loaded)
+        '''
+        plan = cls.__dict__.get('_publish_field_plan')
+        if plan is None:
+            plan = PublishFieldPlan(cls)
+            cls._publish_field_plan = plan
+        return plan
+
+
+class PublishFieldPlan(object):
+    '''
+    the fields and relations to copy and follow when publishing a model,
+    worked out once from its fields and PublishMeta
+    '''
+    # ways of copying a field
+    COPY_VALUE = 0
+    COPY_RELATED = 1
+    COPY_PUBLISHABLE = 2
+
+    __slots__ = ('excluded_fields', 'copy_fields', 'fields', 'attnames',
+                 'foreign_keys', 'many_to_many', 'reverse_names',
+                 'reverse_relations', 'deletion_relations', 'fingerprinted')
+
+    def __init__(self, model):
+        set_ = super(PublishFieldPlan, self).__setattr__
+        publish_meta = model.PublishMeta
+        excluded_fields = frozenset(publish_meta.excluded_fields())
+        set_('excluded_fields', excluded_fields)
+
+        fields = tuple(field for field in model._meta.fields
+                       if field.name not in excluded_fields)
+        copy_fields = []
+        for field in fields:
+            if _publishable_fk(field):
+                how = self.COPY_PUBLISHABLE
+            elif isinstance(field, RelatedField):
+                how = self.COPY_RELATED
+            else:
+                how = self.COPY_VALUE
+            publish_function = publish_meta.find_publish_function(field.name,
+                                                                  None)
+            copy_fields.append((field, how, publish_function))
+        set_('fields', fields)
+        set_('attnames', tuple(field.attname for field in fields))
+        set_('copy_fields', tuple(copy_fields))
+        set_('foreign_keys', tuple(field for field in fields
+                                   if _publishable_fk(field)))
+
+        # m2m using a publishable "through" model are published as
+        # reverse relations, so aren't included here
+        many_to_many = []
+        for field in model._meta.many_to_many:
+            if field.name in excluded_fields or _publishable_through(field):
+                continue
+            many_to_many.append(
+                (field, issubclass(field.rel.to, Publishable)))
+        set_('many_to_many', tuple(many_to_many))
+
+        reverse_names = frozenset(_publish_reverse_names(model))
+        relations = tuple(
+            related for related in model._meta.get_all_related_objects()
+            if issubclass(related.model, Publishable)
+            and related.get_accessor_name() not in excluded_fields)
+        set_('reverse_names', reverse_names)
+        set_('reverse_relations', tuple(
+            related for related in relations
+            if related.get_accessor_name() in reverse_names))
+        set_('deletion_relations', relations)
+        set_('fingerprinted', issubclass(model, FingerprintedPublishable))
+
+        # public versions in a shadow table can't be related to
+        # other public versions (yet)
+        if model.public_model() is not model and \
+                (self.foreign_keys or relations or
+                 [field for field, publishable in many_to_many
+                  if publishable]):
+            raise PublishException(
+                "%s has publishable relations, so can't use "
+                "publish_shadow_table" % model._meta.object_name)
+        # nor can the public versions kept for earlier releases
+        if issubclass(model, ReleasedPublishable):
+            if getattr(model.PublishMeta, 'publish_history', False):
+                raise PublishException(
+                    "%s keeps its earlier public versions already, so "
+                    "can't use publish_history" % model._meta.object_name)
+            if model.public_model() is not model:
+                raise PublishException(
+                    "%s can't use both publish_shadow_table and releases"
+                    % model._meta.object_name)
+            if self.foreign_keys or relations or \
+                    [field for field, publishable in many_to_many
+                     if publishable]:
+                raise PublishException(
+                    "%s has publishable relations, so can't have releases"
+                    % model._meta.object_name)
+        for field in list(self.foreign_keys) + \
+                [field for field, publishable in many_to_many if publishable]:
+            if issubclass(field.rel.to, ReleasedPublishable):
+                raise PublishException(
+                    "%s.%s refers to %s, which has releases" % (
+                        model._meta.object_name, field.name,
+                        field.rel.to._meta.object_name))
+        for field in self.foreign_keys:
+            if field.rel.to.public_model() is not field.rel.to:
+                raise PublishException(
+                    "%s.%s refers to %s, which uses publish_shadow_table" % (
+                        model._meta.object_name, field.name,
+                        field.rel.to._meta.object_name))
+
+    def fingerprint(self, values, many_to_many):
+        '''
+        a stable hash of the values to copy (by attname) and the
+        many-to-many target ids (by field name) of a draft
+        '''
+        digest = sha1()
+        for attname in self.attnames:
+            digest.update(smart_str(values[attname]))
+            digest.update('\0')
+        for field, _ in self.many_to_many:
+            ids = sorted(many_to_many.get(field.name, []))
+            digest.update(','.join(smart_str(pk) for pk in ids))
+            digest.update('\0')
+        return digest.hexdigest()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PublishFieldPlan is read-only")
+
+
+class DirtyFieldsMixin(object):
+    '''
+    keeps track of which fields of a model have been changed
+    '''
+
+    def __init__(self, *arg, **kw):
+        super(DirtyFieldsMixin, self).__init__(*arg, **kw)
+        self._reset_dirty_fields()
+
+    def _reset_dirty_fields(self):
+        # remember the values as loaded/saved, so we can tell what changed
+        # (deferred fields haven't been loaded, so are left out)
+        self._saved_values = dict(
+            (field.attname, self.__dict__[field.attname])
+            for field in self._meta.fields
+            if not field.primary_key and field.attname in self.__dict__)
+
+    def dirty_fields(self):
+        '''
+        names of the fields that have changed since this object was
+        loaded or last saved
+        '''
+        # fields that were deferred, but have since been loaded or set,
+        # count as changed
+        saved_values = self._saved_values
+        return [field.name for field in self._meta.fields
+                if not field.primary_key and field.attname in self.__dict__
+                and (field.attname not in saved_values or
+                     self.__dict__[field.attname] !=
+                     saved_values[field.attname])]
+
 
-class Publishable(models.Model):
+class Publishable(DirtyFieldsMixin, models.Model):
     __metaclass__ = PublishableBase
 
     PUBLISH_DEFAULT = 0
@@ -107,10 +494,17 @@ class Publishable(models.Model):
         (PUBLISH_DELETE, 'To be deleted'))
 
     # make these available here so can easily re-use them in other code
+    # (positive conditions only, so they can use the
+    # (is_public, publish_state) index)
     Q_PUBLISHED = Q(is_public=True)
-    Q_DRAFT = Q(is_public=False) & ~Q(publish_state=PUBLISH_DELETE)
+    Q_DRAFT = Q(is_public=False,
+                publish_state__in=(PUBLISH_DEFAULT, PUBLISH_CHANGED))
     Q_CHANGED = Q(is_public=False, publish_state=PUBLISH_CHANGED)
     Q_DELETED = Q(is_public=False, publish_state=PUBLISH_DELETE)
+    Q_DRAFT_AND_DELETED = Q(is_public=False)
+    # drafts a publish has some work to do for
+    Q_UNPUBLISHED = Q(publish_state__in=(PUBLISH_CHANGED, PUBLISH_DELETE)) | \
+        Q(public__isnull=True)
 
     is_public = models.BooleanField(default=False, editable=False,
                                     db_index=True)
@@ -128,6 +522,9 @@ class Publishable(models.Model):
                                   'draft']
         publish_reverse_fields = []
         publish_functions = {}
+        publish_cache_keys = []
+        publish_shadow_table = False
+        publish_history = False
 
         @classmethod
         def _combined_fields(cls, field_name):
@@ -144,6 +541,10 @@ class Publishable(models.Model):
         def reverse_fields_to_publish(cls):
             return cls._combined_fields('publish_reverse_fields')
 
+        @classmethod
+        def cache_keys(cls):
+            return cls._combined_fields('publish_cache_keys')
+
         @classmethod
         def find_publish_function(cls, field_name, default_function):
             '''
@@ -174,39 +575,86 @@ class Publishable(models.Model):
                     "Attempting to save model marked for deletion")
             self.publish_state = Publishable.PUBLISH_CHANGED
 
+        if not arg and not kw.get('force_insert') \
+                and kw.get('update_fields') is None \
+                and kw.get('using') in (None, self._state.db) \
+                and self.pk is not None and not self._state.adding:
+            # write nothing at all if nothing has changed, otherwise
+            # (where we can) only the columns that have, publish_state
+            # included
+            update_fields = self.dirty_fields()
+            if not update_fields:
+                return
+            if SAVE_UPDATE_FIELDS:
+                update_fields.extend(field.name for field in self._meta.fields
+                                     if getattr(field, 'auto_now', False))
+                kw['update_fields'] = update_fields
+
+        # the state as saved before, if we know it (it may be deferred)
+        adding = self._state.adding
+        old_state = self._saved_values.get('publish_state', _UNKNOWN)
         super(Publishable, self).save(*arg, **kw)
+        self._reset_dirty_fields()
+        if not self.is_public and (adding or old_state is not _UNKNOWN):
+            _count_publish_states(self.__class__,
+                                  [None if adding else old_state],
+                                  self.publish_state)
 
     def delete(self, mark_for_deletion=True):
         if self.public and mark_for_deletion:
             self.publish_state = Publishable.PUBLISH_DELETE
             self.save(mark_changed=False)
         else:
+            # deleting a public version also deletes its draft.  the
+            # drafts deleted are taken off the publish counters by
+            # _count_deleted, so it needs to know their publish_state
+            if not self.is_public and \
+                    'publish_state' not in self._saved_values:
+                self._saved_values['publish_state'] = self.publish_state
             super(Publishable, self).delete()
 
     def undelete(self):
         self.publish_state = Publishable.PUBLISH_CHANGED
         self.save(mark_changed=False)
 
+    def rollback(self, to=None):
+        '''
+        restore the public version as it was before the publish run with
+        id to (or before the time to, if it is a datetime), or before the
+        latest publish if to is None.  needs PublishMeta publish_history
+        '''
+        return PublishHistory.objects.rollback(to, model=self.__class__,
+                                               object_ids=[self.pk])
+
     def _pre_publish(self, dry_run, all_published, deleted=False):
-        if not dry_run:
-            sender = self.__class__
+        all_published.signalled.append((self, deleted))
+        sender = self.__class__
+        if not dry_run and has_listeners(pre_publish, sender):
             pre_publish.send(sender=sender, instance=self, deleted=deleted)
 
     def _post_publish(self, dry_run, all_published, deleted=False):
-        if not dry_run:
+        sender = self.__class__
+        if not dry_run and has_listeners(post_publish, sender):
             # we need to make sure we get the instance that actually
             # got published (in case it was indirectly published elsewhere)
-            sender = self.__class__
             instance = all_published.original(self)
-            post_publish.send(sender=sender, instance=instance,
-                              deleted=deleted)
+            send_publish_signal(post_publish, sender, instance=instance,
+                                deleted=deleted)
 
-    def publish(self, dry_run=False, all_published=None, parent=None):
+    def publish(self, dry_run=False, all_published=None, parent=None,
+                release=None):
         '''
         either publish changes or deletions, depending on
         whether this model is public or draft.
         public models will be examined to see if they need deleting
         and deleted if so.
+
+        a dry run (that isn't part of a larger publish) returns a
+        PublishPlan of everything that would be published, which can
+        then be applied later with its execute() method.
+
+        if release (a PublishRelease or its id) is given, the changes
+        only go live when the release is activated.
         '''
         if self.is_public:
             raise PublishException(
@@ -215,37 +663,69 @@ class Publishable(models.Model):
         if self.pk is None:
             raise PublishException("Please save model before publishing")
 
+        plan = None
+        if parent is None:
+            if all_published is None:
+                all_published = PublishGraph()
+            if release is not None:
+                all_published.release = _release_id(release)
+            if dry_run:
+                from bulk import PublishPlan
+                plan = PublishPlan(all_published, roots=[self])
+            _prefetch_publish_graph([self], all_published)
+            if not dry_run and not all_published.running:
+                return _publish_run([self], all_published)[0]
+
         if self.publish_state == Publishable.PUBLISH_DELETE:
             self.publish_deletions(dry_run=dry_run,
                                    all_published=all_published,
                                    parent=parent)
-            return None
+            public_version = None
         else:
-            return self.publish_changes(dry_run=dry_run,
-                                        all_published=all_published,
-                                        parent=parent)
+            public_version = self.publish_changes(dry_run=dry_run,
+                                                  all_published=all_published,
+                                                  parent=parent)
+        if plan is not None:
+            return plan
+        return public_version
 
     def _get_public_or_publish(self, *arg, **kw):
         # only publish if we don't yet have an id for the
         # public model
-        if self.public:
+        if self.public_id is not None:
             return self.public
         return self.publish(*arg, **kw)
 
-    def _get_through_model(self, field_object):
-        '''
-        Get the "through" model associated with this field.
-        Need to handle things differently for Django1.1 vs Django1.2
-        In 1.1 through is a string and through_model has class
-        In 1.2 through is the class
-        '''
-        through = field_object.rel.through
-        if not through:
-            return None
-
-        if isinstance(through, basestring):
-            return field_object.rel.through_model
-        return through
+    def _publish_related(self, all_published, name, load):
+        # use the related objects loaded by _prefetch_publish_graph
+        # if we have them, otherwise load them now
+        key = (graph_key(self), name)
+        if key not in all_published.related:
+            all_published.related[key] = load()
+        return all_published.related[key]
+
+    def _many_to_many_items(self, all_published, field, publishable):
+        # publishable targets as instances, others as ids
+        name = field.name
+        if publishable:
+            return self._publish_related(
+                all_published, name, lambda: list(getattr(self, name).all()))
+        return self._publish_related(
+            all_published, name,
+            lambda: list(getattr(self, name).values_list('pk', flat=True)))
+
+    def _publish_fingerprint(self, all_published):
+        field_plan = self.__class__.publish_field_plan()
+        values = dict((attname, getattr(self, attname))
+                      for attname in field_plan.attnames)
+        many_to_many = {}
+        for field, publishable in field_plan.many_to_many:
+            items = self._many_to_many_items(all_published, field,
+                                             publishable)
+            if publishable:
+                items = [item.pk for item in items]
+            many_to_many[field.name] = items
+        return field_plan.fingerprint(values, many_to_many)
 
     def publish_changes(self, dry_run=False, all_published=None, parent=None):
         '''
@@ -262,129 +742,161 @@ class Publishable(models.Model):
 
         # avoid mutual recursion
         if all_published is None:
-            all_published = NestedSet()
+            all_published = PublishGraph()
+        if parent is None and not dry_run and not all_published.running:
+            # called directly, so this is a run of its own
+            return _publish_run([self], all_published,
+                                method='publish_changes')[0]
 
         if self in all_published:
+            if parent is not None:
+                all_published.add_edge(parent, self)
             return all_published.original(self).public
 
         all_published.add(self, parent=parent)
 
-        self._pre_publish(dry_run, all_published)
-
         public_version = self.public
         if not public_version:
-            public_version = self.__class__(is_public=True)
+            public_version = self.__class__.public_model()(is_public=True)
+
+        field_plan = self.__class__.publish_field_plan()
+
+        fingerprint = None
+        if field_plan.fingerprinted and \
+                self.publish_state == Publishable.PUBLISH_CHANGED:
+            fingerprint = self._publish_fingerprint(all_published)
+            if public_version.pk is not None and \
+                    public_version.publish_fingerprint == fingerprint:
+                # nothing to copy since the last publish, so just
+                # update the state
+                if not dry_run:
+                    self.publish_state = Publishable.PUBLISH_DEFAULT
+                    self.publish_fingerprint = fingerprint
+                    self.save(mark_changed=False)
+                self._publish_reverse_relations(dry_run, all_published)
+                return public_version
+
+        superseded = None
+        release = all_published.release
+        if release is not None and isinstance(self, ReleasedPublishable) \
+                and self.publish_state == Publishable.PUBLISH_CHANGED:
+            if public_version.pk is not None and \
+                    public_version.release_from != release:
+                # keep the public version for the releases before this one
+                superseded = public_version
+                public_version = self.__class__.public_model()(is_public=True)
+            public_version.release_from = release
 
-        excluded_fields = self.PublishMeta.excluded_fields()
-        reverse_fields_to_publish = \
-            self.PublishMeta.reverse_fields_to_publish()
+        self._pre_publish(dry_run, all_published)
+
+        recorder = None
+        if not dry_run and self.PublishMeta.publish_history:
+            from history import HistoryRecorder
+            recorder = HistoryRecorder(all_published)
+            recorder.before([self])
 
         if self.publish_state == Publishable.PUBLISH_CHANGED:
             # copy over regular fields
-            for field in self._meta.fields:
-                if field.name in excluded_fields:
+            for field, how, publish_function in field_plan.copy_fields:
+                if how == PublishFieldPlan.COPY_PUBLISHABLE:
+                    value = self._publish_related(
+                        all_published, field.name,
+                        lambda: getattr(self, field.name))
+                    if value is not None:
+                        if value.public_id is not None \
+                                and publish_function is None:
+                            # no need to load the public version
+                            if not dry_run:
+                                setattr(public_version, field.attname,
+                                        value.public_id)
+                            continue
+                        value = value._get_public_or_publish(
+                            dry_run=dry_run, all_published=all_published,
+                            parent=self)
+                elif how == PublishFieldPlan.COPY_RELATED \
+                        and publish_function is None:
+                    # no need to load the related object to copy it
+                    if not dry_run:
+                        setattr(public_version, field.attname,
+                                getattr(self, field.attname))
                     continue
-
-                value = getattr(self, field.name)
-                if isinstance(field, RelatedField):
-                    related = field.rel.to
-                    if issubclass(related, Publishable):
-                        if value is not None:
-                            value = value._get_public_or_publish(
-                                dry_run=dry_run, all_published=all_published,
-                                parent=self)
+                else:
+                    value = getattr(self, field.name)
 
                 if not dry_run:
-                    publish_function = self.PublishMeta.find_publish_function(
-                        field.name, setattr)
+                    publish_function = publish_function or setattr
                     publish_function(public_version, field.name, value)
 
             # save the public version and update
             # state so we know everything is up-to-date
             if not dry_run:
+                if fingerprint is not None:
+                    public_version.publish_fingerprint = fingerprint
+                    self.publish_fingerprint = fingerprint
                 public_version.save()
+                if superseded is not None:
+                    superseded.release_to = release
+                    superseded.save()
                 self.public = public_version
                 self.publish_state = Publishable.PUBLISH_DEFAULT
                 self.save(mark_changed=False)
 
         # copy over many-to-many fields
-        for field in self._meta.many_to_many:
-            name = field.name
-            if name in excluded_fields:
-                continue
-
-            m2m_manager = getattr(self, name)
-            public_objs = list(m2m_manager.all())
-
-            field_object, model, direct, m2m = self._meta.get_field_by_name(
-                name)
-            through_model = self._get_through_model(field_object)
-            if through_model:
-                # see if we can work out which reverse relationship this is
-                # see if we are using our own "through" table or not
-                if issubclass(through_model, Publishable):
-                    # this will be db name (e.g. with _id on end)
-                    m2m_reverse_name = field_object.m2m_reverse_name()
-                    for reverse_field in through_model._meta.fields:
-                        if reverse_field.column == m2m_reverse_name:
-                            related_name = reverse_field.name
-                            related_field = getattr(through_model,
-                                                    related_name).field
-                            reverse_name = \
-                                related_field.related.get_accessor_name()
-                            reverse_fields_to_publish.append(reverse_name)
-                            break
-                    continue  # m2m via through table won't be dealt with here
-
-            related = field_object.rel.to
-            if issubclass(related, Publishable):
-                public_objs = [
-                    p._get_public_or_publish(
-                        dry_run=dry_run,
-                        all_published=all_published,
-                        parent=self) for p in public_objs
-                ]
+        for field, publishable in field_plan.many_to_many:
+            related_items = self._many_to_many_items(all_published, field,
+                                                     publishable)
+            if publishable:
+                public_ids = []
+                for p in related_items:
+                    if p.public_id is not None:
+                        public_ids.append(p.public_id)
+                        continue
+                    public = p._get_public_or_publish(
+                        dry_run=dry_run, all_published=all_published,
+                        parent=self)
+                    if public is not None and public.pk is not None:
+                        public_ids.append(public.pk)
+            else:
+                public_ids = related_items
 
             if not dry_run:
-                public_m2m_manager = getattr(public_version, name)
-                old_objs = public_m2m_manager.exclude(
-                    pk__in=[p.pk for p in public_objs])
-                public_m2m_manager.remove(*old_objs)
-                public_m2m_manager.add(*public_objs)
+                _sync_through_rows(_public_field(field),
+                                   [public_version.pk],
+                                   set((public_version.pk, target_id)
+                                       for target_id in public_ids))
 
-        # one-to-many and one-to-one reverse relations
-        for obj in self._meta.get_all_related_objects():
-            if issubclass(obj.model, Publishable):
-                name = obj.get_accessor_name()
-                if name in excluded_fields:
-                    continue
-                if name not in reverse_fields_to_publish:
-                    continue
-                if obj.field.rel.multiple:
-                    related_items = getattr(self, name).all()
-                else:
-                    try:
-                        related_items = [getattr(self, name)]
-                    except obj.model.DoesNotExist:
-                        related_items = []
-
-                for related_item in related_items:
-                    related_item.publish(dry_run=dry_run,
-                                         all_published=all_published,
-                                         parent=self)
-
-                # make sure we tidy up anything that needs deleting
-                if self.public and not dry_run:
-                    if obj.field.rel.multiple:
-                        public_ids = [r.public_id for r in related_items]
-                        deleted_items = getattr(self.public, name).exclude(
-                            pk__in=public_ids)
-                        deleted_items.delete(mark_for_deletion=False)
+        if recorder is not None:
+            recorder.after()
+
+        self._publish_reverse_relations(dry_run, all_published)
 
         self._post_publish(dry_run, all_published)
 
         return public_version
 
+    def _publish_reverse_relations(self, dry_run, all_published):
+        # one-to-many and one-to-one reverse relations
+        field_plan = self.__class__.publish_field_plan()
+        for obj in field_plan.reverse_relations:
+            name = obj.get_accessor_name()
+            # only the children with unpublished changes
+            related_items = self._publish_related(
+                all_published, name,
+                lambda: _load_reverse(self, obj, unpublished_only=True))
+
+            for related_item in related_items:
+                related_item.publish(dry_run=dry_run,
+                                     all_published=all_published,
+                                     parent=self)
+
+            # make sure we tidy up anything that needs deleting
+            # (public children whose draft no longer belongs to us)
+            if self.public and not dry_run:
+                if obj.field.rel.multiple:
+                    deleted_items = getattr(self.public, name).exclude(
+                        **{'draft__' + obj.field.name: self.pk})
+                    deleted_items.delete(mark_for_deletion=False)
+
     def publish_deletions(self, all_published=None, parent=None,
                           dry_run=False):
         '''
@@ -394,34 +906,1017 @@ class Publishable(models.Model):
             return
 
         if all_published is None:
-            all_published = NestedSet()
+            all_published = PublishGraph()
 
         if self in all_published:
             return
 
+        if parent is None and not dry_run and not all_published.running:
+            # called directly, so this is a run of its own
+            _publish_run([self], all_published, method='publish_deletions')
+            return
+
         all_published.add(self, parent=parent)
 
         self._pre_publish(dry_run, all_published, deleted=True)
 
-        for related in self._meta.get_all_related_objects():
-            if not issubclass(related.model, Publishable):
-                continue
+        field_plan = self.__class__.publish_field_plan()
+        for related in field_plan.deletion_relations:
             name = related.get_accessor_name()
-            if name in self.PublishMeta.excluded_fields():
-                continue
-            try:
-
-                instances = getattr(self, name).all()
-            except AttributeError:
-                instances = [getattr(self, name)]
+            instances = self._publish_related(
+                all_published, name, lambda: _load_reverse(self, related))
             for instance in instances:
                 instance.publish_deletions(all_published=all_published,
                                            parent=self, dry_run=dry_run)
 
         if not dry_run:
+            from history import HistoryRecorder, records_history
+            recorder = None
+            if records_history([self]):
+                recorder = HistoryRecorder(all_published)
+                recorder.before([self])
             public = self.public
+            release = all_published.release
             self.delete(mark_for_deletion=False)
-            if public:
+            if public and release is not None and \
+                    isinstance(public, ReleasedPublishable) and \
+                    public.release_from != release:
+                # keep it for the releases before this one
+                public.release_to = release
+                public.save()
+            elif public:
                 public.delete(mark_for_deletion=False)
+            if recorder is not None:
+                recorder.after()
 
         self._post_publish(dry_run, all_published, deleted=True)
+
+
+class FingerprintedPublishable(Publishable):
+    '''
+    a Publishable that stores a fingerprint of its content when published,
+    so that publishing a draft that was saved without really being changed
+    only resets its publish_state
+    '''
+    publish_fingerprint = models.CharField(max_length=40, blank=True,
+                                           editable=False)
+
+    class Meta:
+        abstract = True
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_exclude_fields = ['publish_fingerprint']
+
+
+class PublishCheckpointManager(models.Manager):
+    def start(self, name, model):
+        '''
+        the checkpoint to record the progress of a chunked publish of
+        model in, carrying on from where the last run got to if it
+        didn't finish
+        '''
+        content_type = ContentType.objects.get_for_model(model)
+        checkpoint, created = self.get_or_create(
+            name=name, defaults={'content_type': content_type})
+        if checkpoint.content_type_id != content_type.pk:
+            raise PublishException(
+                "Checkpoint %s is for %s, not %s" % (
+                    name, checkpoint.content_type, content_type))
+        return checkpoint
+
+
+class PublishCheckpoint(models.Model):
+    '''
+    how far a chunked publish has got, so it can be resumed.
+    it is removed when the publish finishes
+    '''
+    name = models.CharField(max_length=100, unique=True)
+    content_type = models.ForeignKey(ContentType)
+    last_pk = models.CharField(max_length=255, blank=True)
+    published = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = PublishCheckpointManager()
+
+    def __unicode__(self):
+        return u'%s (%d published)' % (self.name, self.published)
+
+    def get_last_pk(self):
+        if not self.last_pk:
+            return None
+        model = self.content_type.model_class()
+        return model._meta.pk.to_python(self.last_pk)
+
+
+class PublishCounterManager(models.Manager):
+    # the publish states with a backlog worth counting
+    COUNTED_STATES = {
+        'changed': Publishable.PUBLISH_CHANGED,
+        'deleted': Publishable.PUBLISH_DELETE,
+    }
+
+    def enabled(self):
+        return getattr(settings, 'PUBLISH_COUNTERS', False)
+
+    def adjust(self, model, publish_state, delta):
+        '''
+        add delta to the count of drafts of model in publish_state
+        '''
+        if not delta or publish_state not in self.COUNTED_STATES.values():
+            return
+        content_type = ContentType.objects.get_for_model(model)
+        counters = self.filter(content_type=content_type,
+                               publish_state=publish_state)
+        if not counters.update(count=F('count') + delta):
+            self.create(content_type=content_type,
+                        publish_state=publish_state, count=delta)
+
+    def backlog(self, models=None):
+        '''
+        the changed and deleted counts for models (or every model with
+        counters), as {model: {'changed': n, 'deleted': n}}
+        '''
+        counters = self.all()
+        backlog = {}
+        if models is not None:
+            content_types = ContentType.objects.get_for_models(*models)
+            counters = counters.filter(content_type__in=content_types.values())
+            for model in models:
+                backlog[model] = dict.fromkeys(self.COUNTED_STATES, 0)
+        names = dict((state, name)
+                     for name, state in self.COUNTED_STATES.items())
+        for content_type_id, publish_state, count in counters.values_list(
+                'content_type', 'publish_state', 'count'):
+            model = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            if model is None:
+                continue
+            counts = backlog.setdefault(
+                model, dict.fromkeys(self.COUNTED_STATES, 0))
+            counts[names[publish_state]] = count
+        return backlog
+
+    @transaction.commit_on_success
+    def recount(self, model):
+        '''
+        reset the counters for model from the drafts themselves
+        '''
+        content_type = ContentType.objects.get_for_model(model)
+        counts = dict(model._base_manager.filter(is_public=False)
+                      .values_list('publish_state')
+                      .annotate(Count('pk')).order_by())
+        for publish_state in self.COUNTED_STATES.values():
+            count = counts.get(publish_state, 0)
+            if not self.filter(content_type=content_type,
+                               publish_state=publish_state) \
+                    .update(count=count):
+                self.create(content_type=content_type,
+                            publish_state=publish_state, count=count)
+
+
+class PublishCounter(models.Model):
+    '''
+    the number of drafts of a model in a publish state, kept up-to-date
+    as drafts are saved, deleted and published when PUBLISH_COUNTERS
+    is set, so the backlog can be read without counting the tables
+    '''
+    content_type = models.ForeignKey(ContentType)
+    publish_state = models.IntegerField(choices=Publishable.PUBLISH_CHOICES)
+    count = models.IntegerField(default=0)
+
+    objects = PublishCounterManager()
+
+    class Meta:
+        unique_together = [('content_type', 'publish_state')]
+
+    def __unicode__(self):
+        return u'%s %s: %d' % (self.content_type,
+                               self.get_publish_state_display(), self.count)
+
+
+class PublishCacheGenerationManager(models.Manager):
+    def bump(self, model):
+        '''
+        move model on to its next generation, returning it
+        '''
+        content_type = ContentType.objects.get_for_model(model)
+        generations = self.filter(content_type=content_type)
+        if not generations.update(generation=F('generation') + 1):
+            self.create(content_type=content_type, generation=1)
+        return generations.values_list('generation', flat=True)[0]
+
+    def current(self):
+        '''
+        the current generation of every model that has one
+        '''
+        generations = {}
+        for content_type_id, generation in self.values_list('content_type',
+                                                            'generation'):
+            model = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            if model is not None:
+                generations[model] = generation
+        return generations
+
+
+class PublishCacheGeneration(models.Model):
+    '''
+    counts the publishes of a model, so every process using the
+    published object cache can tell when its cached objects are stale
+    '''
+    content_type = models.ForeignKey(ContentType, unique=True)
+    generation = models.PositiveIntegerField(default=0)
+
+    objects = PublishCacheGenerationManager()
+
+    def __unicode__(self):
+        return u'%s: %d' % (self.content_type, self.generation)
+
+
+class PublishJobManager(models.Manager):
+    def enqueue(self, objects, user=None):
+        '''
+        queue up a draft (or a queryset/list of drafts) to be published
+        in the background by the publish_worker command.  drafts that
+        already have a pending job are not queued again.  returns the
+        number of new jobs
+        '''
+        if isinstance(objects, Publishable):
+            objects = [objects]
+        user_id = getattr(user, 'pk', None)
+        by_type = {}
+        for obj in objects:
+            content_type = ContentType.objects.get_for_model(obj)
+            ids = by_type.setdefault(content_type, [])
+            object_id = force_unicode(obj.pk)
+            if object_id not in ids:
+                ids.append(object_id)
+
+        jobs = []
+        for content_type, ids in by_type.items():
+            pending = set(self.filter(status=PublishJob.STATUS_PENDING,
+                                      content_type=content_type,
+                                      object_id__in=ids)
+                          .values_list('object_id', flat=True))
+            jobs.extend(PublishJob(content_type=content_type,
+                                   object_id=object_id, user_id=user_id)
+                        for object_id in ids if object_id not in pending)
+        self.bulk_create(jobs)
+        return len(jobs)
+
+    @transaction.commit_on_success
+    def claim(self, batch_size, timeout=None):
+        '''
+        claim up to batch_size pending jobs for this worker, marking them
+        as running.  the rows are locked while they are claimed, so
+        several workers can run at once.  if timeout is given, jobs that
+        have been running for longer than timeout seconds (left behind
+        by a worker that died) are claimed again too
+        '''
+        claimable = Q(status=PublishJob.STATUS_PENDING)
+        if timeout is not None:
+            claimable |= Q(status=PublishJob.STATUS_RUNNING,
+                           started__lt=timezone.now() -
+                           timedelta(seconds=timeout))
+        jobs = list(self.select_for_update().filter(claimable)
+                    .order_by('pk')[:batch_size])
+        if jobs:
+            started = timezone.now()
+            self.filter(pk__in=[job.pk for job in jobs]) \
+                .update(status=PublishJob.STATUS_RUNNING, started=started)
+            for job in jobs:
+                job.status = PublishJob.STATUS_RUNNING
+                job.started = started
+        return jobs
+
+
+class PublishJob(models.Model):
+    '''
+    a draft waiting to be published by the publish_worker command
+    '''
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'), (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'), (STATUS_FAILED, 'Failed'))
+
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.CharField(max_length=255)
+    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'),
+                             null=True, blank=True)
+    status = models.IntegerField(choices=STATUS_CHOICES,
+                                 default=STATUS_PENDING, db_index=True)
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = PublishJobManager()
+
+    class Meta:
+        ordering = ['pk']
+
+    def __unicode__(self):
+        return u'%s %s (%s)' % (self.content_type, self.object_id,
+                                self.get_status_display())
+
+    def duration(self):
+        if self.started and self.finished:
+            return self.finished - self.started
+        return None
+
+    def run(self):
+        '''
+        publish the draft, recording how it went
+        '''
+        try:
+            self._publish()
+        except Exception:
+            self.status = PublishJob.STATUS_FAILED
+            self.error = traceback.format_exc()
+        else:
+            self.status = PublishJob.STATUS_DONE
+            self.error = ''
+        self.finished = timezone.now()
+        self.save()
+
+    @transaction.commit_on_success
+    def _publish(self):
+        model = self.content_type.model_class()
+        obj = model._default_manager.get(pk=self.object_id)
+        obj.publish()
+        if self.user_id is not None:
+            from django.contrib.admin.models import LogEntry, CHANGE
+            LogEntry.objects.log_action(
+                self.user_id, self.content_type_id, obj.pk,
+                force_unicode(obj), CHANGE, 'Published')
+
+
+class ScheduledPublishable(Publishable):
+    '''
+    a Publishable that can be published, and withdrawn again,
+    automatically at given times by the publish_scheduled command
+    '''
+    publish_at = models.DateTimeField(
+        'Publish at', null=True, blank=True, db_index=True,
+        help_text='When to publish this automatically (optional)')
+    # copied to the public version, where the expiry sweep looks for it
+    expire_at = models.DateTimeField(
+        'Expire at', null=True, blank=True, db_index=True,
+        help_text='When to delete this automatically, once published '
+                  '(optional)')
+
+    class Meta:
+        abstract = True
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_exclude_fields = ['publish_at']
+
+
+class ReleasedPublishable(Publishable):
+    '''
+    a Publishable whose changes can be published to a PublishRelease,
+    to go live along with everything else in it when the release is
+    activated.  the public versions a release replaces (or deletes) are
+    kept, so the content as of an earlier release can still be read
+    '''
+    # a public version is in the releases from release_from up to, but
+    # not including, release_to.  those published outside of a release
+    # are in all of them until replaced
+    RELEASE_OPEN = 2147483647
+
+    release_from = models.IntegerField(default=0, editable=False)
+    release_to = models.IntegerField(default=RELEASE_OPEN, editable=False)
+
+    class Meta:
+        abstract = True
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_exclude_fields = ['release_from', 'release_to']
+
+    @staticmethod
+    def release_q(release_id):
+        '''
+        the public versions in the release with release_id
+        '''
+        return Q(release_from__lte=release_id, release_to__gt=release_id)
+
+    @staticmethod
+    def live_release_sql(model, connection):
+        '''
+        sql selecting model's public versions in the live release, which
+        is read from PublishReleasePointer by a subquery
+        '''
+        qn = connection.ops.quote_name
+        table = qn(model._meta.db_table)
+        pointer_opts = PublishReleasePointer._meta
+        live = 'COALESCE((SELECT %s FROM %s WHERE %s = 1), 0)' % (
+            qn(pointer_opts.get_field('release').column),
+            qn(pointer_opts.db_table), qn(pointer_opts.pk.column))
+        return '%s.%s <= %s AND %s.%s > %s' % (
+            table, qn(model._meta.get_field('release_from').column), live,
+            table, qn(model._meta.get_field('release_to').column), live)
+
+
+class PublishReleaseManager(models.Manager):
+    def live_id(self):
+        '''
+        the id of the live release, or 0 if no release has been activated
+        '''
+        ids = PublishReleasePointer.objects.filter(pk=1) \
+            .values_list('release', flat=True)
+        return (ids and ids[0]) or 0
+
+    def live(self):
+        release_id = self.live_id()
+        if release_id:
+            return self.get(pk=release_id)
+        return None
+
+    def activate(self, release):
+        '''
+        make release (a PublishRelease or its id) live, along with
+        everything in the releases before it
+        '''
+        release_id = getattr(release, 'pk', release)
+        pointers = PublishReleasePointer.objects.filter(pk=1)
+        if not pointers.update(release=release_id):
+            PublishReleasePointer.objects.create(pk=1, release_id=release_id)
+        self.filter(pk=release_id, activated__isnull=True) \
+            .update(activated=timezone.now())
+        from cache import published_cache
+        if published_cache.max_size:
+            for model in get_models():
+                if issubclass(model, ReleasedPublishable):
+                    published_cache.invalidate(model)
+
+
+class PublishRelease(models.Model):
+    '''
+    a set of changes to publish that go live together
+    '''
+    name = models.CharField(max_length=200, blank=True)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    activated = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = PublishReleaseManager()
+
+    def activate(self):
+        PublishRelease.objects.activate(self)
+
+    def is_live(self):
+        return PublishRelease.objects.live_id() == self.pk
+
+    def __unicode__(self):
+        return self.name or u'Release %s' % self.pk
+
+
+class PublishReleasePointer(models.Model):
+    '''
+    the single row pointing at the live release, so switching
+    releases is a single row update
+    '''
+    release = models.ForeignKey(PublishRelease, null=True)
+
+
+class PublishHistoryManager(models.Manager):
+    def rollback(self, to=None, model=None, object_ids=None):
+        '''
+        restore public versions as they were before the publish run with
+        id to (or before the time to, if it is a datetime), undoing every
+        later publish of the objects involved.  if to is None the latest
+        publish of each of model's objects with object_ids is undone.
+        returns the number of objects restored
+        '''
+        from history import rollback
+        return rollback(to, model, object_ids)
+
+    def prune(self, before=None, keep=None, batch_size=CHUNK_SIZE):
+        '''
+        delete the entries from before the time before and/or all but the
+        latest keep entries of each object, batch_size at a time.  returns
+        the number of entries deleted
+        '''
+        from history import prune
+        return prune(before, keep, batch_size)
+
+
+class PublishHistory(models.Model):
+    '''
+    how a public version was before a publish run changed, deleted or
+    created it, for models with PublishMeta publish_history.  only the
+    fields and many-to-many ids the publish changed are kept, compressed
+    '''
+    ACTION_CREATED = 0
+    ACTION_CHANGED = 1
+    ACTION_DELETED = 2
+
+    ACTION_CHOICES = (
+        (ACTION_CREATED, 'Created'), (ACTION_CHANGED, 'Changed'),
+        (ACTION_DELETED, 'Deleted'))
+
+    content_type = models.ForeignKey(ContentType)
+    # of the draft
+    object_id = models.CharField(max_length=255)
+    public_id = models.CharField(max_length=255)
+    run = models.CharField(max_length=32, db_index=True)
+    action = models.IntegerField(choices=ACTION_CHOICES)
+    published = models.DateTimeField(default=timezone.now, db_index=True)
+    data = models.TextField(blank=True)
+
+    objects = PublishHistoryManager()
+
+    class Meta:
+        ordering = ['pk']
+        if INDEX_TOGETHER:
+            index_together = [('content_type', 'object_id')]
+
+    def __unicode__(self):
+        return u'%s %s %s (%s)' % (self.content_type, self.object_id,
+                                   self.get_action_display(), self.run)
+
+    def values(self):
+        '''
+        the fields (by attname) and many-to-many ids (by field name)
+        the public version had before this publish
+        '''
+        from history import decode
+        return decode(self.data)
+
+
+class PublicShadowManager(models.Manager):
+    def published(self):
+        '''all public/published objects'''
+        return self.get_query_set()
+
+
+class PublicShadow(DirtyFieldsMixin, models.Model):
+    '''
+    the base of the models generated to store the public versions
+    of models with publish_shadow_table set
+    '''
+    is_public = models.BooleanField(default=True, editable=False)
+
+    # public versions are always up-to-date
+    publish_state = Publishable.PUBLISH_DEFAULT
+
+    objects = PublicShadowManager()
+
+    class Meta:
+        abstract = True
+
+    def get_publish_state_display(self):
+        return dict(Publishable.PUBLISH_CHOICES)[self.publish_state]
+
+    def save(self, mark_changed=True, *arg, **kw):
+        super(PublicShadow, self).save(*arg, **kw)
+        self._reset_dirty_fields()
+
+    def delete(self, mark_for_deletion=True):
+        # deleting a public version also deletes its draft
+        super(PublicShadow, self).delete()
+
+
+def _add_public_model(model, attrs):
+    '''
+    generate the sibling model with the same fields as model for its
+    public versions to go in, and point model's public field at it
+    '''
+    opts = model._meta
+    model_attrs = attrs
+    attrs = {
+        '__module__': model.__module__,
+        '_draft_model': model,
+        'Meta': type('Meta', (object,), {
+            'app_label': opts.app_label,
+            'db_table': opts.db_table + '_public',
+            'ordering': opts.ordering,
+        }),
+    }
+    for field in opts.local_fields + opts.local_many_to_many:
+        if field.primary_key or field.name in ('is_public', 'publish_state',
+                                               'public'):
+            continue
+        field = copy.deepcopy(field)
+        if field.rel is not None:
+            # no reverse relations from other models to public versions
+            field.rel.related_name = '+'
+            if getattr(field.rel, 'through', None) is not None and \
+                    field.rel.through._meta.auto_created:
+                field.rel.through = None
+        attrs[field.name] = field
+    # methods of the model itself (e.g. get_absolute_url), though not
+    # ones PublicShadow already has, which may call super().  the model's
+    # own methods are taken from before Django wrapped get_absolute_url
+    for klass in reversed(model.__mro__):
+        if not issubclass(klass, Publishable) or \
+                klass.__module__ == __name__:
+            continue
+        methods = klass.__dict__
+        if klass is model:
+            methods = model_attrs
+        for name, value in methods.items():
+            if isinstance(value, (types.FunctionType, property, classmethod,
+                                  staticmethod)) \
+                    and not hasattr(PublicShadow, name):
+                attrs[name] = value
+    public_model = type(opts.object_name + 'Public', (PublicShadow,), attrs)
+
+    # swap the public field (a one-to-one to model itself)
+    # for one to the public model
+    public = opts.get_field('public')
+    opts.local_fields.remove(public)
+    for attr in ('_field_cache', '_field_name_cache', '_name_map'):
+        if hasattr(opts, attr):
+            delattr(opts, attr)
+    delattr(model, 'draft')
+    delattr(model, 'public')
+    models.OneToOneField(public_model, related_name='draft', null=True,
+                         editable=False).contribute_to_class(model, 'public')
+    model._public_model = public_model
+
+
+def _public_field(field):
+    '''
+    the field of field's model's public model that corresponds to it
+    '''
+    public_model = field.model.public_model()
+    if public_model is field.model:
+        return field
+    return public_model._meta.get_field(field.name)
+
+
+def _release_id(release):
+    release_id = getattr(release, 'pk', release)
+    if release_id < PublishRelease.objects.live_id():
+        raise PublishException("Can't publish to release %s, as a later "
+                               "release is live" % release_id)
+    return release_id
+
+
+def _publish_roots(roots, all_published, bulk=False, batch_size=None,
+                   dry_run=False):
+    _prefetch_publish_graph(roots, all_published)
+    if dry_run or (bulk and all_published.release is None):
+        from bulk import PublishPlan
+        plan = PublishPlan(all_published, batch_size=batch_size, bulk=bulk,
+                           roots=roots)
+        for p in roots:
+            p.publish(dry_run=True, all_published=all_published)
+        if dry_run:
+            return plan
+        plan.execute()
+        return
+    _publish_run(roots, all_published)
+
+
+def _publish_run(roots, all_published, method='publish'):
+    '''
+    publish roots one at a time (with the given Publishable method) as a
+    single run, sending the batch signals before and after it
+    '''
+    all_published.running = True
+    try:
+        if has_listeners(pre_publish_batch):
+            # a dry run on a copy of the graph tells us what will get
+            # published, reusing the related objects already loaded
+            preview = PublishGraph()
+            preview.related = all_published.related
+            preview.prefetched = all_published.prefetched
+            preview.running = True
+            for p in roots:
+                getattr(p, method)(dry_run=True, all_published=preview)
+            _send_batch(pre_publish_batch, preview.signalled)
+
+        start = len(all_published.signalled)
+        public_versions = [getattr(p, method)(all_published=all_published)
+                           for p in roots]
+        if has_listeners(post_publish_batch):
+            _send_batch(post_publish_batch, all_published.signalled[start:])
+    finally:
+        all_published.running = False
+    return public_versions
+
+
+def _send_batch(signal, signalled):
+    '''
+    send signal once per model and deleted flag, for
+    (instance, deleted) pairs
+    '''
+    groups = []
+    by_key = {}
+    for instance, deleted in signalled:
+        key = (instance.__class__, deleted)
+        if key not in by_key:
+            by_key[key] = []
+            groups.append((key, by_key[key]))
+        by_key[key].append(instance)
+    for (sender, deleted), instances in groups:
+        send_publish_signal(signal, sender, instances=instances,
+                            deleted=deleted)
+
+
+_UNKNOWN = object()
+
+
+def _count_publish_states(model, old_states, new_state):
+    '''
+    move drafts of model from old_states (None for a new draft) to
+    new_state (None for a deleted draft) in the publish counters
+    '''
+    if not PublishCounter.objects.enabled():
+        return
+    moved = {}
+    for old_state in old_states:
+        if old_state != new_state:
+            moved[old_state] = moved.get(old_state, 0) + 1
+    for old_state, count in moved.items():
+        PublishCounter.objects.adjust(model, old_state, -count)
+        PublishCounter.objects.adjust(model, new_state, count)
+
+
+def _count_deleted(sender, instance, **kwargs):
+    '''
+    take drafts off the publish counters as they are deleted - including
+    those deleted along with something else, and by QuerySet.delete()
+    '''
+    if instance.is_public:
+        return
+    state = instance._saved_values.get(
+        'publish_state', instance.__dict__.get('publish_state', _UNKNOWN))
+    if state is not _UNKNOWN:
+        _count_publish_states(sender, [state], None)
+
+
+def _draft_states(model, **filters):
+    if not PublishCounter.objects.enabled():
+        return []
+    return list(model._base_manager.filter(is_public=False, **filters)
+                .values_list('publish_state', flat=True))
+
+
+def _group_by_model(items):
+    groups = []
+    by_model = {}
+    for item in items:
+        model = item.__class__
+        if model not in by_model:
+            by_model[model] = []
+            groups.append((model, by_model[model]))
+        by_model[model].append(item)
+    return groups
+
+
+def _publishable_fk(field):
+    return isinstance(field, RelatedField) and \
+        issubclass(field.rel.to, Publishable)
+
+
+def _publishable_through(field):
+    through = field.rel.through
+    return isinstance(through, type) and issubclass(through, Publishable)
+
+
+def _publish_reverse_names(model):
+    '''
+    names of the reverse relations to publish along with model
+    '''
+    excluded_fields = model.PublishMeta.excluded_fields()
+    reverse_fields = model.PublishMeta.reverse_fields_to_publish()
+    # m2m using a publishable "through" model are published as
+    # reverse relations of the "through" model
+    for field in model._meta.many_to_many:
+        if field.name in excluded_fields or not _publishable_through(field):
+            continue
+        through = field.rel.through
+        # this will be db name (e.g. with _id on end)
+        m2m_reverse_name = field.m2m_reverse_name()
+        for reverse_field in through._meta.fields:
+            if reverse_field.column == m2m_reverse_name:
+                reverse_fields.append(
+                    reverse_field.related.get_accessor_name())
+                break
+    return reverse_fields
+
+
+def _through_columns(field):
+    '''
+    the "through" model of a m2m field and the names of the
+    columns pointing at the source and target objects
+    '''
+    through = field.rel.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    return through, source, target
+
+
+def _sync_through_rows(field, source_ids, wanted, batch_size=None,
+                       using=None):
+    '''
+    make the "through" rows of the m2m field for the objects with
+    source_ids match the (source id, target id) pairs in wanted,
+    deleting and inserting only the rows that differ
+    '''
+    through, source, target = _through_columns(field)
+    manager = through._base_manager.db_manager(using)
+    existing = set()
+    stale = []
+    for chunk in chunked(source_ids, CHUNK_SIZE):
+        rows = manager.filter(**{source + '__in': chunk}) \
+            .values_list('pk', source, target)
+        for pk, source_id, target_id in rows:
+            if (source_id, target_id) in wanted:
+                existing.add((source_id, target_id))
+            else:
+                stale.append(pk)
+
+    for chunk in chunked(stale, CHUNK_SIZE):
+        manager.filter(pk__in=chunk).delete()
+    manager.bulk_create([through(**{source: source_id, target: target_id})
+                         for source_id, target_id in wanted - existing],
+                        batch_size=batch_size or CHUNK_SIZE)
+
+
+def _load_reverse(instance, related, unpublished_only=False):
+    if related.field.rel.multiple:
+        items = getattr(instance, related.get_accessor_name()).all()
+        if unpublished_only:
+            items = items.filter(Publishable.Q_UNPUBLISHED)
+        return list(items)
+    try:
+        item = getattr(instance, related.get_accessor_name())
+    except related.model.DoesNotExist:
+        return []
+    if unpublished_only and item.public_id is not None and \
+            item.publish_state == Publishable.PUBLISH_DEFAULT:
+        return []
+    return [item]
+
+
+def _load_in(queryset, field_name, ids, q=None):
+    if q is not None:
+        queryset = queryset.filter(q)
+    for chunk in chunked(set(ids), CHUNK_SIZE):
+        for item in queryset.filter(**{field_name + '__in': chunk}):
+            yield item
+
+
+def _prefetch_publish_graph(roots, all_published):
+    '''
+    load everything a publish of roots is going to visit, a level
+    at a time, so that each model and relation takes one query per level
+    rather than one query per object.  the related objects are cached in
+    all_published, for publish_changes and publish_deletions to use.
+    '''
+    loaded = {}
+
+    def identity(item):
+        # make sure we only ever have one instance for each object
+        key = graph_key(item)
+        if key not in loaded:
+            loaded[key] = all_published.original(item)
+        return loaded[key]
+
+    level = [identity(root) for root in roots]
+    while level:
+        found = []
+        for model, items in _group_by_model(level):
+            items = [item for item in items if isinstance(item, Publishable)
+                     and graph_key(item) not in all_published.prefetched]
+            if items:
+                found.extend(_prefetch_relations(model, items, all_published,
+                                                 identity))
+        level = []
+        queued = set()
+        for item in found:
+            key = graph_key(item)
+            if key not in queued and key not in all_published.prefetched:
+                queued.add(key)
+                level.append(item)
+
+
+def _prefetch_relations(model, items, all_published, identity):
+    # load the relations of items that a publish will follow
+    # and return the related objects that it will go on to visit
+    related = all_published.related
+    field_plan = model.publish_field_plan()
+    found = []
+
+    deleting = [item for item in items
+                if item.publish_state == Publishable.PUBLISH_DELETE]
+    changing = [item for item in items
+                if item.publish_state != Publishable.PUBLISH_DELETE]
+    changed = [item for item in changing
+               if item.publish_state == Publishable.PUBLISH_CHANGED]
+
+    for item in items:
+        all_published.prefetched.add(graph_key(item))
+
+    # public versions
+    cache_name = model._meta.get_field('public').get_cache_name()
+    ids = [item.public_id for item in items if item.public_id is not None
+           and not hasattr(item, cache_name)]
+    publics = dict((public.pk, public) for public in
+                   _load_in(model.public_model()._base_manager, 'pk', ids))
+    for item in items:
+        if item.public_id in publics:
+            setattr(item, cache_name, publics[item.public_id])
+
+    # foreign keys
+    for field in field_plan.foreign_keys:
+        # keep using any related objects that are already loaded
+        targets = {}
+        ids = []
+        for item in changed:
+            pk = getattr(item, field.attname)
+            if hasattr(item, field.get_cache_name()):
+                target = getattr(item, field.get_cache_name())
+                if target is not None:
+                    targets[pk] = identity(target)
+            elif pk is not None:
+                ids.append(pk)
+        targets.update((target.pk, identity(target)) for target in
+                       _load_in(field.rel.to._base_manager, 'pk',
+                                [pk for pk in ids if pk not in targets]))
+        for item in changed:
+            target = targets.get(getattr(item, field.attname))
+            related[(graph_key(item), field.name)] = target
+            if target is not None and target.public_id is None:
+                found.append(target)
+
+    # many-to-many
+    for field, publishable in field_plan.many_to_many:
+        if not changing:
+            break
+        through, source, target = _through_columns(field)
+        pairs = list(_load_in(through._base_manager
+                              .values_list(source, target), source,
+                              [item.pk for item in changing]))
+        target_ids = {}
+        for source_id, target_id in pairs:
+            target_ids.setdefault(source_id, []).append(target_id)
+
+        if publishable:
+            # by pk, along with their place in the default ordering
+            targets = dict(
+                (obj.pk, (position, identity(obj))) for position, obj in
+                enumerate(_load_in(field.rel.to._default_manager, 'pk',
+                                   [target_id for _, target_id in pairs])))
+            for item in changing:
+                items = [targets[target_id] for target_id
+                         in set(target_ids.get(item.pk, []))
+                         if target_id in targets]
+                items = [obj for _, obj in sorted(items)]
+                related[(graph_key(item), field.name)] = items
+                found.extend(obj for obj in items if obj.public_id is None)
+        else:
+            for item in changing:
+                related[(graph_key(item), field.name)] = \
+                    target_ids.get(item.pk, [])
+
+    # reverse relations
+    for rel in field_plan.deletion_relations:
+        name = rel.get_accessor_name()
+        parents = deleting
+        if name in field_plan.reverse_names:
+            parents = changing + deleting
+        if not parents:
+            continue
+
+        if rel.field.rel.multiple:
+            manager = rel.model._default_manager
+        else:
+            manager = rel.model._base_manager
+        # children that don't have any unpublished changes
+        # can be skipped, along with everything below them
+        children = {}
+        for child in _load_in(manager, rel.field.attname,
+                              [item.pk for item in parents],
+                              Publishable.Q_UNPUBLISHED):
+            child = identity(child)
+            children.setdefault(getattr(child, rel.field.attname),
+                                []).append(child)
+
+        for item in parents:
+            items = children.get(item.pk, [])
+            related[(graph_key(item), name)] = items
+            if item.publish_state == Publishable.PUBLISH_DELETE:
+                items = [obj for obj in items if obj.publish_state ==
+                         Publishable.PUBLISH_DELETE]
+            found.extend(items)
+
+    return found
+
+
+def _invalidate_cache(sender, instances, **kw):
+    # keeps the published object cache up-to-date when publishing
+    from cache import published_cache
+    if published_cache.max_size:
+        published_cache.invalidate(sender, [instance.public_id
+                                            for instance in instances])
+
+
+post_publish_batch.connect(_invalidate_cache)
@@ -0,0 +1,84 @@
+from collections import namedtuple
+from multiprocessing import Pool
+import traceback
+
+from django.db import connections, transaction
+from django.db.models import get_model
+
+from models import PublishException
+from utils import PublishGraph, chunked, CHUNK_SIZE
+
+
+# the items in one independent part of a publish, and the
+# traceback if publishing them failed (None otherwise)
+PublishResult = namedtuple('PublishResult', 'items error')
+
+
+def publish_in_parallel(queryset, processes, all_published=None, bulk=False,
+                        batch_size=None):
+    '''
+    work out everything that publishing queryset involves, split it into
+    parts that don't depend on each other and publish each part in its own
+    transaction, using a pool of processes.  returns a PublishResult
+    for each part.  our connections are closed before the processes are
+    started, so this can't be called inside a transaction
+    '''
+    if processes != 1:
+        for alias in connections:
+            if transaction.is_managed(using=alias):
+                raise PublishException(
+                    "Can't publish with processes inside a transaction "
+                    "(on database %s)" % alias)
+    if all_published is None:
+        all_published = PublishGraph()
+    queryset.publish(all_published, dry_run=True)
+    components = all_published.components()
+
+    tasks = []
+    for items in components:
+        roots = {}
+        for item in items:
+            if all_published.parent(item) is None:
+                opts = item._meta
+                roots.setdefault((opts.app_label, opts.object_name),
+                                 []).append(item.pk)
+        tasks.append((roots.items(), bulk, batch_size))
+
+    if processes == 1:
+        errors = map(_publish_component, tasks)
+    else:
+        # don't share our connections with the worker processes
+        _close_connections()
+        pool = Pool(processes, initializer=_close_connections)
+        try:
+            errors = pool.map(_publish_component, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [PublishResult(items, error)
+            for items, error in zip(components, errors)]
+
+
+def _close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def _publish_component(task):
+    roots, bulk, batch_size = task
+    try:
+        _publish_roots(roots, bulk, batch_size)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+@transaction.commit_on_success
+def _publish_roots(roots, bulk, batch_size):
+    all_published = PublishGraph()
+    for (app_label, object_name), ids in roots:
+        model = get_model(app_label, object_name)
+        for chunk in chunked(ids, CHUNK_SIZE):
+            model._default_manager.filter(pk__in=chunk).publish(
+                all_published, bulk=bulk, batch_size=batch_size)
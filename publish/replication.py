@@ -0,0 +1,145 @@
+from collections import namedtuple
+import copy
+from multiprocessing.pool import ThreadPool
+import time
+import traceback
+
+from django.db import connections, transaction
+from django.utils.datastructures import SortedDict
+
+from bulk import _load_pairs, _synced_many_to_many
+from models import Publishable, PublishException, _group_by_model, \
+    _public_field, _sync_through_rows
+from utils import PublishGraph, bulk_upsert, chunked, CHUNK_SIZE
+
+
+# how copying the public versions to a database went: the traceback if
+# it failed (None otherwise) and how many seconds it took
+ReplicationResult = namedtuple('ReplicationResult', 'database error seconds')
+
+
+def publish_to(queryset, databases, all_published=None, batch_size=None):
+    '''
+    publish queryset (in bulk) and then copy the public versions involved
+    into each of databases, each in its own thread and transaction.
+    the publish graph and public versions are only loaded once, from
+    queryset's database.  returns a ReplicationResult per database.
+    '''
+    for database in databases:
+        if database not in connections.databases:
+            raise PublishException("No database called %r" % database)
+    if all_published is None:
+        all_published = PublishGraph()
+    plan = queryset.publish(all_published, bulk=True, dry_run=True,
+                            batch_size=batch_size)
+    nodes = list(plan)
+    # publishing the deletions forgets the public ids
+    deleted = [copy.copy(node) for node in nodes
+               if node.publish_state == Publishable.PUBLISH_DELETE
+               and node.public_id is not None]
+    plan.execute()
+
+    changes = _Changes([node for node in nodes
+                        if node.publish_state != Publishable.PUBLISH_DELETE],
+                       deleted)
+
+    pool = ThreadPool(len(databases))
+    try:
+        return pool.map(lambda database: _replicate(database, changes,
+                                                    batch_size),
+                        databases)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class _Changes(object):
+    '''
+    the public rows (and their many-to-many rows) to copy to
+    each database, loaded from the source database
+    '''
+
+    def __init__(self, published, deleted):
+        # public model -> {pk: public version}
+        self.rows = SortedDict()
+        # (public m2m field, public ids, set of (source id, target id))
+        self.many_to_many = []
+        # (public model, parent column, parent ids, child ids to keep)
+        self.children = []
+        # (public model, public ids)
+        self.deleted = []
+
+        for model, nodes in _group_by_model(published):
+            public_ids = [node.public_id for node in nodes
+                          if node.public_id is not None]
+            if not public_ids:
+                continue
+            self._load_rows(model.public_model(), 'pk', public_ids)
+            for field in _synced_many_to_many(model):
+                field = _public_field(field)
+                self.many_to_many.append(
+                    (field, public_ids, set(_load_pairs(field, public_ids))))
+            for related in model.publish_field_plan().reverse_relations:
+                if related.field.rel.multiple:
+                    # all of the public children, so that any others
+                    # left in the target databases can be removed
+                    child_model = related.model.public_model()
+                    column = related.field.attname
+                    children = self._load_rows(child_model, column,
+                                               public_ids)
+                    self.children.append(
+                        (child_model, column, public_ids,
+                         set(child.pk for child in children)))
+
+        for model, nodes in _group_by_model(deleted):
+            self.deleted.append((model.public_model(),
+                                 [node.public_id for node in nodes]))
+
+    def _load_rows(self, model, column, ids):
+        rows = self.rows.setdefault(model, SortedDict())
+        loaded = []
+        for chunk in chunked(ids, CHUNK_SIZE):
+            loaded.extend(model._base_manager
+                          .filter(**{column + '__in': chunk}))
+        for row in loaded:
+            rows[row.pk] = row
+        return loaded
+
+
+def _replicate(database, changes, batch_size):
+    start = time.time()
+    error = None
+    try:
+        _apply(database, changes, batch_size)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        # each thread has its own connection
+        connections[database].close()
+    return ReplicationResult(database, error, time.time() - start)
+
+
+def _apply(database, changes, batch_size):
+    with transaction.commit_on_success(using=database):
+        for model, rows in changes.rows.items():
+            bulk_upsert(rows.values(), batch_size=batch_size,
+                        using=database)
+
+        for field, public_ids, wanted in changes.many_to_many:
+            _sync_through_rows(field, public_ids, wanted,
+                               batch_size=batch_size, using=database)
+
+        for model, column, parent_ids, keep in changes.children:
+            manager = model._base_manager.db_manager(database)
+            stale = []
+            for chunk in chunked(parent_ids, CHUNK_SIZE):
+                stale.extend(pk for pk in manager.filter(
+                    **{column + '__in': chunk}).values_list('pk', flat=True)
+                    if pk not in keep)
+            for chunk in chunked(stale, CHUNK_SIZE):
+                manager.filter(pk__in=chunk).delete()
+
+        for model, public_ids in changes.deleted:
+            manager = model._base_manager.db_manager(database)
+            for chunk in chunked(public_ids, CHUNK_SIZE):
+                manager.filter(pk__in=chunk).delete()
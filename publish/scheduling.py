@@ -0,0 +1,106 @@
+import traceback
+
+from django.db import transaction
+from django.db.models import get_models
+from django.utils import timezone
+
+from models import Publishable, ScheduledPublishable, _publish_roots, \
+    _count_publish_states, _draft_states
+from utils import PublishGraph
+
+
+def scheduled_models():
+    return [model for model in get_models()
+            if issubclass(model, ScheduledPublishable)]
+
+
+def publish_due(models=None, now=None, batch_size=100, failures=None):
+    '''
+    publish the drafts whose publish_at time has come, reading batch_size
+    at a time.  only the due rows are read (using the index on publish_at),
+    so this is cheap when nothing is due.  each draft is published in its
+    own transaction, so one that fails doesn't hold up the rest: it is left
+    due, to be tried again next time, and (draft, traceback) is appended to
+    failures if given.  returns the number published
+    '''
+    if now is None:
+        now = timezone.now()
+    published = 0
+    for model in models or scheduled_models():
+        due = model._default_manager.filter(publish_at__lte=now) \
+            .order_by('publish_at', 'pk')
+        failed = []
+        while True:
+            roots = list(_excluding(due, failed)[:batch_size])
+            if not roots:
+                break
+            for root in roots:
+                if _run(_publish_root, root, failures):
+                    published += 1
+                else:
+                    failed.append(root.pk)
+    return published
+
+
+def _excluding(queryset, pks):
+    if pks:
+        queryset = queryset.exclude(pk__in=pks)
+    return queryset
+
+
+def _run(func, obj, failures):
+    try:
+        func(obj)
+    except Exception:
+        if failures is None:
+            raise
+        failures.append((obj, traceback.format_exc()))
+        return False
+    return True
+
+
+@transaction.commit_on_success
+def _publish_root(root):
+    # clear publish_at first, so the root isn't due again.  the root is
+    # saved when it is published, so it needs clearing there too
+    type(root)._base_manager.filter(pk=root.pk).update(publish_at=None)
+    root.publish_at = None
+    _publish_roots([root], PublishGraph())
+
+
+def expire_due(models=None, now=None, batch_size=100, failures=None):
+    '''
+    withdraw published content whose expire_at time has come, by marking
+    the drafts for deletion and publishing the deletions, reading
+    batch_size at a time.  only the expired public rows are read (using
+    the index on expire_at).  as with publish_due each draft is expired in
+    its own transaction, and failures are appended to failures if given.
+    returns the number of drafts deleted
+    '''
+    if now is None:
+        now = timezone.now()
+    expired = 0
+    for model in models or scheduled_models():
+        due = model._default_manager.filter(public__expire_at__lte=now) \
+            .order_by('pk')
+        failed = []
+        while True:
+            drafts = list(_excluding(due, failed)[:batch_size])
+            if not drafts:
+                break
+            for draft in drafts:
+                if _run(_expire, draft, failures):
+                    expired += 1
+                else:
+                    failed.append(draft.pk)
+    return expired
+
+
+@transaction.commit_on_success
+def _expire(draft):
+    model = type(draft)
+    drafts = model._default_manager.filter(pk=draft.pk)
+    _count_publish_states(model, _draft_states(model, pk=draft.pk),
+                          Publishable.PUBLISH_DELETE)
+    drafts.update(publish_state=Publishable.PUBLISH_DELETE)
+    drafts.publish_deletions()
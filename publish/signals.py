@@ -1,6 +1,115 @@
+import threading
+from functools import wraps
+
 import django.dispatch
+from django.dispatch.dispatcher import _make_id
+from django.db import transaction
+from django.utils.datastructures import SortedDict
 
 # instance is the instance being published, deleted is a boolean to indicate
 # whether the instance was being deleted (rather than changed)
 pre_publish = django.dispatch.Signal(providing_args=['instance', 'deleted'])
 post_publish = django.dispatch.Signal(providing_args=['instance', 'deleted'])
+
+# sent once per model for a whole publish run, with instances being the
+# list of instances of that model published (or deleted) in the run
+pre_publish_batch = django.dispatch.Signal(providing_args=['instances',
+                                                           'deleted'])
+post_publish_batch = django.dispatch.Signal(providing_args=['instances',
+                                                            'deleted'])
+
+_deferred = threading.local()
+
+
+def has_listeners(signal, sender=None):
+    '''
+    whether signal has any receivers for sender (Signal.has_listeners()
+    is new in Django 1.5)
+    '''
+    if hasattr(signal, 'has_listeners'):
+        return signal.has_listeners(sender)
+    return bool(signal._live_receivers(_make_id(sender)))
+
+
+def _instance_key(instance):
+    # deleted instances have lost their pk by the time post_publish is sent
+    if instance.pk is None:
+        return id(instance)
+    return instance.pk
+
+
+def send_publish_signal(signal, sender, **kwargs):
+    '''
+    send one of the publish signals - though inside defer_post_publish
+    post_publish and post_publish_batch are held on to until the
+    transaction commits
+    '''
+    events = getattr(_deferred, 'events', None)
+    if events is None or signal not in (post_publish, post_publish_batch):
+        signal.send(sender=sender, **kwargs)
+        return
+    deleted = kwargs['deleted']
+    if signal is post_publish_batch:
+        key = (signal, sender, deleted)
+        instances = events.setdefault(key, SortedDict())
+        for instance in kwargs['instances']:
+            instances[_instance_key(instance)] = instance
+    else:
+        key = (signal, sender, _instance_key(kwargs['instance']), deleted)
+        events[key] = kwargs['instance']
+
+
+def _deliver(events):
+    for key, value in events.items():
+        signal, sender, deleted = key[0], key[1], key[-1]
+        if signal is post_publish_batch:
+            signal.send(sender=sender, instances=value.values(),
+                        deleted=deleted)
+        else:
+            signal.send(sender=sender, instance=value, deleted=deleted)
+
+
+class defer_post_publish(object):
+    '''
+    context manager (or decorator) that runs its block in a transaction
+    and only sends post_publish and post_publish_batch once it has
+    committed, at most once per instance.  nothing is sent if the block
+    raises.
+
+    the signals are sent from pool (e.g. a ThreadPool) when given,
+    instead of from the current thread.
+    '''
+
+    def __init__(self, using=None, pool=None):
+        self.using = using
+        self.pool = pool
+
+    def __enter__(self):
+        self.outermost = getattr(_deferred, 'events', None) is None
+        if self.outermost:
+            _deferred.events = SortedDict()
+        self.transaction = transaction.commit_on_success(using=self.using)
+        self.transaction.__enter__()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.transaction.__exit__(exc_type, exc_value, tb)
+        except BaseException:
+            exc_type = True
+            raise
+        finally:
+            if self.outermost:
+                events = _deferred.events
+                _deferred.events = None
+                if exc_type is None and events:
+                    if self.pool is None:
+                        _deliver(events)
+                    else:
+                        self.pool.apply_async(_deliver, (events,))
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with self.__class__(self.using, self.pool):
+                return func(*args, **kwargs)
+        return inner
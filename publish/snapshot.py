@@ -0,0 +1,284 @@
+'''
+export the published content to, and import it from, a snapshot file.
+
+a snapshot is newline-delimited JSON, a section per model: a header
+record naming the model and its columns, followed by a record (a JSON
+list) per public version.  each many-to-many field then gets a header
+record of its own, followed by a [source id, target id] record per row
+of its "through" table.
+
+snapshots whose name ends in .gz are compressed, a gzip member per
+model, so that each model can be read without decompressing the others.
+the byte offset and length of each model's section is written to an
+index alongside the snapshot (its name with .index on the end).
+'''
+import gzip
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import get_model, get_models
+
+from models import Publishable, PublishException, ReleasedPublishable, \
+    _through_columns
+from utils import bulk_upsert, chunked, CHUNK_SIZE
+
+FORMAT = 1
+
+_READ_SIZE = 64 * 1024
+
+
+def snapshot_models():
+    '''
+    the models that have public versions to export
+    '''
+    return [model for model in get_models()
+            if issubclass(model, Publishable) and not model._meta.proxy]
+
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+
+def _get_model(label):
+    try:
+        app_label, model_name = label.split('.')
+    except ValueError:
+        raise PublishException("Expected app_label.ModelName, not %r"
+                               % label)
+    model = get_model(app_label, model_name)
+    if model is None or not issubclass(model, Publishable):
+        raise PublishException("%s is not a Publishable model" % label)
+    return model
+
+
+def _index_path(path):
+    return path + '.index'
+
+
+def _is_compressed(path):
+    return path.endswith('.gz')
+
+
+class _Section(object):
+    '''
+    writes the records of one model's section, compressing them if need be
+    '''
+
+    def __init__(self, out, compressed):
+        self.out = out
+        self.offset = out.tell()
+        self.records = 0
+        self._file = out
+        if compressed:
+            self._file = gzip.GzipFile(filename='', mode='wb', fileobj=out)
+
+    def write(self, record):
+        self._file.write(json.dumps(record, cls=DjangoJSONEncoder,
+                                    separators=(',', ':')))
+        self._file.write('\n')
+        if not isinstance(record, dict):
+            self.records += 1
+
+    def close(self):
+        if self._file is not self.out:
+            # leaves out open
+            self._file.close()
+        return {'offset': self.offset,
+                'length': self.out.tell() - self.offset,
+                'records': self.records}
+
+
+def export_published(path, models=None, batch_size=CHUNK_SIZE,
+                     using=None):
+    '''
+    stream the public versions of models (all of the publishable models
+    by default) and their many-to-many rows to a snapshot at path, a batch
+    at a time.  returns the index written alongside it.
+    '''
+    if models is None:
+        models = snapshot_models()
+    compressed = _is_compressed(path)
+    index = {'format': FORMAT, 'compressed': compressed, 'models': {}}
+    with open(path, 'wb') as out:
+        for model in models:
+            section = _Section(out, compressed)
+            _export_model(section, model, batch_size, using)
+            index['models'][model_label(model)] = section.close()
+    with open(_index_path(path), 'wb') as out:
+        json.dump(index, out, indent=1, sort_keys=True)
+    return index
+
+
+def _export_model(section, model, batch_size, using):
+    published = model._default_manager.db_manager(using).published()
+    if issubclass(model, ReleasedPublishable):
+        # the public versions of every release, not just the live one
+        published = model._base_manager.db_manager(using) \
+            .filter(Publishable.Q_PUBLISHED)
+    attnames = [field.attname for field in published.model._meta.fields]
+    pk_name = published.model._meta.pk.attname
+    attnames.remove(pk_name)
+    attnames.insert(0, pk_name)
+
+    section.write({'model': model_label(model), 'fields': attnames})
+    for row in _keyset(published.values_list(*attnames), 'pk', batch_size):
+        section.write(row)
+
+    for field in published.model._meta.many_to_many:
+        if not field.rel.through._meta.auto_created:
+            # publishable "through" models are exported as models of their own
+            continue
+        through, source, target = _through_columns(field)
+        rows = through._base_manager.db_manager(using).filter(
+            **{source + '__in': published.values('pk')}) \
+            .values_list('pk', source, target)
+        section.write({'model': model_label(model), 'm2m': field.name})
+        for row in _keyset(rows, 'pk', batch_size):
+            section.write(row[1:])
+
+
+def _keyset(queryset, pk_name, batch_size):
+    # page through queryset in pk order, rather than with OFFSET,
+    # expecting each row to start with the pk
+    queryset = queryset.order_by(pk_name)
+    last_pk = None
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(**{pk_name + '__gt': last_pk})
+        count = 0
+        for row in batch[:batch_size].iterator():
+            count += 1
+            last_pk = row[0]
+            yield row
+        if count < batch_size:
+            break
+
+
+def read_index(path):
+    with open(_index_path(path), 'rb') as index_file:
+        index = json.load(index_file)
+    if index.get('format') != FORMAT:
+        raise PublishException("Unknown snapshot format %r"
+                               % index.get('format'))
+    return index
+
+
+def _read_records(path, index, labels):
+    with open(path, 'rb') as snapshot:
+        for label in labels:
+            try:
+                section = index['models'][label]
+            except KeyError:
+                raise PublishException("%s is not in the snapshot" % label)
+            snapshot.seek(section['offset'])
+            for line in _read_lines(snapshot, section['length'],
+                                    index['compressed']):
+                yield json.loads(line)
+
+
+def _read_lines(snapshot, length, compressed):
+    decompressor = None
+    if compressed:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = ''
+    while length > 0:
+        data = snapshot.read(min(length, _READ_SIZE))
+        if not data:
+            break
+        length -= len(data)
+        if decompressor is not None:
+            data = decompressor.decompress(data)
+        lines = (pending + data).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def import_published(path, models=None, batch_size=CHUNK_SIZE, using=None):
+    '''
+    load the public versions in the snapshot at path (only those of
+    models, if given) in batches, adding or updating them and adding
+    their many-to-many rows, all in one transaction.  returns the number
+    of records (public versions and many-to-many rows) loaded per model.
+    '''
+    index = read_index(path)
+    if models is None:
+        labels = sorted(index['models'])
+    else:
+        labels = [model_label(model) for model in models]
+    counts = dict((label, 0) for label in labels)
+
+    with transaction.commit_on_success(using=using):
+        batch = []
+        loader = None
+        for record in _read_records(path, index, labels):
+            if isinstance(record, dict):
+                if loader is not None:
+                    loader.load(batch)
+                batch = []
+                loader = _Loader(record, batch_size, using)
+                continue
+            batch.append(record)
+            counts[loader.label] += 1
+            if len(batch) >= batch_size:
+                loader.load(batch)
+                batch = []
+        if loader is not None:
+            loader.load(batch)
+    return counts
+
+
+class _Loader(object):
+    '''
+    loads the records of the section with the given header
+    '''
+
+    def __init__(self, header, batch_size, using):
+        self.label = header['model']
+        self.batch_size = batch_size
+        self.using = using
+        model = _get_model(self.label)
+        self.model = model.public_model()
+        self.many_to_many = None
+        if 'm2m' in header:
+            self.many_to_many = self.model._meta.get_field(header['m2m'])
+        else:
+            by_attname = dict((field.attname, field)
+                              for field in self.model._meta.fields)
+            try:
+                self.fields = [(attname, by_attname[attname])
+                               for attname in header['fields']]
+            except KeyError, e:
+                raise PublishException("%s has no field %s"
+                                       % (self.label, e.args[0]))
+
+    def load(self, records):
+        if not records:
+            return
+        if self.many_to_many is not None:
+            self._load_pairs(records)
+            return
+        rows = []
+        for record in records:
+            values = dict((attname, field.to_python(value))
+                          for (attname, field), value
+                          in zip(self.fields, record))
+            rows.append(self.model(**values))
+        bulk_upsert(rows, batch_size=self.batch_size, using=self.using)
+
+    def _load_pairs(self, records):
+        through, source, target = _through_columns(self.many_to_many)
+        manager = through._base_manager.db_manager(self.using)
+        wanted = set(tuple(record) for record in records)
+        for chunk in chunked(set(s for s, _ in wanted), CHUNK_SIZE):
+            wanted.difference_update(
+                manager.filter(**{source + '__in': chunk})
+                .values_list(source, target))
+        manager.bulk_create([through(**{source: s, target: t})
+                             for s, t in wanted],
+                            batch_size=self.batch_size)
@@ -1,7 +1,10 @@
 from django.conf import settings
 from publish.tests import settings_for_test
 
-settings.configure(settings_for_test)
+# scripts (e.g. the benchmarks) may have configured their own settings
+if not settings.configured:
+    settings.configure(settings_for_test)
 
 from django.core.management import call_command
-call_command('syncdb', interactive=False)
+for database in settings.DATABASES:
+    call_command('syncdb', interactive=False, database=database)
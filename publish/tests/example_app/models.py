@@ -1,6 +1,7 @@
 from datetime import datetime
 from django.db import models
-from publish.models import Publishable
+from publish.models import Publishable, FingerprintedPublishable, \
+    ScheduledPublishable, ReleasedPublishable
 
 
 class Site(models.Model):
@@ -20,6 +21,9 @@ class FlatPage(Publishable):
     class Meta:
         ordering = ['url']
 
+    class PublishMeta(Publishable.PublishMeta):
+        publish_cache_keys = ['url']
+
     def get_absolute_url(self):
         if self.is_public:
             return self.url
@@ -109,3 +113,109 @@ class PageTagOrder(Publishable):
     tagged_page = models.ForeignKey(Page)
     page_tag = models.ForeignKey(Tag)
     tag_order = models.IntegerField()
+
+
+class Article(FingerprintedPublishable):
+    title = models.CharField(max_length=200)
+    content = models.TextField(blank=True)
+    sites = models.ManyToManyField(Site, blank=True)
+    authors = models.ManyToManyField(Author, blank=True)
+
+    def __unicode__(self):
+        return self.title
+
+
+class Event(ScheduledPublishable):
+    title = models.CharField(max_length=200)
+
+    class PublishMeta(ScheduledPublishable.PublishMeta):
+        publish_reverse_fields = ['eventsession_set']
+
+    def __unicode__(self):
+        return self.title
+
+
+class EventSession(Publishable):
+    event = models.ForeignKey(Event)
+    title = models.CharField(max_length=200)
+
+
+class Notice(Publishable):
+    '''public versions are kept in their own table'''
+    url = models.CharField(max_length=100, db_index=True)
+    title = models.CharField(max_length=200)
+    sites = models.ManyToManyField(Site)
+
+    class Meta:
+        ordering = ['url']
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_shadow_table = True
+        publish_cache_keys = ['url']
+
+    def get_absolute_url(self):
+        if self.is_public:
+            return self.url
+        return '%s*' % self.url
+
+    def __unicode__(self):
+        return self.title
+
+
+class LinkedNotice(Publishable):
+    '''can't be published, as shadow tables don't support related
+    public versions'''
+    parent = models.ForeignKey('self', null=True)
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_shadow_table = True
+
+
+class Bulletin(ReleasedPublishable):
+    slug = models.CharField(max_length=100, db_index=True)
+    title = models.CharField(max_length=200)
+    sites = models.ManyToManyField(Site, blank=True)
+
+    class Meta:
+        ordering = ['slug']
+
+    class PublishMeta(ReleasedPublishable.PublishMeta):
+        publish_cache_keys = ['slug']
+
+    def __unicode__(self):
+        return self.title
+
+
+class LinkedBulletin(ReleasedPublishable):
+    '''can't be published, as releases don't support related
+    public versions'''
+    parent = models.ForeignKey('self', null=True)
+
+
+class Story(Publishable):
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    sites = models.ManyToManyField(Site, blank=True)
+
+    class Meta:
+        ordering = ['title']
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_history = True
+        publish_reverse_fields = ['storynote_set']
+
+    def __unicode__(self):
+        return self.title
+
+
+class StoryNote(Publishable):
+    story = models.ForeignKey(Story)
+    note = models.CharField(max_length=200)
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_history = True
+
+
+class LandingPage(FlatPage):
+    '''a publishable model extending another by multi-table inheritance'''
+    tagline = models.CharField(max_length=200, blank=True)
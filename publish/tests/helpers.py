@@ -1,5 +1,23 @@
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
 def _get_rendered_content(response):
     content = getattr(response, 'rendered_content', None)
     if content is not None:
         return content
     return response.content
+
+
+def _queries_run(func, using=DEFAULT_DB_ALIAS):
+    '''
+    call func, returning its result and the sql of the queries it ran
+    on the database using
+    '''
+    connection = connections[using]
+    connection.use_debug_cursor = True
+    try:
+        start = len(connection.queries)
+        result = func()
+        return result, [query['sql'] for query in connection.queries[start:]]
+    finally:
+        connection.use_debug_cursor = None
@@ -10,7 +10,20 @@ DATABASES = {
         'NAME': 'test.db',
         'USER': '',
         'PASSWORD': '',
-    }
+    },
+    # targets for publishing to other databases
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'test_replica.db',
+        'USER': '',
+        'PASSWORD': '',
+    },
+    'replica2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'test_replica2.db',
+        'USER': '',
+        'PASSWORD': '',
+    },
 }
 INSTALLED_APPS = (
     'django.contrib.contenttypes',
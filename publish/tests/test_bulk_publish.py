@@ -0,0 +1,206 @@
+from django.test import TestCase
+from publish.bulk import BulkPublisher
+from publish.models import Publishable
+from publish.signals import pre_publish, post_publish
+from publish.tests.example_app.models import Page, PageBlock, Author, \
+    FlatPage, LandingPage, Site, update_pub_date
+from publish.tests.helpers import _queries_run
+from publish.utils import NestedSet
+
+
+class TestBulkPublish(TestCase):
+    def setUp(self):
+        super(TestBulkPublish, self).setUp()
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.page2 = Page.objects.create(slug='page2', title='page 2')
+        self.child1 = Page.objects.create(parent=self.page1, slug='child1',
+                                          title='Child 1')
+        self.child2 = Page.objects.create(parent=self.page1, slug='child2',
+                                          title='Child 2')
+        self.child3 = Page.objects.create(parent=self.page2, slug='child3',
+                                          title='Child 3')
+
+    def test_bulk_publish(self):
+        Page.objects.draft().publish(bulk=True)
+
+        self.failUnlessEqual(5, Page.objects.draft().count())
+        self.failUnlessEqual(5, Page.objects.published().count())
+        self.failUnlessEqual(0, Page.objects.changed().count())
+
+        child1 = Page.objects.get(id=self.child1.id)
+        child3 = Page.objects.get(id=self.child3.id)
+        page1 = Page.objects.get(id=self.page1.id)
+        page2 = Page.objects.get(id=self.page2.id)
+        self.failUnlessEqual(page1.public, child1.public.parent)
+        self.failUnlessEqual(page2.public, child3.public.parent)
+        self.failUnless(page1.public.parent is None)
+        self.failUnless(child1.public.is_public)
+        self.failUnless(child1.public.public is None)
+        self.failUnlessEqual('/page1/child1/',
+                             child1.public.get_absolute_url())
+
+    def test_bulk_publish_records_published(self):
+        all_published = NestedSet()
+        Page.objects.draft().publish(all_published, bulk=True)
+        self.failUnlessEqual(5, len(all_published))
+
+    def test_bulk_publish_repeated(self):
+        Page.objects.draft().publish(bulk=True)
+        public_ids = set(Page.objects.published().values_list('id',
+                                                              flat=True))
+
+        page1 = Page.objects.get(id=self.page1.id)
+        page1.title = 'New Title'
+        page1.save()
+
+        Page.objects.draft().publish(bulk=True)
+        self.failUnlessEqual(public_ids,
+                             set(Page.objects.published()
+                                 .values_list('id', flat=True)))
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual('New Title', page1.public.title)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             page1.publish_state)
+
+    def test_bulk_publish_follows_foreign_keys(self):
+        Page.objects.filter(id=self.child1.id).publish(bulk=True)
+        page1 = Page.objects.get(id=self.page1.id)
+        child1 = Page.objects.get(id=self.child1.id)
+        self.failUnless(page1.public)
+        self.failUnlessEqual(page1.public, child1.public.parent)
+        self.failUnlessEqual(2, Page.objects.published().count())
+
+    def test_bulk_publish_circular_foreign_keys(self):
+        self.page1.parent = self.child1
+        self.page1.save()
+        Page.objects.filter(id=self.page1.id).publish(bulk=True)
+        page1 = Page.objects.get(id=self.page1.id)
+        child1 = Page.objects.get(id=self.child1.id)
+        self.failUnlessEqual(child1.public, page1.public.parent)
+        self.failUnlessEqual(page1.public, child1.public.parent)
+
+    def test_bulk_publish_reverse_fields(self):
+        block = PageBlock.objects.create(page=self.page1, content='block')
+        Page.objects.filter(id=self.page1.id).publish(bulk=True)
+
+        page1 = Page.objects.get(id=self.page1.id)
+        blocks = list(page1.public.pageblock_set.all())
+        self.failUnlessEqual(1, len(blocks))
+        self.failUnlessEqual(block.content, blocks[0].content)
+
+        block.delete(mark_for_deletion=False)
+        Page.objects.filter(id=self.page1.id).publish(bulk=True)
+        self.failUnlessEqual([], list(page1.public.pageblock_set.all()))
+
+    def test_bulk_publish_many_to_many(self):
+        author = Author.objects.create(name='author')
+        self.page1.authors.add(author)
+        Page.objects.filter(id=self.page1.id).publish(bulk=True)
+
+        author = Author.objects.get(id=author.id)
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnless(author.public)
+        self.failUnlessEqual([author.public],
+                             list(page1.public.authors.all()))
+
+        page1.authors.clear()
+        Page.objects.filter(id=self.page1.id).publish(bulk=True)
+        self.failUnlessEqual([], list(page1.public.authors.all()))
+
+    def test_bulk_publish_non_publishable_many_to_many(self):
+        site1 = Site.objects.create(title='site 1', domain='one.com')
+        site2 = Site.objects.create(title='site 2', domain='two.com')
+        flat_page = FlatPage.objects.create(url='/flat', title='Flat')
+        flat_page.sites.add(site1, site2)
+        FlatPage.objects.draft().publish(bulk=True)
+
+        flat_page = FlatPage.objects.get(id=flat_page.id)
+        self.failUnlessEqual([site1, site2],
+                             list(flat_page.public.sites.order_by('id')))
+
+        flat_page.sites.remove(site1)
+        FlatPage.objects.draft().publish(bulk=True)
+        self.failUnlessEqual([site2], list(flat_page.public.sites.all()))
+
+    def test_bulk_publish_multi_table_inheritance(self):
+        site = Site.objects.create(title='site', domain='one.com')
+        landing = LandingPage.objects.create(url='/landing/',
+                                             title='Landing',
+                                             tagline='tagline')
+        landing.sites.add(site)
+        LandingPage.objects.draft().publish(bulk=True)
+
+        landing = LandingPage.objects.get(id=landing.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             landing.publish_state)
+        public = LandingPage.objects.get(id=landing.public_id)
+        self.failUnlessEqual(('Landing', 'tagline'),
+                             (public.title, public.tagline))
+        self.failUnlessEqual([site], list(public.sites.all()))
+
+        landing.title = 'New Landing'
+        landing.tagline = 'new tagline'
+        landing.save()
+        LandingPage.objects.draft().publish(bulk=True)
+        public = LandingPage.objects.get(id=landing.public_id)
+        self.failUnlessEqual(('New Landing', 'new tagline'),
+                             (public.title, public.tagline))
+
+        landing = LandingPage.objects.get(id=landing.id)
+        landing.delete()
+        LandingPage.objects.draft_and_deleted().publish(bulk=True)
+        self.failIf(LandingPage.objects.exists())
+        self.failIf(FlatPage.objects.exists())
+
+    def test_bulk_publish_function(self):
+        from datetime import datetime
+        pub_date = datetime(2000, 1, 1)
+        update_pub_date.pub_date = pub_date
+
+        Page.objects.draft().publish(bulk=True)
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual(pub_date, page1.public.pub_date)
+
+    def test_bulk_publish_deletions(self):
+        Page.objects.draft().publish(bulk=True)
+        child3 = Page.objects.get(id=self.child3.id)
+        public_id = child3.public_id
+        child3.delete()
+
+        Page.objects.draft_and_deleted().publish(bulk=True)
+        self.failIf(Page.objects.filter(id__in=[self.child3.id,
+                                                public_id]).exists())
+        self.failUnlessEqual(4, Page.objects.published().count())
+
+    def test_bulk_publish_signals(self):
+        pre_published = []
+        published = []
+
+        def pre_publish_handler(sender, instance, deleted, **kw):
+            self.failIf(deleted)
+            pre_published.append(instance)
+
+        def post_publish_handler(sender, instance, deleted, **kw):
+            self.failIf(deleted)
+            published.append(instance)
+
+        pre_publish.connect(pre_publish_handler, sender=Page)
+        post_publish.connect(post_publish_handler, sender=Page)
+
+        Page.objects.draft().publish(bulk=True)
+        self.failUnlessEqual(set(Page.objects.draft()), set(pre_published))
+        self.failUnlessEqual(set(Page.objects.draft()), set(published))
+        self.failUnlessEqual(5, len(published))
+
+    def test_bulk_publish_query_count(self):
+        for i in range(20):
+            Page.objects.create(slug='extra%d' % i, title='Extra')
+        Page.objects.draft().publish(bulk=True)
+        for page in Page.objects.draft():
+            page.save()
+
+        # count the queries for the publish itself, without the traversal
+        plan = Page.objects.draft().publish(dry_run=True)
+        self.failUnlessEqual(25, len(plan))
+        result, queries = _queries_run(BulkPublisher(plan).publish)
+        self.failUnless(len(queries) < 15, len(queries))
@@ -0,0 +1,64 @@
+from django.test import TestCase
+from publish.models import PublishCheckpoint, PublishException
+from publish.signals import pre_publish
+from publish.tests.example_app.models import Page, PageBlock, Author
+
+
+class TestChunkedPublish(TestCase):
+    def setUp(self):
+        super(TestChunkedPublish, self).setUp()
+        self.pages = [Page.objects.create(slug='page%d' % i, title='Page')
+                      for i in range(7)]
+        PageBlock.objects.create(page=self.pages[0], content='block')
+
+    def test_publish_in_chunks(self):
+        published = Page.objects.draft().publish(chunk_size=3)
+        self.failUnlessEqual(7, published)
+        self.failUnlessEqual(7, Page.objects.published().count())
+        self.failUnlessEqual(0, Page.objects.changed().count())
+        page = Page.objects.get(id=self.pages[0].id)
+        self.failUnlessEqual(1, page.public.pageblock_set.count())
+
+    def test_publish_in_chunks_bulk(self):
+        Page.objects.draft().publish(chunk_size=3, bulk=True)
+        self.failUnlessEqual(7, Page.objects.published().count())
+
+    def test_checkpoint_removed_when_finished(self):
+        Page.objects.draft().publish(chunk_size=3, checkpoint='pages')
+        self.failIf(PublishCheckpoint.objects.exists())
+
+    def test_resume_from_checkpoint(self):
+        published = []
+        fail_on = self.pages[4].id
+
+        def handler(sender, instance, **kw):
+            if instance.id == fail_on:
+                raise ValueError('failed')
+            published.append(instance.id)
+
+        pre_publish.connect(handler, sender=Page)
+        try:
+            self.failUnlessRaises(ValueError, Page.objects.draft().publish,
+                                  chunk_size=3, checkpoint='pages')
+
+            checkpoint = PublishCheckpoint.objects.get(name='pages')
+            self.failUnlessEqual(3, checkpoint.published)
+            self.failUnlessEqual(self.pages[2].id, checkpoint.get_last_pk())
+
+            fail_on = None
+            published[:] = []
+            self.failUnlessEqual(4, Page.objects.draft().publish(
+                chunk_size=3, checkpoint='pages'))
+        finally:
+            pre_publish.disconnect(handler, sender=Page)
+
+        # only the pages after the checkpoint were published again
+        self.failUnlessEqual([page.id for page in self.pages[3:]],
+                             published)
+        self.failUnlessEqual(7, Page.objects.published().count())
+        self.failIf(PublishCheckpoint.objects.exists())
+
+    def test_checkpoint_for_other_model(self):
+        PublishCheckpoint.objects.start('pages', Page)
+        self.failUnlessRaises(PublishException, Author.objects.draft().publish,
+                              chunk_size=3, checkpoint='pages')
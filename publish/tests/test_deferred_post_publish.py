@@ -0,0 +1,98 @@
+from multiprocessing.pool import ThreadPool
+
+from django.test import TestCase
+from publish.signals import post_publish, post_publish_batch, \
+    defer_post_publish
+from publish.tests.example_app.models import Page
+
+
+class TestDeferredPostPublish(TestCase):
+    def setUp(self):
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.child1 = Page.objects.create(parent=self.page1, slug='child1',
+                                          title='Child 1')
+        self.published = []
+
+        def handler(sender, instance, deleted, **kw):
+            self.published.append(instance)
+
+        post_publish.connect(handler, sender=Page)
+        self.handler = handler
+
+    def tearDown(self):
+        post_publish.disconnect(self.handler, sender=Page)
+
+    def test_sent_after_block(self):
+        with defer_post_publish():
+            self.page1.publish()
+            self.failUnlessEqual([], self.published)
+        self.failUnlessEqual([self.page1], self.published)
+
+    def test_sent_once_per_instance(self):
+        with defer_post_publish():
+            self.page1.publish()
+            child1 = Page.objects.get(id=self.child1.id)
+            child1.title = 'New Title'
+            child1.save()
+            child1.publish()
+            self.page1.title = 'New Title'
+            self.page1.save()
+            self.page1.publish()
+        self.failUnlessEqual([self.page1, child1], self.published)
+
+    def test_nested_sent_after_outermost(self):
+        with defer_post_publish():
+            with defer_post_publish():
+                self.page1.publish()
+            self.failUnlessEqual([], self.published)
+        self.failUnlessEqual([self.page1], self.published)
+
+    def test_dropped_on_error(self):
+        try:
+            with defer_post_publish():
+                self.page1.publish()
+                raise ValueError
+        except ValueError:
+            pass
+        self.failUnlessEqual([], self.published)
+
+        self.page1.title = 'New Title'
+        self.page1.save()
+        self.page1.publish()
+        self.failUnlessEqual([self.page1], self.published)
+
+    def test_batch_merged(self):
+        batches = []
+
+        def handler(sender, instances, deleted, **kw):
+            batches.append(list(instances))
+
+        post_publish_batch.connect(handler)
+        try:
+            with defer_post_publish():
+                Page.objects.filter(id=self.page1.id).publish()
+                Page.objects.draft().publish()
+                self.failUnlessEqual([], batches)
+        finally:
+            post_publish_batch.disconnect(handler)
+        self.failUnlessEqual([[self.page1, self.child1]], batches)
+
+    def test_decorator(self):
+        @defer_post_publish()
+        def publish_page():
+            self.page1.publish()
+            self.failUnlessEqual([], self.published)
+            return 'done'
+
+        self.failUnlessEqual('done', publish_page())
+        self.failUnlessEqual([self.page1], self.published)
+
+    def test_pool(self):
+        pool = ThreadPool(1)
+        try:
+            with defer_post_publish(pool=pool):
+                self.page1.publish()
+        finally:
+            pool.close()
+            pool.join()
+        self.failUnlessEqual([self.page1], self.published)
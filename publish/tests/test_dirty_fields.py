@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django.utils.unittest import skipUnless
+from publish.models import Publishable, SAVE_UPDATE_FIELDS
+from publish.tests.example_app.models import Page, FlatPage
+from publish.tests.helpers import _queries_run
+
+
+class TestDirtyFields(TestCase):
+    def setUp(self):
+        super(TestDirtyFields, self).setUp()
+        self.page = Page.objects.create(slug='page', title='Page',
+                                        content='some content')
+
+    def _queries(self, func):
+        result, queries = _queries_run(func)
+        return queries
+
+    def test_dirty_fields(self):
+        page = Page.objects.get(id=self.page.id)
+        self.failUnlessEqual([], page.dirty_fields())
+        page.title = 'New Title'
+        self.failUnlessEqual(['title'], page.dirty_fields())
+        page.save()
+        self.failUnlessEqual([], page.dirty_fields())
+
+    def test_save_without_changes_skipped(self):
+        page = Page.objects.get(id=self.page.id)
+        self.failUnlessEqual(Publishable.PUBLISH_CHANGED, page.publish_state)
+        self.failUnlessEqual([], self._queries(page.save))
+
+    @skipUnless(SAVE_UPDATE_FIELDS, 'update_fields needs Django 1.5')
+    def test_save_only_changed_columns(self):
+        page = Page.objects.get(id=self.page.id)
+        page.title = 'New Title'
+        queries = self._queries(page.save)
+        self.failUnlessEqual(1, len(queries))
+        self.failUnless('"title"' in queries[0])
+        self.failIf('"content"' in queries[0])
+
+        page = Page.objects.get(id=self.page.id)
+        self.failUnlessEqual('New Title', page.title)
+        self.failUnlessEqual('some content', page.content)
+
+    @skipUnless(SAVE_UPDATE_FIELDS, 'update_fields needs Django 1.5')
+    def test_save_marks_changed(self):
+        self.page.publish()
+        page = Page.objects.get(id=self.page.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, page.publish_state)
+        queries = self._queries(page.save)
+        self.failUnlessEqual(1, len(queries))
+        self.failUnless('"publish_state"' in queries[0])
+        self.failIf('"title"' in queries[0])
+        self.failUnlessEqual(Publishable.PUBLISH_CHANGED,
+                             Page.objects.get(id=self.page.id).publish_state)
+
+    def test_deferred_fields(self):
+        page = Page.objects.only('title').get(id=self.page.id)
+        page.content = 'new content'
+        page.save()
+        self.failUnlessEqual('new content',
+                             Page.objects.get(id=self.page.id).content)
+
+    @skipUnless(SAVE_UPDATE_FIELDS, 'update_fields needs Django 1.5')
+    def test_publish_only_changed_columns(self):
+        self.page.publish()
+        page = Page.objects.get(id=self.page.id)
+        page.title = 'New Title'
+        page.save()
+
+        page = Page.objects.get(id=self.page.id)
+        queries = self._queries(page.publish)
+        public_id = page.public_id
+        updates = [sql for sql in queries if sql.startswith('UPDATE') and
+                   sql.endswith('WHERE "example_app_page"."id" = %d '
+                                % public_id)]
+        self.failUnlessEqual(1, len(updates), queries)
+        self.failUnless('"title"' in updates[0])
+        self.failIf('"content"' in updates[0])
+        self.failUnlessEqual('New Title',
+                             Page.objects.get(id=public_id).title)
+
+
+class TestDirtyFieldsOtherDatabase(TestCase):
+    multi_db = True
+
+    def test_save_to_other_database(self):
+        # saving to another database writes every column
+        flat_page = FlatPage.objects.create(url='/url/', title='title')
+        flat_page = FlatPage.objects.get(id=flat_page.id)
+        flat_page.save(using='replica')
+        self.failUnlessEqual(['title'], list(FlatPage.objects.using('replica')
+                                             .values_list('title',
+                                                          flat=True)))
+
+        flat_page = FlatPage.objects.get(id=flat_page.id)
+        flat_page.title = 'new title'
+        flat_page.save(using='replica')
+        self.failUnlessEqual(['new title'], list(
+            FlatPage.objects.using('replica').values_list('title',
+                                                          flat=True)))
@@ -0,0 +1,97 @@
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from publish.scheduling import expire_due
+from publish.signals import pre_publish, post_publish
+from publish.tests.example_app.models import Event, EventSession
+from publish.tests.helpers import _queries_run
+
+
+class TestExpirePublished(TestCase):
+    def setUp(self):
+        super(TestExpirePublished, self).setUp()
+        self.now = timezone.now()
+        hour = timedelta(hours=1)
+        self.expired = Event.objects.create(title='expired',
+                                            expire_at=self.now - hour)
+        self.session = EventSession.objects.create(event=self.expired,
+                                                   title='session')
+        self.later = Event.objects.create(title='later',
+                                          expire_at=self.now + hour)
+        Event.objects.draft().publish()
+        # not published, so nothing to expire
+        self.draft = Event.objects.create(title='draft',
+                                          expire_at=self.now - hour)
+
+    def test_expire_due(self):
+        public_id = Event.objects.get(id=self.expired.id).public_id
+        deleted_items = []
+
+        def handler(sender, instance, deleted, **kw):
+            if deleted:
+                deleted_items.append(instance)
+
+        post_publish.connect(handler)
+        try:
+            self.failUnlessEqual(1, expire_due(now=self.now))
+        finally:
+            post_publish.disconnect(handler)
+
+        self.failIf(Event.objects.filter(
+            id__in=[self.expired.id, public_id]).exists())
+        self.failIf(EventSession.objects.exists())
+        self.failUnless(self.expired in deleted_items)
+        self.failUnless(Event.objects.get(id=self.later.id).public)
+        self.failUnless(Event.objects.filter(id=self.draft.id).exists())
+
+        self.failUnlessEqual(0, expire_due(now=self.now))
+        self.failUnlessEqual(1, expire_due(now=self.now + timedelta(hours=2)))
+
+    def test_nothing_due_is_one_query(self):
+        expire_due(now=self.now)
+        expired, queries = _queries_run(
+            lambda: expire_due(models=[Event], now=self.now))
+        self.failUnlessEqual(1, len(queries))
+        self.failUnless('"expire_at" <=' in queries[0])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('publish_scheduled', stdout=out)
+        self.failUnless('Expired 1' in out.getvalue())
+        self.failIf(Event.objects.filter(id=self.expired.id).exists())
+
+
+class TestExpireFailures(TransactionTestCase):
+    def setUp(self):
+        super(TestExpireFailures, self).setUp()
+        self.now = timezone.now()
+        self.broken = Event.objects.create(
+            title='broken', expire_at=self.now - timedelta(hours=1))
+        self.expired = Event.objects.create(
+            title='expired', expire_at=self.now - timedelta(hours=1))
+        Event.objects.draft().publish()
+
+        def handler(sender, instance, deleted, **kw):
+            if deleted and instance == self.broken:
+                raise ValueError('broken')
+        self.handler = handler
+        pre_publish.connect(handler, sender=Event)
+
+    def tearDown(self):
+        pre_publish.disconnect(self.handler, sender=Event)
+        super(TestExpireFailures, self).tearDown()
+
+    def test_failure_does_not_hold_up_others(self):
+        failures = []
+        self.failUnlessEqual(1, expire_due(now=self.now, batch_size=1,
+                                           failures=failures))
+        self.failIf(Event.objects.filter(id=self.expired.id).exists())
+
+        # rolled back, still published and due to expire
+        broken = Event.objects.get(id=self.broken.id)
+        self.failUnless(broken.public)
+        self.failIf(broken.publish_state == broken.PUBLISH_DELETE)
+        self.failUnlessEqual([broken], [obj for obj, error in failures])
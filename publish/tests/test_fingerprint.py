@@ -0,0 +1,105 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from publish.models import Publishable
+from publish.signals import post_publish
+from publish.tests.example_app.models import Article, Author, Site
+from publish.tests.helpers import _queries_run
+
+
+class TestFingerprint(TestCase):
+    def setUp(self):
+        super(TestFingerprint, self).setUp()
+        self.site = Site.objects.create(title='site', domain='site.com')
+        self.author = Author.objects.create(name='author')
+        self.article = Article.objects.create(title='Article',
+                                              content='some content')
+        self.article.sites.add(self.site)
+        self.article.authors.add(self.author)
+
+    def _publish_queries(self, bulk=False):
+        result, queries = _queries_run(
+            lambda: Article.objects.draft().publish(bulk=bulk))
+        return queries
+
+    def _resave(self):
+        article = Article.objects.get(id=self.article.id)
+        article.save()
+        self.failUnlessEqual(Publishable.PUBLISH_CHANGED,
+                             Article.objects.get(id=article.id).publish_state)
+        return article
+
+    def _fingerprints(self):
+        article = Article.objects.get(id=self.article.id)
+        return article.publish_fingerprint, article.public.publish_fingerprint
+
+    def test_fingerprint_stored(self):
+        Article.objects.draft().publish()
+        draft, public = self._fingerprints()
+        self.failUnless(draft)
+        self.failUnlessEqual(draft, public)
+
+    def test_fingerprint_changes_with_content(self):
+        Article.objects.draft().publish()
+        before, _ = self._fingerprints()
+
+        article = Article.objects.get(id=self.article.id)
+        article.title = 'New Title'
+        article.save()
+        Article.objects.draft().publish()
+        after, public = self._fingerprints()
+        self.failIfEqual(before, after)
+        self.failUnlessEqual(after, public)
+
+        article = Article.objects.get(id=self.article.id)
+        article.sites.clear()
+        article.save()
+        Article.objects.draft().publish()
+        self.failIfEqual(after, self._fingerprints()[0])
+        article = Article.objects.get(id=self.article.id)
+        self.failUnlessEqual([], list(article.public.sites.all()))
+
+    def _test_unchanged_skipped(self, bulk):
+        Article.objects.draft().publish(bulk=bulk)
+        self._resave()
+
+        published = []
+
+        def handler(sender, instance, **kw):
+            published.append(instance)
+
+        post_publish.connect(handler, sender=Article)
+        try:
+            queries = self._publish_queries(bulk=bulk)
+        finally:
+            post_publish.disconnect(handler, sender=Article)
+
+        self.failUnlessEqual([], published)
+        public_id = Article.objects.get(id=self.article.id).public_id
+        for sql in queries:
+            self.failIf(sql.startswith('UPDATE') and
+                        str(public_id) in sql.split('WHERE')[-1], sql)
+            self.failIf(sql.startswith('INSERT') or sql.startswith('DELETE'),
+                        sql)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             Article.objects.get(id=self.article.id)
+                             .publish_state)
+
+    def test_unchanged_skipped(self):
+        self._test_unchanged_skipped(bulk=False)
+
+    def test_unchanged_skipped_bulk(self):
+        self._test_unchanged_skipped(bulk=True)
+
+    def test_backfill_command(self):
+        Article.objects.draft().publish()
+        draft, public = self._fingerprints()
+        Article.objects.update(publish_fingerprint='')
+
+        out = StringIO()
+        call_command('backfill_publish_fingerprints', 'example_app.Article',
+                     batch_size=1, stdout=out)
+        self.failUnless('example_app.Article: 1 fingerprints' in
+                        out.getvalue())
+        self.failUnlessEqual((draft, public), self._fingerprints())
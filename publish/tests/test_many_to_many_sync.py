@@ -0,0 +1,56 @@
+from django.test import TestCase
+from publish.tests.example_app.models import FlatPage, Site
+from publish.tests.helpers import _queries_run
+
+
+class TestManyToManySync(TestCase):
+    def setUp(self):
+        super(TestManyToManySync, self).setUp()
+        self.flat_page = FlatPage.objects.create(url='/flat', title='Flat')
+
+    def _add_sites(self, count):
+        sites = [Site.objects.create(title='site %d' % i,
+                                     domain='%d.com' % i)
+                 for i in range(count)]
+        self.flat_page.sites.add(*sites)
+        return sites
+
+    def _through_rows(self, flat_page):
+        through = FlatPage.sites.through
+        return dict((site_id, pk) for pk, site_id in
+                    through.objects.filter(flatpage=flat_page)
+                    .values_list('pk', 'site'))
+
+    def _publish_queries(self):
+        public, queries = _queries_run(
+            lambda: FlatPage.objects.get(id=self.flat_page.id).publish())
+        return len(queries)
+
+    def test_only_changed_rows_written(self):
+        sites = self._add_sites(10)
+        self.flat_page.publish()
+        public = FlatPage.objects.get(id=self.flat_page.id).public
+        before = self._through_rows(public)
+        self.failUnlessEqual(set(site.id for site in sites), set(before))
+
+        self.flat_page.sites.remove(sites[0])
+        extra = Site.objects.create(title='extra', domain='extra.com')
+        self.flat_page.sites.add(extra)
+        FlatPage.objects.get(id=self.flat_page.id).publish()
+
+        after = self._through_rows(public)
+        self.failIf(sites[0].id in after)
+        self.failUnless(extra.id in after)
+        for site in sites[1:]:
+            # unchanged rows are left alone
+            self.failUnlessEqual(before[site.id], after[site.id])
+
+    def test_queries_independent_of_size(self):
+        self._add_sites(3)
+        self.flat_page.publish()
+        small = self._publish_queries()
+
+        self._add_sites(40)
+        self.flat_page.publish()
+        large = self._publish_queries()
+        self.failUnlessEqual(small, large)
@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from publish.models import PublishException
+from publish.parallel import PublishResult
+from publish.signals import pre_publish
+from publish.tests.example_app.models import Page, PageBlock, Author
+
+
+class ParallelPublishMixin(object):
+    def setUp(self):
+        super(ParallelPublishMixin, self).setUp()
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.page2 = Page.objects.create(slug='page2', title='page 2')
+        self.page3 = Page.objects.create(slug='page3', title='page 3')
+        self.block = PageBlock.objects.create(page=self.page1,
+                                              content='block')
+        # page1 and page3 share an author, so must be published together
+        self.author = Author.objects.create(name='author')
+        self.page1.authors.add(self.author)
+        self.page3.authors.add(self.author)
+
+
+class TestParallelPublish(ParallelPublishMixin, TestCase):
+    def test_publish_components(self):
+        results = Page.objects.draft().publish(processes=1)
+
+        self.failUnlessEqual(2, len(results))
+        self.failUnless(all(isinstance(result, PublishResult)
+                            for result in results))
+        self.failUnlessEqual([None, None],
+                             [result.error for result in results])
+        self.failUnlessEqual(set([self.page1, self.block, self.author,
+                                  self.page3]), set(results[0].items))
+        self.failUnlessEqual([self.page2], results[1].items)
+
+        self.failUnlessEqual(3, Page.objects.published().count())
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual(1, page1.public.pageblock_set.count())
+        self.failUnlessEqual([Author.objects.get(id=self.author.id).public],
+                             list(page1.public.authors.all()))
+
+    def test_publish_components_bulk(self):
+        Page.objects.draft().publish(processes=1, bulk=True)
+        self.failUnlessEqual(3, Page.objects.published().count())
+
+    def test_errors_per_component(self):
+        def fail(sender, instance, **kw):
+            if instance.slug == 'page2':
+                raise ValueError('cannot publish page2')
+
+        pre_publish.connect(fail, sender=Page)
+        try:
+            results = Page.objects.draft().publish(processes=1)
+        finally:
+            pre_publish.disconnect(fail, sender=Page)
+
+        self.failUnless(results[0].error is None)
+        self.failUnless('cannot publish page2' in results[1].error)
+        self.failUnless(Page.objects.get(id=self.page1.id).public)
+
+    def test_processes_in_transaction(self):
+        with transaction.commit_on_success():
+            self.assertRaises(PublishException,
+                              Page.objects.draft().publish, processes=2)
+        self.failIf(Page.objects.published().exists())
+
+
+class TestParallelPublishProcesses(ParallelPublishMixin,
+                                   TransactionTestCase):
+    def test_publish_components(self):
+        results = Page.objects.draft().publish(processes=2)
+
+        self.failUnlessEqual([None, None],
+                             [result.error for result in results])
+        self.failUnlessEqual(3, Page.objects.published().count())
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual(1, page1.public.pageblock_set.count())
+        self.failUnlessEqual([Author.objects.get(id=self.author.id).public],
+                             list(page1.public.authors.all()))
@@ -0,0 +1,56 @@
+from django.test import TestCase
+from publish.models import Publishable
+from publish.tests.example_app.models import Page, PageBlock, Author
+from publish.tests.helpers import _queries_run
+from publish.utils import PublishGraph
+
+
+class TestPrefetchTraversal(TestCase):
+    def _count_queries(self, func):
+        result, queries = _queries_run(func)
+        return len(queries)
+
+    def _create_pages(self, count):
+        for i in range(count):
+            page = Page.objects.create(slug='page%d' % i, title='Page')
+            author = Author.objects.create(name='author %d' % i)
+            page.authors.add(author)
+            for j in range(3):
+                PageBlock.objects.create(page=page, content='block')
+
+    def _dry_run_queries(self, count):
+        self._create_pages(count)
+        queries = self._count_queries(
+            lambda: Page.objects.draft().publish(dry_run=True))
+        PageBlock.objects.all().delete(mark_for_deletion=False)
+        Page.objects.all().delete(mark_for_deletion=False)
+        Author.objects.all().delete(mark_for_deletion=False)
+        return queries
+
+    def test_dry_run_queries_independent_of_size(self):
+        self.failUnlessEqual(self._dry_run_queries(2),
+                             self._dry_run_queries(10))
+
+    def test_publish_uses_prefetched_relations(self):
+        self._create_pages(2)
+        page = Page.objects.draft().get(slug='page0')
+        all_published = PublishGraph()
+        page.publish(all_published=all_published)
+
+        self.failUnlessEqual(5, len(all_published))
+        page = Page.objects.draft().get(slug='page0')
+        self.failUnlessEqual(3, page.public.pageblock_set.count())
+        self.failUnlessEqual(1, page.public.authors.count())
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             page.publish_state)
+
+    def test_publish_deletion_prefetches_children(self):
+        self._create_pages(1)
+        Page.objects.draft().publish()
+        page = Page.objects.draft().get(slug='page0')
+        public_id = page.public_id
+        page.delete()
+
+        Page.objects.deleted().publish()
+        self.failIf(Page.objects.filter(id=public_id).exists())
+        self.failIf(PageBlock.objects.exists())
@@ -0,0 +1,116 @@
+from django.dispatch import Signal
+from django.test import TestCase
+from publish.models import Publishable
+from publish.signals import post_publish, pre_publish_batch, \
+    post_publish_batch, has_listeners
+from publish.tests.example_app.models import Page, PageBlock
+from publish.utils import PublishGraph
+
+
+class TestPublishBatchSignals(TestCase):
+    def setUp(self):
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.page2 = Page.objects.create(slug='page2', title='page 2')
+        self.child1 = Page.objects.create(parent=self.page1, slug='child1',
+                                          title='Child 1')
+        self.block = PageBlock.objects.create(page=self.page1,
+                                              content='block')
+
+    def _connect(self):
+        batches = []
+
+        def pre_handler(sender, instances, deleted, **kw):
+            batches.append(('pre', sender, deleted,
+                            [instance.pk for instance in instances]))
+
+        def post_handler(sender, instances, deleted, **kw):
+            batches.append(('post', sender, deleted,
+                            [instance.pk for instance in instances]))
+
+        pre_publish_batch.connect(pre_handler)
+        post_publish_batch.connect(post_handler)
+        # signals only hold weak references to their receivers
+        self._handlers = (pre_handler, post_handler)
+        return batches
+
+    def _check_batches(self, batches):
+        pages = set(Page.objects.draft().values_list('pk', flat=True))
+        blocks = set(PageBlock.objects.draft().values_list('pk', flat=True))
+        self.failUnlessEqual(['pre', 'pre', 'post', 'post'],
+                             [when for when, _, _, _ in batches])
+        for when, sender, deleted, instances in batches:
+            self.failIf(deleted)
+            expected = {Page: pages, PageBlock: blocks}[sender]
+            self.failUnlessEqual(len(expected), len(instances))
+            self.failUnlessEqual(expected, set(instances))
+
+    def test_batch_signals_sent_once_per_model(self):
+        batches = self._connect()
+        Page.objects.draft().publish()
+        self._check_batches(batches)
+
+    def test_batch_signals_sent_once_per_model_bulk(self):
+        batches = self._connect()
+        Page.objects.draft().publish(bulk=True)
+        self._check_batches(batches)
+
+    def test_batch_signals_for_single_publish(self):
+        batches = self._connect()
+        self.child1.publish()
+        self.failUnlessEqual(['pre', 'pre', 'post', 'post'],
+                             [when for when, _, _, _ in batches])
+        pages = [instances for when, sender, _, instances in batches
+                 if sender is Page]
+        self.failUnlessEqual([set([self.page1.pk, self.child1.pk])] * 2,
+                             [set(instances) for instances in pages])
+
+    def test_batch_signals_for_deletions(self):
+        Page.objects.draft().publish()
+        batches = self._connect()
+
+        child1 = Page.objects.get(id=self.child1.id)
+        child1.delete()
+        Page.objects.deleted().publish()
+
+        # by post_publish_batch the instances have been deleted
+        self.failUnlessEqual([('pre', Page, True, [self.child1.pk]),
+                              ('post', Page, True, [None])], batches)
+
+    def test_batch_signals_not_sent_for_dry_run(self):
+        batches = self._connect()
+        Page.objects.draft().publish(dry_run=True)
+        self.failUnlessEqual([], batches)
+
+    def test_original_not_looked_up_without_receivers(self):
+        class CountingGraph(PublishGraph):
+            lookups = 0
+
+            def original(self, item):
+                CountingGraph.lookups += 1
+                return super(CountingGraph, self).original(item)
+
+        self.page2.publish(all_published=CountingGraph())
+        without_receivers = CountingGraph.lookups
+        page2 = Page.objects.get(id=self.page2.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, page2.publish_state)
+
+        def handler(sender, instance, **kw):
+            pass
+
+        post_publish.connect(handler, sender=Page)
+        page3 = Page.objects.create(slug='page3', title='page 3')
+        CountingGraph.lookups = 0
+        page3.publish(all_published=CountingGraph())
+        self.failUnlessEqual(without_receivers + 1, CountingGraph.lookups)
+
+    def test_has_listeners(self):
+        def handler(sender, **kw):
+            pass
+
+        signal = Signal()
+        self.failIf(has_listeners(signal))
+        signal.connect(handler, sender=Page)
+        self.failUnless(has_listeners(signal, Page))
+        self.failIf(has_listeners(signal, PageBlock))
+        signal.disconnect(handler, sender=Page)
+        self.failIf(has_listeners(signal, Page))
@@ -0,0 +1,126 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from publish.models import Publishable, PublishCounter
+from publish.tests.example_app.models import Page, PageBlock, Event
+
+
+@override_settings(PUBLISH_COUNTERS=True)
+class TestPublishCounters(TestCase):
+    def setUp(self):
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.page2 = Page.objects.create(slug='page2', title='page 2')
+        self.child1 = Page.objects.create(parent=self.page1, slug='child1',
+                                          title='Child 1')
+
+    def _check(self, changed, deleted, model=Page):
+        self.failUnlessEqual({'changed': changed, 'deleted': deleted},
+                             model.objects.backlog())
+        # and the counters agree with the tables
+        self.failUnlessEqual(changed, model.objects.changed().count())
+        self.failUnlessEqual(deleted, model.objects.deleted().count())
+
+    def test_save_counts_changed(self):
+        self._check(3, 0)
+        self.page1.title = 'New Title'
+        self.page1.save()
+        self._check(3, 0)
+
+    def test_publish(self):
+        self.page1.publish()
+        self._check(2, 0)
+        Page.objects.draft().publish()
+        self._check(0, 0)
+
+        page1 = Page.objects.get(id=self.page1.id)
+        page1.title = 'New Title'
+        page1.save()
+        self._check(1, 0)
+
+    def test_bulk_publish(self):
+        Page.objects.draft().publish(bulk=True)
+        self._check(0, 0)
+
+    def test_delete_and_undelete(self):
+        Page.objects.draft().publish()
+        page2 = Page.objects.get(id=self.page2.id)
+        page2.delete()
+        self._check(0, 1)
+        page2.undelete()
+        self._check(1, 0)
+
+    def test_publish_deletions(self):
+        Page.objects.draft().publish()
+        for page in Page.objects.draft():
+            page.delete()
+        self._check(0, 3)
+        page2 = Page.objects.get(id=self.page2.id)
+        page2.publish()
+        self._check(0, 2)
+        Page.objects.deleted().publish(bulk=True)
+        self._check(0, 0)
+
+    def test_delete_unpublished(self):
+        self.page2.delete()
+        self._check(2, 0)
+
+    def test_delete_cascades(self):
+        # the children deleted along with a draft come off the counters too
+        for i in range(3):
+            PageBlock.objects.create(page=self.page2, content='block %d' % i)
+        self._check(3, 0, model=PageBlock)
+        self.page2.delete()
+        self._check(0, 0, model=PageBlock)
+        self._check(2, 0)
+
+    def test_publish_deletions_cascades(self):
+        for i in range(3):
+            PageBlock.objects.create(page=self.page2, content='block %d' % i)
+        Page.objects.draft().publish()
+        Page.objects.get(id=self.page2.id).delete()
+        PageBlock.objects.create(page=self.page2, content='new block')
+        self._check(1, 0, model=PageBlock)
+        Page.objects.deleted().publish(bulk=True)
+        self._check(0, 0, model=PageBlock)
+        self._check(0, 0)
+
+    def test_models_counted_separately(self):
+        PageBlock.objects.create(page=self.page1, content='block')
+        self._check(1, 0, model=PageBlock)
+        self._check(3, 0)
+        self._check(0, 0, model=Event)
+
+        backlog = PublishCounter.objects.backlog()
+        self.failUnlessEqual({'changed': 1, 'deleted': 0},
+                             backlog[PageBlock])
+        self.failIf(Event in backlog)
+
+    def test_recount(self):
+        Page.objects.filter(id=self.page1.id).update(
+            publish_state=Publishable.PUBLISH_DEFAULT)
+        self.failUnlessEqual(3, Page.objects.backlog()['changed'])
+
+        out = StringIO()
+        call_command('recount_publish_counters', 'example_app.Page',
+                     stdout=out)
+        self._check(2, 0)
+        self.failUnlessEqual('example_app.Page: 2 changed, 0 deleted\n',
+                             out.getvalue())
+
+    def test_publish_status(self):
+        PageBlock.objects.create(page=self.page1, content='block')
+        out = StringIO()
+        call_command('publish_status', stdout=out)
+        self.failUnlessEqual('example_app.Page: 3 changed, 0 deleted\n'
+                             'example_app.PageBlock: 1 changed, 0 deleted\n',
+                             out.getvalue())
+
+
+class TestPublishCountersDisabled(TestCase):
+    def test_not_counted(self):
+        Page.objects.create(slug='page1', title='page 1')
+        self.failIf(PublishCounter.objects.exists())
+        self.failUnlessEqual({'changed': 0, 'deleted': 0},
+                             Page.objects.backlog())
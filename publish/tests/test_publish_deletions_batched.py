@@ -0,0 +1,71 @@
+from django.test import TestCase
+from publish.signals import pre_publish, post_publish
+from publish.tests.example_app.models import Page, PageBlock
+from publish.tests.helpers import _queries_run
+
+
+class TestPublishDeletionsBatched(TestCase):
+    def _create_page(self, slug, blocks):
+        page = Page.objects.create(slug=slug, title=slug)
+        for i in range(blocks):
+            PageBlock.objects.create(page=page, content='block %d' % i)
+        page.publish()
+        page = Page.objects.get(id=page.id)
+        for block in page.pageblock_set.all():
+            block.delete()
+        page.delete()
+        return page
+
+    def _deletion_queries(self, slug, blocks):
+        self._create_page(slug, blocks)
+        result, queries = _queries_run(
+            lambda: Page.objects.filter(slug=slug).publish_deletions())
+        return len(queries)
+
+    def test_publish_deletions(self):
+        page = self._create_page('page', 3)
+        public_id = page.public_id
+        Page.objects.all().publish_deletions()
+
+        self.failIf(Page.objects.filter(id__in=[page.id, public_id]).exists())
+        self.failIf(PageBlock.objects.exists())
+
+    def test_only_publishes_deletions(self):
+        page = Page.objects.create(slug='draft', title='draft')
+        self._create_page('deleted', 1)
+        Page.objects.all().publish_deletions()
+
+        self.failUnlessEqual([page], list(Page.objects.all()))
+        self.failUnless(Page.objects.get(id=page.id).public is None)
+
+    def test_signals(self):
+        published = []
+
+        def handler(sender, instance, deleted, **kw):
+            self.failUnless(deleted)
+            published.append((sender, instance.pk))
+
+        page = self._create_page('page', 2)
+        blocks = list(PageBlock.objects.filter(page=page)
+                      .values_list('id', flat=True))
+        pre_publish.connect(handler)
+        try:
+            Page.objects.all().publish_deletions()
+        finally:
+            pre_publish.disconnect(handler)
+        self.failUnlessEqual(set([(Page, page.id)] +
+                                 [(PageBlock, pk) for pk in blocks]),
+                             set(published))
+
+        published[:] = []
+        page = self._create_page('other', 1)
+        post_publish.connect(handler)
+        try:
+            Page.objects.all().publish_deletions()
+        finally:
+            post_publish.disconnect(handler)
+        self.failUnless((Page, page.id) in published)
+
+    def test_queries_independent_of_size(self):
+        self.failUnlessEqual(self._deletion_queries('small', 2),
+                             self._deletion_queries('large', 20))
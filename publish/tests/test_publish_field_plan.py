@@ -0,0 +1,59 @@
+from django.test import TestCase
+from publish.models import PublishFieldPlan
+from publish.tests.example_app.models import Page, PageBlock, Author, \
+    FlatPage, update_pub_date
+
+
+class TestPublishFieldPlan(TestCase):
+    def test_compiled_once(self):
+        plan = Page.publish_field_plan()
+        self.failUnless(isinstance(plan, PublishFieldPlan))
+        self.failUnless(plan is Page.publish_field_plan())
+        self.failIf(plan is PageBlock.publish_field_plan())
+
+    def test_read_only(self):
+        plan = Page.publish_field_plan()
+        self.failUnlessRaises(AttributeError, setattr, plan, 'fields', ())
+
+    def test_copy_fields(self):
+        plan = Page.publish_field_plan()
+        copied = dict((field.name, (copy, publish_function))
+                      for field, copy, publish_function in plan.copy_fields)
+        self.failIf('id' in copied)
+        self.failIf('public' in copied)
+        self.failIf('publish_state' in copied)
+        self.failUnlessEqual((PublishFieldPlan.COPY_VALUE, None),
+                             copied['title'])
+        self.failUnlessEqual((PublishFieldPlan.COPY_VALUE, update_pub_date),
+                             copied['pub_date'])
+        self.failUnlessEqual((PublishFieldPlan.COPY_PUBLISHABLE, None),
+                             copied['parent'])
+        self.failUnlessEqual(['parent'],
+                             [field.name for field in plan.foreign_keys])
+        self.failUnless('parent_id' in plan.attnames)
+
+    def test_many_to_many(self):
+        plan = Page.publish_field_plan()
+        # log is excluded and tags are published via PageTagOrder
+        self.failUnlessEqual([('authors', True)],
+                             [(field.name, publishable)
+                              for field, publishable in plan.many_to_many])
+        self.failUnlessEqual([('sites', False)],
+                             [(field.name, publishable) for field, publishable
+                              in FlatPage.publish_field_plan().many_to_many])
+
+    def test_reverse_relations(self):
+        plan = Page.publish_field_plan()
+        self.failUnlessEqual(frozenset(['pageblock_set', 'pagetagorder_set']),
+                             plan.reverse_names)
+        self.failUnlessEqual(set(['pageblock_set', 'pagetagorder_set']),
+                             set(related.get_accessor_name()
+                                 for related in plan.reverse_relations))
+        self.failUnless('page_set' in
+                        [related.get_accessor_name()
+                         for related in plan.deletion_relations])
+
+        plan = Author.publish_field_plan()
+        self.failUnlessEqual(['authorprofile'],
+                             [related.get_accessor_name()
+                              for related in plan.reverse_relations])
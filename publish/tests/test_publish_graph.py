@@ -0,0 +1,91 @@
+from django.test import TestCase
+from publish.tests.example_app.models import Page, Author
+from publish.utils import PublishGraph, NestedSet
+
+
+class TestPublishGraph(TestCase):
+    def setUp(self):
+        super(TestPublishGraph, self).setUp()
+        self.graph = PublishGraph()
+
+    def test_nested_set_alias(self):
+        self.failUnless(NestedSet is PublishGraph)
+
+    def test_original_uses_model_and_pk(self):
+        page = Page.objects.create(slug='page', title='Page')
+        self.graph.add(page)
+
+        other = Page.objects.get(id=page.id)
+        self.failIf(other is page)
+        self.failUnless(other in self.graph)
+        self.failUnless(self.graph.original(other) is page)
+
+        # same pk, different model
+        author = Author(id=page.id, name='author')
+        self.failIf(author in self.graph)
+        self.failUnless(self.graph.original(author) is author)
+
+    def test_parent_and_children(self):
+        self.graph.add('one')
+        self.graph.add('one1', parent='one')
+        self.graph.add('one2', parent='one')
+        self.failUnlessEqual(['one1', 'one2'], self.graph.children('one'))
+        self.failUnlessEqual('one', self.graph.parent('one1'))
+        self.failUnlessEqual(None, self.graph.parent('one'))
+
+    def test_iter_in_insertion_order(self):
+        for item in ['c', 'a', 'b']:
+            self.graph.add(item)
+        self.failUnlessEqual(['c', 'a', 'b'], list(self.graph))
+
+    def test_topological_order(self):
+        self.graph.add('page')
+        self.graph.add('block', parent='page')
+        self.graph.add('image')
+        # block also depends on image, already added as a root
+        self.graph.add_edge('block', 'image')
+        order = self.graph.topological_order()
+        self.failUnless(order.index('page') < order.index('block'))
+        self.failUnless(order.index('block') < order.index('image'))
+        self.failUnlessEqual(['image'], self.graph.edges('block'))
+        self.failUnlessEqual(['block'], self.graph.edges('page'))
+
+    def test_topological_order_with_cycle(self):
+        self.graph.add('one')
+        self.graph.add('two', parent='one')
+        self.graph.add_edge('two', 'one')
+        self.failUnlessEqual(['one', 'two'], self.graph.topological_order())
+
+    def test_deep_graph(self):
+        # no recursion limits for long chains
+        parent = None
+        for i in range(5000):
+            self.graph.add(i, parent=parent)
+            parent = i
+        nested = self.graph.nested_items()
+        depth = 0
+        while len(nested) == 2:
+            nested = nested[1]
+            depth += 1
+        self.failUnlessEqual(4999, depth)
+        self.failUnlessEqual(range(5000), self.graph.topological_order())
+        self.failUnlessEqual(range(5000), self.graph.ordered_items())
+
+    def test_nodes_have_slots(self):
+        self.graph.add('one')
+        node = self.graph._nodes['one']
+        self.failIf(hasattr(node, '__dict__'))
+
+    def test_components(self):
+        self.graph.add('page1')
+        self.graph.add('block1', parent='page1')
+        self.graph.add('page2')
+        self.graph.add('image')
+        self.graph.add('page3')
+        self.graph.add('block3', parent='page3')
+        # block3 and page1 both lead to image
+        self.graph.add_edge('block3', 'image')
+        self.graph.add_edge('page1', 'image')
+        self.failUnlessEqual([['page1', 'block1', 'image', 'page3', 'block3'],
+                              ['page2']],
+                             self.graph.components())
@@ -0,0 +1,204 @@
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.contrib.admin import AdminSite
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from publish.actions import rollback_selected, rollback_selected_runs
+from publish.admin import PublishableAdmin
+from publish.history import records_history
+from publish.models import Publishable, PublishException, PublishHistory
+from publish.tests.example_app.models import Story, StoryNote, FlatPage, \
+    Site, Page, PageBlock
+
+
+class dummy_request(object):
+    GET = {}
+
+    class user(object):
+        @classmethod
+        def has_perm(cls, *arg):
+            return True
+
+
+class TestPublishHistory(TestCase):
+
+    def setUp(self):
+        self.site1 = Site.objects.create(title='site 1', domain='one.com')
+        self.site2 = Site.objects.create(title='site 2', domain='two.com')
+        self.story = Story.objects.create(title='Story', body='body')
+        self.story.sites.add(self.site1)
+        self.note = StoryNote.objects.create(story=self.story, note='note')
+        self.story.publish()
+
+    def _story(self):
+        return Story.objects.get(pk=self.story.pk)
+
+    def _change(self, title):
+        story = self._story()
+        story.title = title
+        story.save()
+        return story
+
+    def test_created(self):
+        entries = PublishHistory.objects.all()
+        self.failUnlessEqual([PublishHistory.ACTION_CREATED] * 2,
+                             [entry.action for entry in entries])
+        self.failUnlessEqual(1, len(set(entry.run for entry in entries)))
+        self.failUnlessEqual({}, entries[0].values())
+
+    def test_changed_keeps_only_changes(self):
+        story = self._change('New Story')
+        story.sites.add(self.site2)
+        story.publish()
+
+        entry = PublishHistory.objects.filter(
+            action=PublishHistory.ACTION_CHANGED).get()
+        self.failUnlessEqual(unicode(self.story.pk), entry.object_id)
+        self.failUnlessEqual({'fields': {'title': 'Story'},
+                              'm2m': {'sites': [self.site1.pk]}},
+                             entry.values())
+        # stored compressed
+        self.failIf('Story' in entry.data)
+
+    def test_unchanged_not_recorded(self):
+        self._story().publish()
+        self.failUnlessEqual(2, PublishHistory.objects.count())
+
+    def test_rollback(self):
+        story = self._change('New Story')
+        story.sites.add(self.site2)
+        story.publish()
+        self._change('Newer Story').publish()
+
+        self.failUnlessEqual(1, self._story().rollback())
+        self.failUnlessEqual('New Story', self._story().public.title)
+
+        self.failUnlessEqual(1, self._story().rollback())
+        story = self._story()
+        self.failUnlessEqual('Story', story.public.title)
+        self.failUnlessEqual([self.site1], list(story.public.sites.all()))
+        self.failUnlessEqual(Publishable.PUBLISH_CHANGED,
+                             story.publish_state)
+        # undone entries are removed
+        self.failIf(PublishHistory.objects.filter(
+            action=PublishHistory.ACTION_CHANGED).exists())
+
+    def test_rollback_creation(self):
+        self._story().rollback()
+        story = self._story()
+        self.failUnless(story.public is None)
+        self.failUnlessEqual(Publishable.PUBLISH_CHANGED,
+                             story.publish_state)
+        self.failIf(Story.objects.published().exists())
+
+    def test_rollback_creation_of_parent(self):
+        # the note's public version goes with the story's, but its draft
+        # is kept, to be published again
+        self._story().rollback()
+        self.failIf(StoryNote.objects.published().exists())
+        note = StoryNote.objects.get(pk=self.note.pk)
+        self.failUnless(note.public is None)
+        self.failUnlessEqual(Publishable.PUBLISH_CHANGED, note.publish_state)
+
+        self._story().publish()
+        self.failUnlessEqual(1, StoryNote.objects.published().count())
+
+    def test_rollback_run(self):
+        Story.objects.get(pk=self.story.pk).delete()
+        Story.objects.deleted().publish()
+        self.failIf(Story.objects.draft_and_deleted().exists())
+        self.failIf(StoryNote.objects.draft_and_deleted().exists())
+        run = PublishHistory.objects.filter(
+            action=PublishHistory.ACTION_DELETED)[0].run
+
+        self.failUnlessEqual(2, PublishHistory.objects.rollback(run))
+        story = self._story()
+        self.failUnlessEqual('Story', story.title)
+        self.failUnlessEqual([self.site1], list(story.sites.all()))
+        self.failUnlessEqual('Story', story.public.title)
+        self.failUnlessEqual([self.site1], list(story.public.sites.all()))
+        note = StoryNote.objects.draft().get()
+        self.failUnlessEqual(story, note.story)
+        self.failUnlessEqual(story.public, note.public.story)
+
+    def test_rollback_to_time(self):
+        before = timezone.now()
+        PublishHistory.objects.update(published=before - timedelta(hours=1))
+        self._change('New Story').publish()
+        self._change('Newer Story').publish()
+
+        PublishHistory.objects.rollback(before)
+        self.failUnlessEqual('Story', self._story().public.title)
+        self.failUnlessEqual(2, PublishHistory.objects.count())
+
+    def test_rollback_needs_objects(self):
+        self.assertRaises(PublishException, PublishHistory.objects.rollback)
+
+    def test_bulk_publish_recorded(self):
+        self._change('New Story')
+        Story.objects.changed().publish(bulk=True)
+        entry = PublishHistory.objects.filter(
+            action=PublishHistory.ACTION_CHANGED).get()
+        self.failUnlessEqual({'fields': {'title': 'Story'}}, entry.values())
+
+        self._story().rollback()
+        self.failUnlessEqual('Story', self._story().public.title)
+
+    def test_not_recorded_without_publish_history(self):
+        FlatPage.objects.create(url='/url/', title='title').publish()
+        self.failUnlessEqual(2, PublishHistory.objects.count())
+
+    def test_only_recorded_when_needed(self):
+        page = Page.objects.create(slug='page', title='page')
+        PageBlock.objects.create(page=page, content='block')
+        page.publish()
+        page = Page.objects.get(pk=page.pk)
+        page.delete()
+        self.failIf(records_history([page]))
+        self.failUnless(records_history([self._story()]))
+        story = self._story()
+        story.delete()
+        self.failUnless(records_history([story]))
+
+    def test_prune(self):
+        for title in ('one', 'two', 'three'):
+            self._change(title).publish()
+        old = PublishHistory.objects.order_by('pk')[:2]
+        PublishHistory.objects.filter(pk__in=[entry.pk for entry in old]) \
+            .update(published=timezone.now() - timedelta(days=10))
+
+        self.failUnlessEqual(2, PublishHistory.objects.prune(
+            before=timezone.now() - timedelta(days=5), batch_size=1))
+        self.failUnlessEqual(2, PublishHistory.objects.prune(keep=1))
+        self.failUnlessEqual(['two'], [entry.values()['fields']['title']
+                                       for entry in PublishHistory.objects
+                                       .all()])
+
+    def test_prune_command(self):
+        self._change('New Story').publish()
+        out = StringIO()
+        call_command('prune_publish_history', keep=1, stdout=out)
+        self.failUnlessEqual('Deleted 1 history entries\n', out.getvalue())
+
+    def test_admin_actions(self):
+        messages = []
+        story_admin = PublishableAdmin(Story, AdminSite('Test Admin'))
+        story_admin.message_user = \
+            lambda request, message: messages.append(message)
+        self.failUnless('rollback_selected' in
+                        story_admin.get_actions(dummy_request))
+        self.failIf('rollback_selected' in PublishableAdmin(
+            FlatPage, AdminSite('Test Admin')).get_actions(dummy_request))
+
+        self._change('New Story').publish()
+        rollback_selected(story_admin, dummy_request, Story.objects.draft())
+        self.failUnlessEqual('Story', self._story().public.title)
+
+        # the whole publish of the story, notes and all
+        rollback_selected_runs(story_admin, dummy_request,
+                               Story.objects.draft())
+        self.failIf(Story.objects.published().exists())
+        self.failIf(StoryNote.objects.published().exists())
+        self.failUnlessEqual(2, len(messages))
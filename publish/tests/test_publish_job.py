@@ -0,0 +1,150 @@
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.contrib.admin import AdminSite
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from publish.actions import publish_selected
+from publish.admin import PublishableAdmin
+from publish.models import Publishable, PublishJob
+from publish.tests.example_app.models import Page, PageBlock
+
+
+class PageBlockAdmin(PublishableAdmin):
+    list_display = ['content']
+
+
+class TestPublishJob(TestCase):
+    def setUp(self):
+        super(TestPublishJob, self).setUp()
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.page2 = Page.objects.create(slug='page2', title='page 2')
+        self.block = PageBlock.objects.create(page=self.page1,
+                                              content='block')
+
+    def _run_worker(self):
+        call_command('publish_worker', once=True, batch_size=1,
+                     stdout=StringIO())
+
+    def test_enqueue(self):
+        self.failUnlessEqual(1, PublishJob.objects.enqueue(self.page1))
+        self.failUnlessEqual(0, Page.objects.published().count())
+
+        job = PublishJob.objects.get()
+        self.failUnlessEqual(PublishJob.STATUS_PENDING, job.status)
+        self.failUnlessEqual(str(self.page1.id), job.object_id)
+
+    def test_enqueue_merges_pending_jobs(self):
+        PublishJob.objects.enqueue(self.page1)
+        self.failUnlessEqual(1, PublishJob.objects.enqueue(
+            Page.objects.draft()))
+        self.failUnlessEqual(0, PublishJob.objects.enqueue([self.page1,
+                                                            self.page2]))
+        self.failUnlessEqual(2, PublishJob.objects.count())
+
+    def test_claim(self):
+        PublishJob.objects.enqueue(Page.objects.draft())
+        jobs = PublishJob.objects.claim(1)
+        self.failUnlessEqual(1, len(jobs))
+        self.failUnlessEqual(PublishJob.STATUS_RUNNING, jobs[0].status)
+        self.failUnless(jobs[0].started)
+        self.failUnlessEqual(1, len(PublishJob.objects.claim(5)))
+        self.failUnlessEqual([], PublishJob.objects.claim(5))
+
+    def test_claim_reclaims_stale_jobs(self):
+        PublishJob.objects.enqueue(Page.objects.draft())
+        PublishJob.objects.claim(5)
+        self.failUnlessEqual([], PublishJob.objects.claim(5, timeout=60))
+
+        # a worker died part way through the first job
+        PublishJob.objects.filter(object_id=str(self.page1.id)).update(
+            started=timezone.now() - timedelta(minutes=5))
+        jobs = PublishJob.objects.claim(5, timeout=60)
+        self.failUnlessEqual([str(self.page1.id)],
+                             [job.object_id for job in jobs])
+        self.failUnless(jobs[0].started > timezone.now() -
+                        timedelta(minutes=1))
+
+    def test_worker(self):
+        user = User.objects.create_user('test', 'test@example.com', 'test')
+        PublishJob.objects.enqueue(Page.objects.draft(), user=user)
+        self._run_worker()
+
+        self.failUnlessEqual(2, Page.objects.published().count())
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, page1.publish_state)
+        self.failUnlessEqual(1, page1.public.pageblock_set.count())
+        for job in PublishJob.objects.all():
+            self.failUnlessEqual(PublishJob.STATUS_DONE, job.status)
+            self.failUnless(job.duration() is not None)
+        self.failUnlessEqual(2, LogEntry.objects.filter(user=user).count())
+
+    def test_worker_records_errors(self):
+        PublishJob.objects.enqueue(self.page1)
+        self.page1.delete(mark_for_deletion=False)
+        PublishJob.objects.enqueue(self.page2)
+        self._run_worker()
+
+        job1, job2 = PublishJob.objects.all()
+        self.failUnlessEqual(PublishJob.STATUS_FAILED, job1.status)
+        self.failUnless('DoesNotExist' in job1.error)
+        self.failUnlessEqual(PublishJob.STATUS_DONE, job2.status)
+        self.failUnlessEqual(1, Page.objects.published().count())
+
+    def _background_request(self, messages, denied=()):
+        class dummy_request(object):
+            POST = {'post': True}
+
+            class user(object):
+                pk = None
+
+                @classmethod
+                def has_perm(cls, perm):
+                    return perm not in denied
+
+            class _messages(object):
+                @classmethod
+                def add(cls, *message):
+                    messages.append(message)
+
+        return dummy_request
+
+    def _background_admin(self):
+        admin_site = AdminSite('Test Admin')
+        admin_site.register(Page, PublishableAdmin)
+        admin_site.register(PageBlock, PageBlockAdmin)
+        page_admin = admin_site._registry[Page]
+        page_admin.publish_in_background = True
+        return page_admin
+
+    def test_publish_selected_in_background(self):
+        messages = []
+        response = publish_selected(self._background_admin(),
+                                    self._background_request(messages),
+                                    Page.objects.draft())
+        self.failUnless(response is None)
+        self.failUnless(messages)
+        self.failUnlessEqual(0, Page.objects.published().count())
+        self.failUnlessEqual(2, PublishJob.objects.filter(
+            status=PublishJob.STATUS_PENDING).count())
+
+    def test_publish_selected_in_background_needs_permission(self):
+        self.assertRaises(PermissionDenied, publish_selected,
+                          self._background_admin(),
+                          self._background_request(
+                              [], denied=['example_app.publish_page']),
+                          Page.objects.draft())
+        self.failIf(PublishJob.objects.exists())
+
+    def test_publish_selected_in_background_checks_related(self):
+        # page1 would publish its block, which the user can't publish
+        self.assertRaises(PermissionDenied, publish_selected,
+                          self._background_admin(),
+                          self._background_request(
+                              [], denied=['example_app.publish_pageblock']),
+                          Page.objects.draft())
+        self.failIf(PublishJob.objects.exists())
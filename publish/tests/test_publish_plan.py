@@ -0,0 +1,105 @@
+from django.db.models.signals import post_save
+from django.test import TestCase
+from publish.bulk import PublishPlan
+from publish.models import Publishable, PublishException
+from publish.tests.example_app.models import Page, PageBlock, Author
+
+
+class TestPublishPlan(TestCase):
+    def setUp(self):
+        super(TestPublishPlan, self).setUp()
+        self.page1 = Page.objects.create(slug='page1', title='page 1')
+        self.child1 = Page.objects.create(parent=self.page1, slug='child1',
+                                          title='Child 1')
+        self.block = PageBlock.objects.create(page=self.page1,
+                                              content='block')
+        self.author = Author.objects.create(name='author')
+        self.page1.authors.add(self.author)
+
+    def test_dry_run_returns_plan(self):
+        plan = self.child1.publish(dry_run=True)
+        self.failUnless(isinstance(plan, PublishPlan))
+        self.failUnlessEqual([self.child1, self.page1, self.author,
+                              self.block], list(plan))
+        self.failUnless(self.page1 in plan)
+        self.failUnlessEqual(0, Page.objects.published().count())
+
+    def test_plan_edges_and_values(self):
+        plan = self.page1.publish(dry_run=True)
+        list(plan)
+        self.failUnlessEqual([(self.page1, self.block)], plan.reverse)
+        self.failUnlessEqual([(self.page1.id, self.author.id)],
+                             plan.many_to_many[(Page, 'authors')])
+        self.failUnlessEqual('page 1',
+                             plan.values[(Page, self.page1.id)]['title'])
+
+        plan = self.child1.publish(dry_run=True)
+        list(plan)
+        self.failUnless((self.child1, Page._meta.get_field('parent'),
+                         (Page, self.page1.id)) in plan.foreign_keys)
+
+    def test_execute(self):
+        plan = Page.objects.filter(id=self.child1.id).publish(dry_run=True)
+        plan.execute()
+
+        child1 = Page.objects.get(id=self.child1.id)
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             child1.publish_state)
+        self.failUnlessEqual(page1.public, child1.public.parent)
+        self.failUnlessEqual([Author.objects.get(id=self.author.id).public],
+                             list(page1.public.authors.all()))
+        self.failUnlessEqual(1, page1.public.pageblock_set.count())
+
+    def test_execute_twice(self):
+        plan = self.page1.publish(dry_run=True)
+        plan.execute()
+        self.failUnlessRaises(PublishException, plan.execute)
+
+    def test_execute_draft_changed(self):
+        plan = self.page1.publish(dry_run=True)
+        list(plan)
+
+        page1 = Page.objects.get(id=self.page1.id)
+        page1.title = 'Changed'
+        page1.save()
+
+        self.failUnlessRaises(PublishException, plan.execute)
+        self.failUnlessEqual(0, Page.objects.published().count())
+
+    def test_execute_many_to_many_changed(self):
+        plan = self.page1.publish(dry_run=True)
+        list(plan)
+
+        self.page1.authors.clear()
+
+        self.failUnlessRaises(PublishException, plan.execute)
+
+    def _saved(self, plan):
+        saved = []
+
+        def handler(sender, instance, **kw):
+            saved.append(instance)
+
+        post_save.connect(handler, sender=Page)
+        try:
+            plan.execute()
+        finally:
+            post_save.disconnect(handler, sender=Page)
+        return saved
+
+    def test_execute_saves(self):
+        # the public versions and drafts are saved as usual
+        plan = Page.objects.filter(id=self.page1.id).publish(dry_run=True)
+        saved = self._saved(plan)
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnless(page1.public in saved)
+        self.failUnless(page1 in saved)
+
+    def test_execute_bulk(self):
+        plan = Page.objects.filter(id=self.page1.id).publish(dry_run=True,
+                                                             bulk=True)
+        self.failUnlessEqual([], self._saved(plan))
+        page1 = Page.objects.get(id=self.page1.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             page1.publish_state)
@@ -0,0 +1,137 @@
+from django.db import connections
+from django.test import TransactionTestCase
+from publish.models import PublishException
+from publish.replication import ReplicationResult
+from publish.tests.example_app.models import Page, PageBlock, Author, \
+    FlatPage, Site, Notice
+from publish.tests.helpers import _queries_run
+
+TARGETS = ['replica', 'replica2']
+
+
+class TestPublishToDatabases(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        super(TestPublishToDatabases, self).setUp()
+        self.page = Page.objects.create(slug='page', title='page')
+        self.block = PageBlock.objects.create(page=self.page,
+                                              content='block')
+        self.author = Author.objects.create(name='author')
+        self.page.authors.add(self.author)
+
+    def _public_pages(self, database):
+        return Page.objects.using(database).filter(is_public=True)
+
+    def test_publish(self):
+        results = Page.objects.draft().publish(databases=TARGETS)
+
+        self.failUnlessEqual(TARGETS, [result.database for result in results])
+        self.failUnless(all(isinstance(result, ReplicationResult)
+                            for result in results))
+        self.failUnlessEqual([None, None],
+                             [result.error for result in results])
+        self.failUnless(all(result.seconds >= 0 for result in results))
+
+        page = Page.objects.get(id=self.page.id)
+        self.failUnlessEqual(Page.PUBLISH_DEFAULT, page.publish_state)
+        for database in TARGETS:
+            public = self._public_pages(database).get()
+            self.failUnlessEqual(page.public_id, public.pk)
+            self.failUnlessEqual('page', public.title)
+            self.failUnlessEqual(['block'], [block.content for block in
+                                             public.pageblock_set.all()])
+            self.failUnlessEqual(['author'], [author.name for author in
+                                              public.authors.all()])
+            # the drafts stay where they are
+            self.failIf(Page.objects.using(database).filter(
+                is_public=False).exists())
+
+    def test_publish_changes(self):
+        Page.objects.draft().publish(databases=TARGETS)
+
+        page = Page.objects.get(id=self.page.id)
+        page.title = 'new title'
+        page.save()
+        page.authors.clear()
+        PageBlock.objects.get(id=self.block.id).delete()
+        PageBlock.objects.create(page=page, content='new block')
+        Page.objects.filter(id=page.id).publish(databases=TARGETS)
+
+        for database in TARGETS:
+            public = self._public_pages(database).get()
+            self.failUnlessEqual('new title', public.title)
+            self.failUnlessEqual(['new block'], [block.content for block in
+                                                 public.pageblock_set.all()])
+            self.failIf(public.authors.exists())
+            self.failUnlessEqual(1, PageBlock.objects.using(database)
+                                 .count())
+
+    def test_publish_deletions(self):
+        Page.objects.draft().publish(databases=TARGETS)
+        Page.objects.get(id=self.page.id).delete()
+        Page.objects.deleted().publish(databases=TARGETS)
+
+        self.failIf(Page.objects.exists())
+        for database in TARGETS:
+            self.failIf(self._public_pages(database).exists())
+            self.failIf(PageBlock.objects.using(database).exists())
+
+    def test_many_to_many_targets(self):
+        # non-publishable targets need to be in the other databases already
+        site = Site.objects.create(title='site', domain='site.com')
+        for database in TARGETS:
+            Site.objects.using(database).create(id=site.id, title='site',
+                                                domain='site.com')
+        flat_page = FlatPage.objects.create(url='/url/', title='title')
+        flat_page.sites.add(site)
+        FlatPage.objects.draft().publish(databases=TARGETS)
+
+        for database in TARGETS:
+            public = FlatPage.objects.using(database).get(is_public=True)
+            self.failUnlessEqual([site.id], [s.id for s in public.sites.all()])
+
+    def test_shadow_table(self):
+        Notice.objects.create(url='/notice/', title='notice')
+        Notice.objects.draft().publish(databases=TARGETS)
+
+        for database in TARGETS:
+            self.failIf(Notice.objects.using(database).exists())
+            self.failUnlessEqual(['notice'], list(
+                Notice.public_model().objects.using(database)
+                .values_list('title', flat=True)))
+
+    def test_failed_target(self):
+        cursor = connections['replica2'].cursor()
+        cursor.execute('ALTER TABLE example_app_pageblock RENAME TO moved')
+        try:
+            results = Page.objects.draft().publish(databases=TARGETS)
+        finally:
+            cursor = connections['replica2'].cursor()
+            cursor.execute('ALTER TABLE moved RENAME TO example_app_pageblock')
+
+        self.failUnlessEqual(None, results[0].error)
+        self.failUnless('example_app_pageblock' in results[1].error)
+        self.failUnlessEqual(1, self._public_pages('replica').count())
+        # nothing is left half done
+        self.failIf(self._public_pages('replica2').exists())
+        # and the source is still published
+        self.failUnlessEqual(1, Page.objects.published().count())
+
+    def test_unknown_database(self):
+        self.assertRaises(PublishException, Page.objects.draft().publish,
+                          databases=['replica', 'missing'])
+        self.failIf(Page.objects.published().exists())
+        self.failIf(self._public_pages('replica').exists())
+
+    def test_graph_loaded_once(self):
+        def source_queries(databases):
+            results, queries = _queries_run(
+                lambda: Page.objects.draft().publish(databases=databases))
+            return len(queries)
+
+        one = source_queries(['replica'])
+        Page.objects.all().delete()
+        Page.objects.using('replica').all().delete()
+        self.setUp()
+        self.failUnlessEqual(one, source_queries(TARGETS))
@@ -1,5 +1,11 @@
+from StringIO import StringIO
+
+from django.core.management.validation import get_validation_errors
+from django.db.models import get_app
 from django.test import TestCase
-from publish.tests.example_app.models import FlatPage
+from django.utils.unittest import skipUnless
+from publish.models import INDEX_TOGETHER
+from publish.tests.example_app.models import FlatPage, LandingPage
 
 
 class TestPublishableManager(TestCase):
@@ -84,6 +90,37 @@ class TestPublishableManager(TestCase):
                              set(FlatPage.objects.draft_and_deleted()))
         self.failUnlessEqual([self.flat_page2], list(FlatPage.objects.draft()))
 
+    def test_filters_are_positive(self):
+        # negated conditions can't use the (is_public, publish_state) index
+        for queryset in [FlatPage.objects.draft(), FlatPage.objects.changed(),
+                         FlatPage.objects.deleted(),
+                         FlatPage.objects.published(),
+                         FlatPage.objects.draft_and_deleted()]:
+            self.failIf(' NOT ' in str(queryset.query), str(queryset.query))
+
+    @skipUnless(INDEX_TOGETHER, 'index_together needs Django 1.5')
+    def test_composite_index(self):
+        self.failUnless(('is_public', 'publish_state') in
+                        FlatPage._meta.index_together)
+        # the columns are in FlatPage's table, not LandingPage's
+        self.failUnlessEqual([], list(LandingPage._meta.index_together))
+
+    def test_models_validate(self):
+        errors = StringIO()
+        self.failUnlessEqual(0, get_validation_errors(
+            errors, get_app('example_app')), errors.getvalue())
+
+    def test_multi_table_inheritance(self):
+        page = LandingPage.objects.create(url='/landing/', title='landing',
+                                          tagline='tagline')
+        page.publish()
+        page = LandingPage.objects.get(pk=page.pk)
+        page.tagline = 'new tagline'
+        page.save()
+        LandingPage.objects.changed().publish()
+        self.failUnlessEqual([('new tagline', '/landing/')], list(
+            LandingPage.objects.published().values_list('tagline', 'url')))
+
     def test_delete(self):
         # delete is overriden, so it marks the public instances
         self.flat_page1.publish()
@@ -0,0 +1,182 @@
+from django.db import transaction
+from django.db.models.signals import post_init
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from publish.cache import published_cache
+from publish.models import PublishException, PublishCacheGeneration
+from publish.tests.example_app.models import FlatPage, Page
+from publish.tests.helpers import _queries_run
+
+
+@override_settings(PUBLISH_CACHE_SIZE=3, PUBLISH_CACHE_CHECK_INTERVAL=0)
+class TestPublishedCache(TransactionTestCase):
+    def setUp(self):
+        published_cache.clear()
+        self.flat_page = FlatPage.objects.create(url='/url/', title='Title')
+        self.flat_page.publish()
+        self.public_id = self.flat_page.public_id
+
+    def tearDown(self):
+        published_cache.clear()
+
+    def _queries(self, func):
+        result, queries = _queries_run(func)
+        return result, len(queries)
+
+    def test_get_by_pk(self):
+        public = FlatPage.objects.get_published(pk=self.public_id)
+        self.failUnlessEqual(self.public_id, public.pk)
+        self.failUnless(public.is_public)
+        again = FlatPage.objects.get_published(id=self.public_id)
+        self.failUnless(public is again)
+        self.failUnlessEqual(1, published_cache.hits)
+        self.failUnlessEqual(1, published_cache.misses)
+
+    def test_get_by_key(self):
+        public = FlatPage.objects.get_published(url='/url/')
+        self.failUnlessEqual(self.public_id, public.pk)
+        self.failUnless(public is FlatPage.objects.get_published(url='/url/'))
+
+    def test_hit_only_checks_generations(self):
+        FlatPage.objects.get_published(url='/url/')
+        public, queries = self._queries(
+            lambda: FlatPage.objects.get_published(url='/url/'))
+        self.failUnlessEqual(1, queries)
+
+        with override_settings(PUBLISH_CACHE_CHECK_INTERVAL=60):
+            public, queries = self._queries(
+                lambda: FlatPage.objects.get_published(url='/url/'))
+        self.failUnlessEqual(0, queries)
+
+    def test_drafts_not_found(self):
+        self.assertRaises(FlatPage.DoesNotExist,
+                          FlatPage.objects.get_published,
+                          pk=self.flat_page.pk)
+
+    def test_invalid_lookup(self):
+        self.assertRaises(PublishException, FlatPage.objects.get_published,
+                          title='Title')
+        self.assertRaises(PublishException, FlatPage.objects.get_published,
+                          pk=self.public_id, url='/url/')
+
+    def test_publish_evicts(self):
+        FlatPage.objects.get_published(url='/url/')
+        FlatPage.objects.get_published(pk=self.public_id)
+
+        flat_page = FlatPage.objects.get(id=self.flat_page.id)
+        flat_page.url = '/new-url/'
+        flat_page.save()
+        flat_page.publish()
+        self.failUnlessEqual(0, published_cache.stats()['size'])
+
+        self.assertRaises(FlatPage.DoesNotExist,
+                          FlatPage.objects.get_published, url='/url/')
+        self.failUnlessEqual(
+            '/new-url/', FlatPage.objects.get_published(url='/new-url/').url)
+
+    def test_publish_only_evicts_published(self):
+        other = FlatPage.objects.create(url='/other/', title='Other')
+        other.publish()
+        FlatPage.objects.get_published(url='/url/')
+        FlatPage.objects.get_published(url='/other/')
+
+        other = FlatPage.objects.get(id=other.id)
+        other.title = 'New Title'
+        other.save()
+        FlatPage.objects.filter(id=other.id).publish(bulk=True)
+
+        self.failUnlessEqual(1, published_cache.stats()['size'])
+        self.failUnlessEqual('New Title',
+                             FlatPage.objects.get_published(url='/other/')
+                             .title)
+        FlatPage.objects.get_published(url='/url/')
+        self.failUnlessEqual(1, published_cache.hits)
+
+    def test_deletion_evicts(self):
+        FlatPage.objects.get_published(url='/url/')
+        self.flat_page.delete()
+        self.flat_page.publish()
+        self.assertRaises(FlatPage.DoesNotExist,
+                          FlatPage.objects.get_published, url='/url/')
+
+    def test_publish_changes_evicts(self):
+        FlatPage.objects.get_published(url='/url/')
+        flat_page = FlatPage.objects.get(id=self.flat_page.id)
+        flat_page.title = 'New Title'
+        flat_page.save()
+        flat_page.publish_changes()
+        self.failUnlessEqual(
+            'New Title', FlatPage.objects.get_published(url='/url/').title)
+
+    def test_publish_deletions_evicts(self):
+        FlatPage.objects.get_published(url='/url/')
+        flat_page = FlatPage.objects.get(id=self.flat_page.id)
+        flat_page.delete()
+        flat_page.publish_deletions()
+        self.assertRaises(FlatPage.DoesNotExist,
+                          FlatPage.objects.get_published, url='/url/')
+
+    def test_other_process_publish(self):
+        FlatPage.objects.get_published(url='/url/')
+        Page.objects.create(slug='page', title='Page').publish()
+        FlatPage.objects.get_published(url='/url/')
+        self.failUnlessEqual(1, published_cache.hits)
+
+        # as if another process had published a FlatPage
+        FlatPage.objects.published().update(title='New Title')
+        PublishCacheGeneration.objects.bump(FlatPage)
+        self.failUnlessEqual('New Title',
+                             FlatPage.objects.get_published(url='/url/')
+                             .title)
+
+    def test_publish_in_transaction(self):
+        old = FlatPage.objects.get_published(url='/url/')
+        with transaction.commit_on_success():
+            flat_page = FlatPage.objects.get(id=self.flat_page.id)
+            flat_page.title = 'New Title'
+            flat_page.save()
+            flat_page.publish()
+            # as if another thread, that can't see the publish yet, had
+            # just cached the old version
+            published_cache._add((FlatPage, 'url', '/url/'), old)
+        self.failUnlessEqual('New Title',
+                             FlatPage.objects.get_published(url='/url/')
+                             .title)
+
+    def test_evicted_while_missing(self):
+        # a publish evicting the object while it is being loaded
+        def handler(sender, instance, **kw):
+            post_init.disconnect(handler, sender=FlatPage)
+            published_cache.invalidate(FlatPage, [self.public_id])
+
+        post_init.connect(handler, sender=FlatPage)
+        try:
+            FlatPage.objects.get_published(url='/url/')
+        finally:
+            post_init.disconnect(handler, sender=FlatPage)
+        self.failUnlessEqual(0, published_cache.stats()['size'])
+
+    def test_lru_eviction(self):
+        for i in range(4):
+            FlatPage.objects.create(url='/%d/' % i, title='Title').publish()
+        FlatPage.objects.get_published(url='/0/')
+        FlatPage.objects.get_published(url='/1/')
+        FlatPage.objects.get_published(url='/2/')
+        FlatPage.objects.get_published(url='/0/')
+        FlatPage.objects.get_published(url='/3/')
+
+        stats = published_cache.stats()
+        self.failUnlessEqual(3, stats['size'])
+        self.failUnlessEqual(1, stats['evictions'])
+        # /1/ was the least recently used
+        FlatPage.objects.get_published(url='/0/')
+        FlatPage.objects.get_published(url='/1/')
+        self.failUnlessEqual(2, published_cache.stats()['hits'])
+        self.failUnlessEqual(5, published_cache.stats()['misses'])
+
+    def test_disabled(self):
+        with override_settings(PUBLISH_CACHE_SIZE=0):
+            FlatPage.objects.get_published(url='/url/')
+            FlatPage.objects.get_published(url='/url/')
+        self.failUnlessEqual(0, published_cache.stats()['size'])
+        self.failUnlessEqual(0, published_cache.hits)
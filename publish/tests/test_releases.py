@@ -0,0 +1,169 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.unittest import skipUnless
+from publish.cache import published_cache
+from publish.models import Publishable, PublishException, PublishRelease, \
+    ReleasedPublishable, INDEX_TOGETHER
+from publish.tests.example_app.models import Bulletin, LinkedBulletin, \
+    FlatPage, Site
+
+
+class TestReleases(TestCase):
+    def setUp(self):
+        self.site1 = Site.objects.create(title='site 1', domain='one.com')
+        self.site2 = Site.objects.create(title='site 2', domain='two.com')
+        self.bulletin = Bulletin.objects.create(slug='news', title='News')
+        self.bulletin.sites.add(self.site1)
+        self.release1 = PublishRelease.objects.create(name='first')
+        self.release2 = PublishRelease.objects.create(name='second')
+
+    def _titles(self, release=None):
+        return list(Bulletin.objects.published(release)
+                    .values_list('title', flat=True))
+
+    def _change(self, title):
+        bulletin = Bulletin.objects.get(id=self.bulletin.id)
+        bulletin.title = title
+        bulletin.save()
+        return bulletin
+
+    def test_publish_without_release(self):
+        self.bulletin.publish()
+        self.failUnlessEqual(['News'], self._titles())
+        public = Bulletin.objects.get(id=self.bulletin.id).public
+        self.failUnlessEqual(0, public.release_from)
+        self.failUnlessEqual(ReleasedPublishable.RELEASE_OPEN,
+                             public.release_to)
+
+    def test_release_goes_live_when_activated(self):
+        self.bulletin.publish(release=self.release1)
+        other = Bulletin.objects.create(slug='other', title='Other')
+        Bulletin.objects.filter(id=other.id).publish(release=self.release1)
+
+        bulletin = Bulletin.objects.get(id=self.bulletin.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             bulletin.publish_state)
+        self.failUnlessEqual([], self._titles())
+        self.failUnlessEqual(['News', 'Other'], self._titles(self.release1))
+
+        self.release1.activate()
+        self.failUnless(PublishRelease.objects.get(id=self.release1.id)
+                        .activated)
+        self.failUnless(self.release1.is_live())
+        self.failUnlessEqual(self.release1, PublishRelease.objects.live())
+        self.failUnlessEqual(['News', 'Other'], self._titles())
+
+    def test_live_release_read_when_queried(self):
+        self.bulletin.publish(release=self.release1)
+        self.release1.activate()
+        self._change('Latest News').publish(release=self.release2)
+
+        # e.g. the queryset of a generic view
+        prebuilt = Bulletin.objects.published() \
+            .values_list('title', flat=True)
+        self.failUnlessEqual(['News'], list(prebuilt))
+        self.release2.activate()
+        self.failUnlessEqual(['Latest News'], list(prebuilt.all()))
+
+    def test_changes_keep_earlier_release(self):
+        self.bulletin.publish(release=self.release1)
+        self.release1.activate()
+        old_public = Bulletin.objects.get(id=self.bulletin.id).public
+
+        bulletin = self._change('Latest News')
+        bulletin.sites.add(self.site2)
+        bulletin.publish(release=self.release2)
+
+        self.failUnlessEqual(['News'], self._titles())
+        self.failUnlessEqual(['Latest News'], self._titles(self.release2))
+
+        self.release2.activate()
+        self.failUnlessEqual(['Latest News'], self._titles())
+        self.failUnlessEqual(['News'], self._titles(self.release1))
+
+        new_public = Bulletin.objects.get(id=self.bulletin.id).public
+        self.failIf(new_public.pk == old_public.pk)
+        self.failUnlessEqual([self.site1], list(
+            Bulletin.objects.get(id=old_public.id).sites.all()))
+        self.failUnlessEqual([self.site1, self.site2],
+                             list(new_public.sites.order_by('id')))
+
+        # switching back is just moving the pointer
+        self.release1.activate()
+        self.failUnlessEqual(['News'], self._titles())
+
+    def test_republish_in_same_release(self):
+        self.bulletin.publish(release=self.release1)
+        self._change('Latest News').publish(release=self.release1)
+        self.failUnlessEqual(1, Bulletin.objects.filter(is_public=True)
+                             .count())
+        self.failUnlessEqual(['Latest News'], self._titles(self.release1))
+
+    def test_deletion_in_release(self):
+        self.bulletin.publish(release=self.release1)
+        self.release1.activate()
+
+        Bulletin.objects.get(id=self.bulletin.id).delete()
+        Bulletin.objects.deleted().publish(release=self.release2)
+        self.failIf(Bulletin.objects.draft_and_deleted().exists())
+        self.failUnlessEqual(['News'], self._titles())
+
+        self.release2.activate()
+        self.failUnlessEqual([], self._titles())
+        self.failUnlessEqual(['News'], self._titles(self.release1))
+
+    def test_deletion_of_unreleased_version(self):
+        self.bulletin.publish(release=self.release1)
+        Bulletin.objects.get(id=self.bulletin.id).delete()
+        Bulletin.objects.deleted().publish(release=self.release1)
+        self.failIf(Bulletin.objects.filter(is_public=True).exists())
+
+    def test_bulk_publish_in_release(self):
+        Bulletin.objects.create(slug='other', title='Other')
+        Bulletin.objects.draft().publish(bulk=True, release=self.release1)
+        self.failUnlessEqual([], self._titles())
+        self.failUnlessEqual(['News', 'Other'], self._titles(self.release1))
+
+    def test_plan_not_executed_in_release(self):
+        plan = Bulletin.objects.draft().publish(dry_run=True,
+                                                release=self.release1)
+        self.assertRaises(PublishException, plan.execute)
+
+    def test_older_release(self):
+        self.release2.activate()
+        self.assertRaises(PublishException, self.bulletin.publish,
+                          release=self.release1)
+        self.assertRaises(PublishException, Bulletin.objects.draft().publish,
+                          release=self.release1)
+
+    def test_unsupported(self):
+        self.assertRaises(PublishException, Bulletin.objects.draft().publish,
+                          release=self.release1, processes=2)
+        self.assertRaises(PublishException, FlatPage.objects.published,
+                          release=self.release1)
+        linked = LinkedBulletin.objects.create()
+        self.assertRaises(PublishException, linked.publish)
+
+    @skipUnless(INDEX_TOGETHER, 'index_together needs Django 1.5')
+    def test_index(self):
+        self.failUnless(('is_public', 'release_from', 'release_to') in
+                        [tuple(fields) for fields in
+                         Bulletin._meta.index_together])
+
+    @override_settings(PUBLISH_CACHE_SIZE=10, PUBLISH_CACHE_CHECK_INTERVAL=60)
+    def test_activation_clears_cache(self):
+        published_cache.clear()
+        try:
+            self.bulletin.publish()
+            self.failUnlessEqual(
+                'News', Bulletin.objects.get_published(slug='news').title)
+            self._change('Latest News').publish(release=self.release1)
+            self.failUnlessEqual(
+                'News', Bulletin.objects.get_published(slug='news').title)
+
+            self.release1.activate()
+            self.failUnlessEqual(
+                'Latest News',
+                Bulletin.objects.get_published(slug='news').title)
+        finally:
+            published_cache.clear()
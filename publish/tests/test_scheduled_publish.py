@@ -0,0 +1,115 @@
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from publish.models import Publishable
+from publish.scheduling import publish_due
+from publish.signals import pre_publish, post_publish
+from publish.tests.example_app.models import Event, EventSession
+from publish.tests.helpers import _queries_run
+
+
+class TestScheduledPublish(TestCase):
+    def setUp(self):
+        super(TestScheduledPublish, self).setUp()
+        self.now = timezone.now()
+        hour = timedelta(hours=1)
+        self.due = Event.objects.create(title='due',
+                                        publish_at=self.now - hour)
+        self.session = EventSession.objects.create(event=self.due,
+                                                   title='session')
+        self.later = Event.objects.create(title='later',
+                                          publish_at=self.now + hour)
+        self.unscheduled = Event.objects.create(title='unscheduled')
+
+    def test_publish_due(self):
+        published = []
+
+        def handler(sender, instance, **kw):
+            published.append(instance)
+
+        post_publish.connect(handler)
+        try:
+            self.failUnlessEqual(1, publish_due(now=self.now))
+        finally:
+            post_publish.disconnect(handler)
+
+        due = Event.objects.get(id=self.due.id)
+        self.failUnless(due.public)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, due.publish_state)
+        self.failUnless(due.publish_at is None)
+        self.failUnless(due.public.publish_at is None)
+        self.failUnlessEqual(1, due.public.eventsession_set.count())
+        self.failUnlessEqual(set([self.due, self.session]), set(published))
+
+        self.failIf(Event.objects.get(id=self.later.id).public)
+        self.failIf(Event.objects.get(id=self.unscheduled.id).public)
+
+        # nothing is due again until later
+        self.failUnlessEqual(0, publish_due(now=self.now))
+        self.failUnlessEqual(1, publish_due(now=self.now + timedelta(hours=2)))
+        self.failUnless(Event.objects.get(id=self.later.id).public)
+
+    def test_publish_due_in_batches(self):
+        for i in range(4):
+            Event.objects.create(title='due %d' % i,
+                                 publish_at=self.now - timedelta(minutes=i))
+        self.failUnlessEqual(5, publish_due(now=self.now, batch_size=2))
+        self.failUnlessEqual(5, Event.objects.published().count())
+
+    def test_nothing_due_is_one_query(self):
+        publish_due(now=self.now)
+        published, queries = _queries_run(
+            lambda: publish_due(models=[Event], now=self.now))
+        self.failUnlessEqual(1, len(queries))
+        self.failUnless('"publish_at" <=' in queries[0])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('publish_scheduled', stdout=out)
+        self.failUnless('Published 1' in out.getvalue())
+        self.failUnless(Event.objects.get(id=self.due.id).public)
+
+
+class TestScheduledPublishFailures(TransactionTestCase):
+    def setUp(self):
+        super(TestScheduledPublishFailures, self).setUp()
+        self.now = timezone.now()
+        self.broken = Event.objects.create(
+            title='broken', publish_at=self.now - timedelta(hours=2))
+        self.due = Event.objects.create(
+            title='due', publish_at=self.now - timedelta(hours=1))
+
+        def handler(sender, instance, **kw):
+            if instance == self.broken:
+                raise ValueError('broken')
+        self.handler = handler
+        pre_publish.connect(handler, sender=Event)
+
+    def tearDown(self):
+        pre_publish.disconnect(self.handler, sender=Event)
+        super(TestScheduledPublishFailures, self).tearDown()
+
+    def test_failure_does_not_hold_up_others(self):
+        failures = []
+        self.failUnlessEqual(1, publish_due(now=self.now, batch_size=1,
+                                            failures=failures))
+        self.failUnless(Event.objects.get(id=self.due.id).public)
+
+        # the failed draft is left due, to be tried again
+        broken = Event.objects.get(id=self.broken.id)
+        self.failIf(broken.public)
+        self.failUnless(broken.publish_at)
+        self.failUnlessEqual([broken], [obj for obj, error in failures])
+        self.failUnless('ValueError' in failures[0][1])
+
+    def test_failure_raised_without_failures(self):
+        self.assertRaises(ValueError, publish_due, now=self.now)
+
+    def test_command_reports_failure(self):
+        out, err = StringIO(), StringIO()
+        call_command('publish_scheduled', stdout=out, stderr=err)
+        self.failUnless('Published 1' in out.getvalue())
+        self.failUnless('Failed Event %d' % self.broken.id in err.getvalue())
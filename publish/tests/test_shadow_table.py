@@ -0,0 +1,127 @@
+from django.test import TestCase
+from publish.models import Publishable, PublishException
+from publish.tests.example_app.models import Notice, LinkedNotice, Site, \
+    FlatPage
+
+
+class TestShadowTable(TestCase):
+    def setUp(self):
+        self.site1 = Site.objects.create(title='site 1', domain='one.com')
+        self.site2 = Site.objects.create(title='site 2', domain='two.com')
+        self.notice = Notice.objects.create(url='/notice/', title='Notice')
+        self.notice.sites.add(self.site1, self.site2)
+        self.NoticePublic = Notice.public_model()
+
+    def test_public_model(self):
+        self.failIf(self.NoticePublic is Notice)
+        self.failUnless(FlatPage.public_model() is FlatPage)
+        self.failUnlessEqual('example_app_notice_public',
+                             self.NoticePublic._meta.db_table)
+        self.failUnless(Notice._meta.get_field('public').rel.to is
+                        self.NoticePublic)
+
+    def test_publish(self):
+        self.notice.publish()
+
+        notice = Notice.objects.get(id=self.notice.id)
+        public = notice.public
+        self.failUnless(isinstance(public, self.NoticePublic))
+        self.failUnless(public.is_public)
+        self.failUnlessEqual('Notice', public.title)
+        self.failUnlessEqual('/notice/', public.get_absolute_url())
+        self.failUnlessEqual(notice, public.draft)
+        self.failUnlessEqual([self.site1, self.site2],
+                             list(public.sites.order_by('id')))
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT,
+                             notice.publish_state)
+
+        # the draft table only has the draft
+        self.failUnlessEqual([notice], list(Notice.objects.all()))
+        self.failUnlessEqual([public], list(Notice.objects.published()))
+        self.failUnlessEqual([notice], list(Notice.objects.draft()))
+        self.failUnlessEqual([], list(Notice.objects.changed()))
+
+    def test_publish_changes(self):
+        self.notice.publish()
+        public_id = self.notice.public_id
+
+        notice = Notice.objects.get(id=self.notice.id)
+        notice.title = 'New Title'
+        notice.save()
+        notice.sites.remove(self.site1)
+        notice.publish()
+
+        public = self.NoticePublic.objects.get(id=public_id)
+        self.failUnlessEqual('New Title', public.title)
+        self.failUnlessEqual([self.site2], list(public.sites.all()))
+        self.failUnlessEqual(1, self.NoticePublic.objects.count())
+
+    def test_bulk_publish(self):
+        other = Notice.objects.create(url='/other/', title='Other')
+        Notice.objects.draft().publish(bulk=True)
+        self.failUnlessEqual(2, Notice.objects.published().count())
+
+        notice = Notice.objects.get(id=self.notice.id)
+        self.failUnlessEqual([self.site1, self.site2],
+                             list(notice.public.sites.order_by('id')))
+
+        other = Notice.objects.get(id=other.id)
+        other.title = 'New Title'
+        other.save()
+        Notice.objects.draft().publish(bulk=True)
+        self.failUnlessEqual(['New Title', 'Notice'],
+                             sorted(Notice.objects.published()
+                                    .values_list('title', flat=True)))
+
+    def test_publish_deletions(self):
+        self.notice.publish()
+        notice = Notice.objects.get(id=self.notice.id)
+        notice.delete()
+        self.failUnlessEqual([notice], list(Notice.objects.deleted()))
+        notice.publish()
+        self.failIf(Notice.objects.exists())
+        self.failIf(self.NoticePublic.objects.exists())
+
+    def test_bulk_publish_deletions(self):
+        Notice.objects.draft().publish()
+        Notice.objects.get(id=self.notice.id).delete()
+        Notice.objects.all().publish_deletions()
+        self.failIf(Notice.objects.exists())
+        self.failIf(self.NoticePublic.objects.exists())
+
+    def test_published_cache(self):
+        self.notice.publish()
+        public = Notice.objects.get_published(url='/notice/')
+        self.failUnless(isinstance(public, self.NoticePublic))
+
+    def test_filtered_published(self):
+        Notice.objects.create(url='/other/', title='Other')
+        Notice.objects.draft().publish()
+        public = Notice.objects.get(id=self.notice.id).public
+
+        self.failUnlessEqual([public], list(
+            Notice.objects.filter(title='Notice').published()))
+        self.failUnlessEqual([public], list(
+            Notice.objects.exclude(url='/other/').published()))
+        self.failUnlessEqual([], list(
+            Notice.objects.filter(title='None').published()))
+
+    def test_filter_published(self):
+        self.notice.publish()
+        public = Notice.objects.get(id=self.notice.id).public
+
+        self.failUnlessEqual([public], list(
+            Notice.objects.filter(Publishable.Q_PUBLISHED)))
+        self.failUnlessEqual([public], list(
+            Notice.objects.filter(title='Notice')
+            .filter(Publishable.Q_PUBLISHED).filter(url='/notice/')))
+        self.failUnlessEqual([], list(
+            Notice.objects.filter(Publishable.Q_PUBLISHED, title='None')))
+
+    def test_unknown_filters_published(self):
+        self.assertRaises(PublishException, Notice.objects.extra(
+            where=["title = 'Notice'"]).published)
+
+    def test_publishable_relations_not_supported(self):
+        notice = LinkedNotice.objects.create()
+        self.assertRaises(PublishException, notice.publish)
@@ -0,0 +1,124 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from publish.models import PublishException
+from publish.snapshot import export_published, import_published, read_index
+from publish.tests.example_app.models import Page, PageBlock, Author, \
+    FlatPage, Site, Notice
+
+
+class TestSnapshot(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.site = Site.objects.create(title='site', domain='site.com')
+        Site.objects.using('replica').create(id=self.site.id, title='site',
+                                             domain='site.com')
+
+        self.author = Author.objects.create(name='author')
+        for i in range(3):
+            page = Page.objects.create(slug='page%d' % i, title='page')
+            page.authors.add(self.author)
+            PageBlock.objects.create(page=page, content='block %d' % i)
+        flat_page = FlatPage.objects.create(url='/url/', title='title')
+        flat_page.sites.add(self.site)
+        notice = Notice.objects.create(url='/notice/', title='notice')
+        notice.sites.add(self.site)
+        for model in (Page, FlatPage, Notice):
+            model.objects.draft().publish()
+        # a draft that isn't published
+        Page.objects.create(slug='draft', title='draft')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestSnapshot, self).tearDown()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _check_imported(self):
+        pages = Page.objects.using('replica').order_by('slug')
+        self.failUnlessEqual(['page0', 'page1', 'page2'],
+                             [page.slug for page in pages])
+        self.failUnless(all(page.is_public for page in pages))
+        self.failUnlessEqual(
+            sorted(Page.objects.published().values_list('id', 'pub_date')),
+            sorted(pages.values_list('id', 'pub_date')))
+        for page in pages:
+            self.failUnlessEqual(['author'], [author.name for author in
+                                              page.authors.all()])
+            self.failUnlessEqual(1, page.pageblock_set.count())
+
+        flat_page = FlatPage.objects.using('replica').get()
+        self.failUnlessEqual([self.site.id],
+                             [site.id for site in flat_page.sites.all()])
+        notice = Notice.public_model().objects.using('replica').get()
+        self.failUnlessEqual([self.site.id],
+                             [site.id for site in notice.sites.all()])
+
+    def test_export_import(self):
+        path = self._path('snapshot.ndjson')
+        index = export_published(path, batch_size=2)
+
+        # 3 pages and their 3 authors rows
+        self.failUnlessEqual(6,
+                             index['models']['example_app.Page']['records'])
+        self.failUnlessEqual(index, read_index(path))
+        with open(path) as snapshot:
+            lines = snapshot.read().splitlines()
+        self.failUnless(all(json.loads(line) is not None for line in lines))
+
+        counts = import_published(path, batch_size=2, using='replica')
+        self.failUnlessEqual(6, counts['example_app.Page'])
+        self._check_imported()
+
+        # importing again updates rather than duplicates
+        import_published(path, using='replica')
+        self._check_imported()
+
+    def test_compressed(self):
+        path = self._path('snapshot.ndjson.gz')
+        index = export_published(path)
+        self.failUnless(index['compressed'])
+        lines = gzip.open(path).read().splitlines()
+        self.failUnless(any('"example_app.FlatPage"' in line
+                            for line in lines))
+
+        import_published(path, using='replica')
+        self._check_imported()
+
+    def test_index_offsets(self):
+        for name in ('snapshot.ndjson', 'snapshot.ndjson.gz'):
+            path = self._path(name)
+            export_published(path)
+            import_published(path, [FlatPage], using='replica')
+            self.failUnlessEqual(1, FlatPage.objects.using('replica')
+                                 .count())
+            self.failIf(Page.objects.using('replica').exists())
+            FlatPage.objects.using('replica').all().delete()
+
+    def test_only_models_given(self):
+        path = self._path('snapshot.ndjson')
+        index = export_published(path, [FlatPage])
+        self.failUnlessEqual(['example_app.FlatPage'], index['models'].keys())
+        self.assertRaises(PublishException, import_published, path, [Page],
+                          using='replica')
+
+    def test_commands(self):
+        path = self._path('snapshot.ndjson.gz')
+        out = StringIO()
+        call_command('publish_export', path, stdout=out)
+        self.failUnless('example_app.Page: 6 records\n' in out.getvalue())
+
+        out = StringIO()
+        call_command('publish_import', path, database='replica', stdout=out)
+        self.failUnless('example_app.Page: 6 records\n' in out.getvalue())
+        self._check_imported()
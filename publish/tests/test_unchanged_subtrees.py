@@ -0,0 +1,54 @@
+from django.test import TestCase
+from publish.models import Publishable
+from publish.tests.example_app.models import Page, PageBlock
+from publish.tests.helpers import _queries_run
+
+
+class TestUnchangedSubtrees(TestCase):
+    def _create_page(self, slug, blocks):
+        page = Page.objects.create(slug=slug, title=slug)
+        for i in range(blocks):
+            PageBlock.objects.create(page=page, content='block %d' % i)
+        page.publish()
+        return Page.objects.get(id=page.id)
+
+    def _republish_queries(self, page):
+        page.title = 'edited'
+        page.save()
+        public, queries = _queries_run(
+            lambda: Page.objects.get(id=page.id).publish())
+        return len(queries)
+
+    def test_unchanged_children_skipped(self):
+        small = self._republish_queries(self._create_page('small', 2))
+        large = self._republish_queries(self._create_page('large', 20))
+        self.failUnlessEqual(small, large)
+
+        page = Page.objects.get(slug='large', is_public=False)
+        self.failUnlessEqual('edited', page.public.title)
+        self.failUnlessEqual(20, page.public.pageblock_set.count())
+
+    def test_changed_children_published(self):
+        page = self._create_page('page', 3)
+        block = page.pageblock_set.all()[0]
+        block.content = 'changed'
+        block.save()
+        new_block = PageBlock.objects.create(page=page, content='new')
+
+        page.publish()
+        block = PageBlock.objects.get(id=block.id)
+        new_block = PageBlock.objects.get(id=new_block.id)
+        self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, block.publish_state)
+        self.failUnlessEqual('changed', block.public.content)
+        self.failUnless(new_block.public)
+        self.failUnlessEqual(4, page.public.pageblock_set.count())
+
+    def test_removed_children_tidied(self):
+        page = self._create_page('page', 3)
+        block = page.pageblock_set.all()[0]
+        public_id = block.public_id
+        block.delete(mark_for_deletion=False)
+
+        page.publish()
+        self.failIf(PageBlock.objects.filter(id=public_id).exists())
+        self.failUnlessEqual(2, page.public.pageblock_set.count())
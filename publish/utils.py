@@ -1,50 +1,307 @@
-class NestedSet(object):
+from django.db import connections, router, transaction
+from django.utils.datastructures import SortedDict
+
+# keep IN (...) clauses below the bound parameter limit of sqlite
+CHUNK_SIZE = 500
+
+
+def graph_key(item):
+    '''
+        key used to identify an item in a PublishGraph - model
+        instances are identified by (concrete model, pk), much as a
+        content type and object id would, anything else by itself
+    '''
+    opts = getattr(item, '_meta', None)
+    if opts is None or item.pk is None:
+        return item
+    return (getattr(opts, 'concrete_model', None) or item.__class__, item.pk)
+
+
+class _Node(object):
+    __slots__ = ('item', 'index', 'parent', 'children', 'edges')
+
+    def __init__(self, item, index, parent):
+        self.item = item
+        self.index = index
+        self.parent = parent
+        # lists are only created when needed, to keep nodes small
+        self.children = None
+        self.edges = None
+
+
+class PublishGraph(object):
     '''
-        a class that can be used a bit like a set,
-        but will let us store hiearchy too
+        the objects involved in a publish, indexed by graph_key() so
+        membership and original() lookups don't need to scan,
+        along with the parent/child relations between them.
+
+        can be used a bit like a set, iterating in the order items
+        were added.
     '''
 
     def __init__(self):
-        self._root_elements = []
-        self._children = {}
+        self._nodes = {}
+        self._order = []
+        self._roots = []
+        # related objects loaded ahead of the publish,
+        # keyed by (graph_key(item), relation name)
+        self.related = {}
+        self.prefetched = set()
+        # (item, deleted) for everything that gets the publish signals,
+        # used to send the batch signals at the end of a publish run
+        self.signalled = []
+        self.running = False
+        # the id of the PublishRelease being published to, if any
+        self.release = None
+        # identifies the publish run in the publish history
+        self.history_run = None
 
     def add(self, item, parent=None):
-        if parent is None:
-            self._root_elements.append(item)
+        parent_node = None
+        if parent is not None:
+            parent_node = self._nodes[graph_key(parent)]
+        node = _Node(item, len(self._order), parent_node)
+        self._nodes[graph_key(item)] = node
+        self._order.append(node)
+        if parent_node is None:
+            self._roots.append(node)
         else:
-            self._children[parent].append(item)
-        self._children[item] = []
+            if parent_node.children is None:
+                parent_node.children = []
+            parent_node.children.append(node)
+
+    def add_edge(self, parent, child):
+        '''
+            record that parent also depends on child, where child
+            was already added elsewhere in the graph
+        '''
+        parent_node = self._nodes[graph_key(parent)]
+        child_node = self._nodes[graph_key(child)]
+        if child_node is parent_node or child_node.parent is parent_node:
+            return
+        if parent_node.edges is None:
+            parent_node.edges = []
+        if child_node not in parent_node.edges:
+            parent_node.edges.append(child_node)
 
     def __contains__(self, item):
-        return item in self._children
+        return graph_key(item) in self._nodes
 
     def __len__(self):
-        return len(self._children)
+        return len(self._order)
 
     def __iter__(self):
-        return iter(self._children)
+        return (node.item for node in self._order)
 
     def original(self, item):
         # return the original item added
         # or this item if that's not the case
-        for child in self:
-            if child == item:
-                return child
-        return item
+        node = self._nodes.get(graph_key(item))
+        if node is None:
+            return item
+        return node.item
 
-    def _add_nested_items(self, items, nested):
-        for item in items:
-            nested.append(item)
-            children = self._nested_children(item)
-            if children:
-                nested.append(children)
+    def parent(self, item):
+        parent = self._nodes[graph_key(item)].parent
+        if parent is None:
+            return None
+        return parent.item
 
-    def _nested_children(self, item):
-        children = []
-        self._add_nested_items(self._children[item], children)
-        return children
+    def children(self, item):
+        children = self._nodes[graph_key(item)].children or []
+        return [child.item for child in children]
+
+    def edges(self, item):
+        '''
+            all the items this item leads to, both children and
+            items reached again from elsewhere
+        '''
+        node = self._nodes[graph_key(item)]
+        return [child.item for child in
+                (node.children or []) + (node.edges or [])]
 
     def nested_items(self):
+        '''
+            items as nested lists e.g. [root, [child, [grandchild]], root2]
+        '''
         items = []
-        self._add_nested_items(self._root_elements, items)
+        stack = [(iter(self._roots), items)]
+        while stack:
+            nodes, nested = stack[-1]
+            node = next(nodes, None)
+            if node is None:
+                stack.pop()
+                continue
+            nested.append(node.item)
+            if node.children:
+                children = []
+                nested.append(children)
+                stack.append((iter(node.children), children))
         return items
+
+    def ordered_items(self, since=0):
+        # items in the order they were reached, parents before children,
+        # optionally only those added after the first since items
+        ordered = []
+        stack = list(reversed(self._roots))
+        while stack:
+            node = stack.pop()
+            if node.index >= since:
+                ordered.append(node.item)
+            if node.children:
+                stack.extend(reversed(node.children))
+        return ordered
+
+    def topological_order(self):
+        '''
+            items ordered so every item comes before all the items it
+            leads to.  items that are part of a cycle follow in the
+            order they were added.
+        '''
+        incoming = [0] * len(self._order)
+        for node in self._order:
+            for child in (node.children or []) + (node.edges or []):
+                incoming[child.index] += 1
+
+        ordered = []
+        stack = [node for node in reversed(self._order)
+                 if not incoming[node.index]]
+        while stack:
+            node = stack.pop()
+            ordered.append(node.item)
+            for child in reversed((node.children or []) +
+                                  (node.edges or [])):
+                incoming[child.index] -= 1
+                if not incoming[child.index]:
+                    stack.append(child)
+
+        if len(ordered) < len(self._order):
+            ordered.extend(node.item for node in self._order
+                           if incoming[node.index] > 0)
+        return ordered
+
+    def components(self):
+        '''
+            the items split into groups that don't lead to each other
+            (so can be published independently), each in the order the
+            items were added
+        '''
+        groups = range(len(self._order))
+
+        def find(index):
+            while groups[index] != index:
+                groups[index] = groups[groups[index]]
+                index = groups[index]
+            return index
+
+        for node in self._order:
+            for child in (node.children or []) + (node.edges or []):
+                a, b = find(node.index), find(child.index)
+                if a != b:
+                    groups[max(a, b)] = min(a, b)
+
+        components = {}
+        ordered = []
+        for node in self._order:
+            group = find(node.index)
+            if group not in components:
+                components[group] = []
+                ordered.append(components[group])
+            components[group].append(node.item)
+        return ordered
+
+
+# the original name for the publish graph
+NestedSet = PublishGraph
+
+
+def chunked(items, size):
+    '''
+        split a sequence up into lists of at most size items
+    '''
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_update(objs, fields, batch_size=None, using=None):
+    '''
+        write the given fields of each of objs back to the database.
+        rather than issuing an UPDATE per object this issues one
+        UPDATE ... SET col = CASE pk WHEN ... END per batch of objects.
+        like QuerySet.update() this does not call save() or send any
+        signals.
+    '''
+    objs = [obj for obj in objs if obj.pk is not None]
+    if not objs or not fields:
+        return
+    model = objs[0].__class__
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+
+    if batch_size is None:
+        # stay well below the bound parameter limit (e.g. 999 in sqlite)
+        batch_size = max(1, 900 // (2 * len(fields) + 1))
+
+    # with multi-table inheritance each field's column is in the table
+    # of the parent it was declared on (which shares the primary key).
+    # fields of other models with the same columns (e.g. the draft model
+    # of a shadow table) are taken to be model's own
+    tables = SortedDict()
+    for field in fields:
+        owner = model._meta.concrete_model
+        if issubclass(owner, field.model):
+            owner = field.model._meta.concrete_model
+        tables.setdefault(owner, []).append(field)
+
+    cursor = connection.cursor()
+    for table_model, table_fields in tables.items():
+        opts = table_model._meta
+        pk_column = qn(opts.pk.column)
+        for batch in chunked(objs, batch_size):
+            assignments = []
+            params = []
+            for field in table_fields:
+                cases = []
+                for obj in batch:
+                    value = field.get_db_prep_save(
+                        field.pre_save(obj, False), connection=connection)
+                    cases.append('WHEN %s THEN %s')
+                    params.extend([obj.pk, value])
+                assignments.append('%s = CASE %s %s ELSE %s END' % (
+                    qn(field.column), pk_column, ' '.join(cases),
+                    qn(field.column)))
+            params.extend([obj.pk for obj in batch])
+            sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+                qn(opts.db_table), ', '.join(assignments), pk_column,
+                ', '.join(['%s'] * len(batch)))
+            cursor.execute(sql, params)
+    transaction.commit_unless_managed(using=using)
+
+
+def bulk_upsert(objs, batch_size=None, using=None):
+    '''
+        write objs (which all have their primary keys set) to the
+        database, inserting the ones that aren't there yet with
+        bulk_create and updating the others with bulk_update
+    '''
+    if not objs:
+        return
+    model = objs[0].__class__
+    manager = model._base_manager.db_manager(using)
+    if model._meta.parents:
+        # bulk_create can't handle multi-table inheritance
+        for obj in objs:
+            obj.save(using=manager.db)
+        return
+    existing = set()
+    for chunk in chunked([obj.pk for obj in objs], CHUNK_SIZE):
+        existing.update(manager.filter(pk__in=chunk)
+                        .values_list('pk', flat=True))
+    manager.bulk_create([obj for obj in objs if obj.pk not in existing],
+                        batch_size=batch_size)
+    bulk_update([obj for obj in objs if obj.pk in existing],
+                [field for field in model._meta.local_fields
+                 if not field.primary_key],
+                batch_size=batch_size, using=manager.db)